@@ -12,6 +12,12 @@ KEYWORD_GAME_DIR = 'SpyParty_directory'
 KEYWORD_PROGRESS_BAR = 'show_progress_bar'
 KEYWORD_QUERIED_SETS_DIR = 'queried_sets_folder'
 KEYWORD_QUERIED_SETS_DATA = 'queried_sets_data'
+KEYWORD_PARSE_WORKERS = 'parse_workers'
+KEYWORD_WATCH_INTERVAL = 'watch_interval'
+KEYWORD_IO_THREADS = 'io_threads'
+KEYWORD_SQL_CATALOG = 'sql_catalog'
+KEYWORD_PROFILE_SCANS = 'profile_scans'
+KEYWORD_EXPLAIN_QUERIES = 'explain_queries'
 
 # CWD / allows access to the config from project subdirectories
 __REPARTY_CONFIG_FILE = CWD / 'ReParty_config.json'
@@ -19,8 +25,20 @@ REPARTY_CONFIG = Config(__REPARTY_CONFIG_FILE, default_config=lambda: {
     KEYWORD_GAME_DIR: rf'{Path.home()}\AppData\Local\SpyParty',
     KEYWORD_PROGRESS_BAR: 1,
     KEYWORD_QUERIED_SETS_DIR: 'ReParty Queried Sets',
+    KEYWORD_PARSE_WORKERS: 0,  # processes used to parse new replays, 0 for one per CPU
+    KEYWORD_WATCH_INTERVAL: 5,  # seconds between checks for new replays, 0 to only look for them when querying
+    KEYWORD_IO_THREADS: 0,  # reads in flight when parsing in inode order, for slow disks and cold caches, 0 to not
+    KEYWORD_SQL_CATALOG: 0,  # mirror the index into an SQLite catalog, and run queries over the index through it
+    # run each query's scan under cProfile, dumping its stats to SCAN_PROFILE_FILE, and print startup timings
+    KEYWORD_PROFILE_SCANS: 0,
+    KEYWORD_EXPLAIN_QUERIES: 0,  # print each query's plan, which SCAN_METRICS_FILE keeps either way
     # KEYWORD_QUERIED_SETS_DATA: {}
 }, load_logging=True)
+REPLAY_INDEX_FILE = CWD / 'ReParty_index.pickle'
+REPLAY_CATALOG_FILE = CWD / 'ReParty_catalog.sqlite'
+THUMBNAILS_DIRECTORY = CWD / 'ReParty_thumbnails'
+SCAN_METRICS_FILE = CWD / 'ReParty_metrics.json'  # counters and stage timings of the last query
+SCAN_PROFILE_FILE = CWD / 'ReParty_scan.pstats'
 
 
 def SPYPARTY_DIRECTORY():
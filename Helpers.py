@@ -7,7 +7,9 @@ class Cleaner:
         self.func = clean_func
 
     def clean(self, text):
-        return self.cleaned.setdefault(text, self.func(text))
+        if (cleaned := self.cleaned.get(text)) is None:  # setdefault would call func even when it's remembered
+            cleaned = self.cleaned[text] = self.func(text)
+        return cleaned
 
 
 def font_verdana(size):
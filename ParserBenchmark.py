@@ -0,0 +1,194 @@
+import cProfile
+import pstats
+from argparse import ArgumentParser
+from io import StringIO
+from os import path
+from random import Random
+from tempfile import TemporaryDirectory
+from time import perf_counter
+from ReplayParser import ReplayParser
+from SpyPartyReplay import SpyPartyReplay
+from SyntheticReplays import FILE_VERSIONS, random_header, write_library
+
+
+def time_per_item(func, items, repeats=3):
+    """Best-of-repeats seconds taken to call func on each of items, divided by the number of items"""
+    best = float('inf')
+    for _ in range(repeats):
+        start = perf_counter()
+        for item in items:
+            func(item)
+        best = min(best, perf_counter() - start)
+    return best / len(items)
+
+
+def report(label, seconds, baseline=None):
+    speedup = f' ({baseline / seconds:.2f}x)' if baseline else ''
+    print(f'{label:<44}{seconds * 1e6:>9.2f} us/header {1 / seconds:>12,.0f} headers/s{speedup}')
+
+
+def attempt(func):
+    """func, returning rather than raising its exceptions, so that unreadable files don't end a run"""
+    def attempted(*args):
+        try:
+            return func(*args)
+        except Exception as e:
+            return e
+    return attempted
+
+
+def differences(replay, legacy):
+    """Names of the fields which a ReplayParser.Replay and a SpyPartyReplay of the same file disagree on"""
+    # SpyPartyReplay passes the display name as the Player's username and vice versa, so /steam is stripped from
+    # the username instead; ReplayParser strips it from the display name
+    def steamless(name):
+        return name[:-6] if name.endswith('/steam') else name
+
+    setup = legacy.get_game_type(), legacy.missions_required, legacy.missions_available
+    pairs = {
+        'uuid': (replay.uuid, legacy.uuid.split('=')[0]),
+        'playid': (replay.playid, legacy.playid),
+        'date': (replay.date, legacy.date),
+        'spy': (replay.spy, steamless(legacy.spy.username)),
+        'sniper': (replay.sniper, steamless(legacy.sniper.username)),
+        'spy_username': (steamless(replay.spy_username), legacy.spy.display_name),
+        'sniper_username': (steamless(replay.sniper_username), legacy.sniper.display_name),
+        'result': (replay.result, legacy.get_game_result()),
+        # the available missions of a known setup are the required ones
+        'setup': (replay.setup, '%s%d/%d' % (setup[0], setup[1], setup[1] if setup[0] == 'k' else setup[2])),
+        'venue': (replay.venue, legacy.venue),
+        'variant': (replay.variant, legacy.variant),
+        'guests': (replay.guests, legacy.guests),
+        'clock': (replay.clock, legacy.start_clock),
+        'duration': (replay.duration, legacy.duration),
+        'selected_missions': (replay.selected_missions, legacy.selected_missions),
+        'picked_missions': (replay.picked_missions, legacy.picked_missions),
+        'completed_missions': (replay.completed_missions, legacy.completed_missions),
+    }
+    return [field for field, (value, legacy_value) in pairs.items() if value != legacy_value]
+
+
+def check_equivalence(filepaths):
+    """Parse filepaths with both parsers, returning (files compared, files only one could parse, field mismatches)"""
+    parse, legacy_parse = attempt(ReplayParser().parse), attempt(SpyPartyReplay)
+    compared, unparsed, mismatches = 0, 0, {}
+    for filepath in filepaths:
+        replay, legacy = parse(filepath), legacy_parse(filepath)
+        if isinstance(replay, Exception) or isinstance(legacy, Exception):
+            unparsed += not (isinstance(replay, Exception) and isinstance(legacy, Exception))
+            continue
+        compared += 1
+        for field in differences(replay, legacy):
+            mismatches[field] = mismatches.get(field, 0) + 1
+    return compared, unparsed, mismatches
+
+
+def stage_costs(func, items, top=8):
+    """Seconds per item spent within each of the functions func spends the most of its own time in, via cProfile"""
+    profiler = cProfile.Profile()
+    profiler.enable()
+    for item in items:
+        func(item)
+    profiler.disable()
+    stats = pstats.Stats(profiler, stream=StringIO()).stats
+    costs = sorted(((tottime, pstats.func_std_string(function)) for function, (_, _, tottime, _, _) in stats.items()),
+                   reverse=True)
+    return [(label, tottime / len(items)) for tottime, label in costs[:top]]
+
+
+def library(directory, count, seed):
+    """Filepaths of a synthetic library of count replays in directory, only writing it if it isn't already there"""
+    marker = path.join(directory, f'library-{count}-{seed}.txt')
+    if path.exists(marker):
+        with open(marker) as f:
+            return f.read().splitlines()
+    filepaths = write_library(path.join(directory, f'{count}-{seed}'), count, seed=seed)
+    with open(marker, 'w') as f:
+        f.write('\n'.join(filepaths))
+    return filepaths
+
+
+def scaling(directory, sizes, seed, workers):
+    """Headers per second of each parser over libraries of growing size, every file being read once"""
+    hummus = ReplayParser()
+    parsers = (
+        ('SpyPartyReplay', lambda filepaths: list(map(attempt(SpyPartyReplay), filepaths))),
+        ('ReplayParser.parse', lambda filepaths: list(map(attempt(hummus.parse), filepaths))),
+        ('ReplayParser.parse_batch', hummus.parse_batch),
+        ('ReplayParser.parse_replays_parallel', lambda filepaths: list(
+            hummus.parse_replays_parallel(filepaths, workers=workers))),
+    )
+    print(f'{"replays":>10}' + ''.join(f'{label:>38}' for label, _ in parsers) + '   (headers/s)')
+    for size in sizes:
+        filepaths = library(directory, size, seed)
+        rates = []
+        for _, parse in parsers:
+            start = perf_counter()
+            parse(filepaths)
+            rates.append(size / (perf_counter() - start))
+        print(f'{size:>10,}' + ''.join(f'{rate:>38,.0f}' for rate in rates))
+
+
+def main():
+    arguments = ArgumentParser(description='Benchmark of ReplayParser and SpyPartyReplay header decoding.')
+    arguments.add_argument('-n', '--count', type=int, default=10000, help='headers per file version')
+    arguments.add_argument('--seed', type=int, default=0)
+    arguments.add_argument('--sizes', type=int, nargs='*', default=[1000, 10000],
+                           help='library sizes to measure scaling over, such as 1000 10000 100000 1000000')
+    arguments.add_argument('--directory', help='where to keep the libraries, so large ones are only written once '
+                                               '(default: a temporary directory)')
+    arguments.add_argument('-j', '--workers', type=int, help='processes for parse_replays_parallel')
+    options = arguments.parse_args()
+
+    hummus = ReplayParser()
+    rng = Random(options.seed)
+    print(f'{options.count} synthetic headers per version')
+    for version in FILE_VERSIONS:
+        headers = [random_header(rng, version=version) for _ in range(options.count)]
+        print(f'file version {version}')
+        report('  ReplayParser.decode (in memory)', time_per_item(hummus.decode, headers))
+
+    with TemporaryDirectory() as temporary:
+        directory = options.directory or temporary
+        print('\nequivalence of ReplayParser.parse and SpyPartyReplay')
+        versions = {}
+        for version in FILE_VERSIONS:
+            versions[version] = write_library(
+                path.join(temporary, f'v{version}'), options.count, options.seed, version=version)
+            compared, unparsed, mismatches = check_equivalence(versions[version])
+            verdict = 'identical' if compared and not mismatches else (
+                ', '.join(f'{field} x{count}' for field, count in mismatches.items()) or 'nothing comparable')
+            print(f'  file version {version}: {compared} compared, {unparsed} parsed by only one, {verdict}')
+
+        # one file version from disk, so that every stage sees the same headers
+        filepaths = versions[5]
+
+        def read_only(filepath):
+            with open(filepath, 'rb') as f:
+                f.read(1000)
+
+        print('\nfile version 5, from disk')
+        read = time_per_item(read_only, filepaths)
+        report('  open + read only', read)
+        # both decode through ReplayHeader, leaving the names, uuid and date until they're read
+        legacy = time_per_item(SpyPartyReplay, filepaths) - read
+        report('  SpyPartyReplay decoding (minus read)', legacy)
+        parse = time_per_item(hummus.parse, filepaths)
+        report('  ReplayParser.parse decoding (minus read)', parse - read, legacy)
+        report('  ReplayParser.parse', parse)
+        report('  ReplayParser.parse_batch', time_per_item(hummus.parse_batch, [filepaths]) / len(filepaths), parse)
+        # the reads are only ordered for cold caches and slow disks, so this measures their overhead on a warm one
+        report('  ReplayParser.parse_cold (warm cache)',
+               time_per_item(lambda paths: list(hummus.parse_cold(paths)), [filepaths]) / len(filepaths), parse)
+
+        for label, func in (('SpyPartyReplay.__init__', SpyPartyReplay), ('ReplayParser.parse', hummus.parse)):
+            print(f'\nstages of {label} (us/header, own time)')
+            for stage, seconds in stage_costs(func, filepaths):
+                print(f'  {seconds * 1e6:>9.2f}  {stage}')
+
+        print('\nscaling, mixed file versions warm page cache')
+        scaling(directory, options.sizes, options.seed, options.workers)
+
+
+if __name__ == '__main__':
+    main()
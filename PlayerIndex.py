@@ -0,0 +1,61 @@
+from collections import defaultdict
+from ReplayQuery import ROLE_SPY, ROLE_SNIPER, clean_player_name
+
+
+class PlayerIndex:
+    """Inverted index from cleaned player names to the rows (of a ReplayTable) they played each role in,
+    with an n-gram index so that partial names find their players without comparing against every name."""
+    GRAM_LENGTH = 3
+
+    def __init__(self):
+        self.names = []  # a player's id is their index, holding their cleaned name
+        self.__ids = {}  # cleaned name -> player id
+        self.__displayed = {}  # name as displayed -> player id, so each distinct name is only cleaned once
+        self.__grams = defaultdict(set)  # n-gram -> ids of the players whose cleaned names contain it
+        self.__rows = {ROLE_SPY: [], ROLE_SNIPER: []}  # role -> player id -> rows they played it in
+
+    def __len__(self):
+        return len(self.names)
+
+    def __player_id(self, cleaned):
+        if (player_id := self.__ids.get(cleaned)) is None:
+            player_id = self.__ids[cleaned] = len(self.names)
+            self.names.append(cleaned)
+            for gram in self.__split(cleaned):
+                self.__grams[gram].add(player_id)
+            for rows in self.__rows.values():
+                rows.append([])
+        return player_id
+
+    def __displayed_id(self, displayed):
+        if (player_id := self.__displayed.get(displayed)) is None:
+            player_id = self.__displayed[displayed] = self.__player_id(clean_player_name(displayed))
+        return player_id
+
+    @classmethod
+    def __split(cls, cleaned):
+        return {cleaned[i:i + cls.GRAM_LENGTH] for i in range(len(cleaned) - cls.GRAM_LENGTH + 1)}
+
+    def add(self, row, spy, sniper):
+        """Record that row's replay was played by spy and sniper (as displayed, they are cleaned here)"""
+        self.__rows[ROLE_SPY][self.__displayed_id(spy)].append(row)
+        self.__rows[ROLE_SNIPER][self.__displayed_id(sniper)].append(row)
+
+    def find(self, partial_name):
+        """ids of every player whose cleaned name contains the cleaned partial_name"""
+        partial_name = clean_player_name(partial_name)
+        if len(partial_name) < self.GRAM_LENGTH:  # too short for n-grams, but there are far fewer players than replays
+            return [player_id for player_id, name in enumerate(self.names) if partial_name in name]
+        postings = sorted((self.__grams.get(gram, ()) for gram in self.__split(partial_name)), key=len)
+        candidates = set(postings[0]).intersection(*postings[1:])
+        # sharing every n-gram doesn't guarantee that they are contiguous, so confirm each candidate
+        return sorted(player_id for player_id in candidates if partial_name in self.names[player_id])
+
+    def rows(self, partial_name, role):
+        """Rows played by any player matching partial_name, on role (or on either role for ROLE_EITHER)
+        :returns: generator of lists of rows, one per matching player and role
+        """
+        roles = (role,) if role in self.__rows else tuple(self.__rows)
+        for player_id in self.find(partial_name):
+            for played in roles:
+                yield self.__rows[played][player_id]
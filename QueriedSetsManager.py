@@ -1,7 +1,8 @@
+from threading import Thread
 from tkinter import Tk, Label, Entry, Button, Checkbutton, IntVar
 from Filepaths import get_queried_sets_directory
-from shutil import copy
 from Helpers import windows_filename_sanitizer
+from ReplayExporter import ReplayExporter
 
 
 class QueriedSetModal(Tk):
@@ -10,7 +11,8 @@ class QueriedSetModal(Tk):
 
         self.title('ReParty: Queried Set Generator')
         self.replays = replays
-        self.memory_saver = IntVar()
+        self.memory_saver = IntVar(self, value=0)  # linking is opt-in, so sets are copies unless asked
+        self.__exported = None  # (files done, total files), updated by the exporting thread
 
         Label(self, text='What would you like to call this replay set?').grid(row=1, columnspan=4)
         self.text_entry = Entry(self, width=40)
@@ -18,8 +20,8 @@ class QueriedSetModal(Tk):
         # todo sanitize in real time
 
         Button(self, text='Cancel', command=self.destroy, width=10).grid(row=4, column=0)
-        Checkbutton(self, text='Memory-saver mode?\n(Coming soon™)', variable=self.memory_saver, width=20).grid(
-            row=4, column=1, columnspan=2)
+        Checkbutton(self, text='Memory-saver mode?\n(link, rather than copy)', variable=self.memory_saver, width=20
+                    ).grid(row=4, column=1, columnspan=2)
         self.action_button = Button(self, text='Create', command=self.create_replay_sniper_set, width=10)
         self.action_button.grid(row=4, column=3)
         self.create_mode = True
@@ -47,21 +49,44 @@ class QueriedSetModal(Tk):
                 self.confirm_set(set_path)
 
     def confirm_set(self, directory):
-        self.__copy_replays_to_directory(directory)
-        # if self.memory_saver.get():
-        #     self.__move_replays_to_directory(directory)
-        # else:
-        #     self.__copy_replays_to_directory(directory)
-        self.action_button['text'] = 'Success!'
-        self.action_button['command'] = self.destroy
-
-    def __move_replays_to_directory(self, directory):
-        # todo memory saving: move the replays, remember where they came from, then move them back?
-        pass
-
-    def __copy_replays_to_directory(self, directory):
-        for replay in self.replays:
-            copy(replay.filepath, directory)
+        """Export the replays into directory on another thread, showing its progress on the action button"""
+        # memory saving links the replays where they can be, so the set takes up no more space than its directory
+        exporter = ReplayExporter(directory, link=bool(self.memory_saver.get()))
+        filepaths = [replay.filepath for replay in self.replays]
+        self.__exported = 0, len(filepaths)
+        self.action_button['state'] = 'disabled'
+        outcome = []
+
+        def export():
+            try:
+                outcome.append(exporter.export(filepaths, progress=self.__set_exported))
+            except Exception as e:  # handed to check_finished, which reports it
+                outcome.append(e)
+
+        thread = Thread(target=export, daemon=True)
+        thread.start()
+
+        def check_finished():
+            done, total = self.__exported
+            if thread.is_alive():
+                self.action_button['text'] = f'{done}/{total}'
+                self.after(100, check_finished)
+                return
+            self.action_button['state'] = 'normal'
+            if isinstance(result := outcome[0], Exception):
+                print(result)
+                reason = getattr(result, 'strerror', None) or result  # OSErrors say why without their filename
+                Label(self, text=f'Export failed: {reason}').grid(row=3, columnspan=4)
+                self.action_button['text'] = 'Retry?'
+                return
+            print(', '.join(f'{count} {method}' for method, count in result.items() if count))
+            self.action_button['text'] = 'Success!'
+            self.action_button['command'] = self.destroy
+
+        check_finished()
+
+    def __set_exported(self, done, total):
+        self.__exported = done, total
 
     # I am very wary of attempting to delete files. I would hate to make a mistake.
     # def __replace_replays_in_directory(self, directory):
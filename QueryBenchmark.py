@@ -0,0 +1,106 @@
+import tracemalloc
+from argparse import ArgumentParser
+from math import log
+from os import path
+from tempfile import TemporaryDirectory
+from time import perf_counter
+from ParserBenchmark import library
+from ReplayParser import ReplayParser
+from ReplayQuery import ReplayQuery, date_bound, ROLE_SPY, MWC_YES
+from ReplayTable import ReplayTable
+from ReplayRollups import ReplayRollups
+
+# queries as submit_query would build them: none at all, a player, a season, and a player with every other kind of
+# criterion
+QUERIES = {
+    'everything': ReplayQuery(),
+    'one player': ReplayQuery(right_player='player12'),
+    'one season': ReplayQuery(start=date_bound('2020-01'), end=date_bound('2020-03', end=True)),
+    'all criteria': ReplayQuery(left_player='player1', role=ROLE_SPY, venues={'Ballroom', 'Teien', 'Aquarium'},
+                                results={'Missions Win', 'Spy Shot'}, mwc=MWC_YES, missions={'Bug'}),
+}
+
+
+def measure(stage, memory):
+    """Run stage, returning (its result, seconds taken, peak bytes allocated or None).
+    Tracing allocations slows everything down, so when memory is wanted the stage is timed and traced separately."""
+    start = perf_counter()
+    result = stage()
+    seconds = perf_counter() - start
+    peak = None
+    if memory:
+        del result
+        tracemalloc.start()
+        result = stage()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return result, seconds, peak
+
+
+def end_to_end(directory, workers, memory):
+    """Time each stage of a query over the replays in directory, as ReParty runs it headless
+    :returns: {stage: (seconds, peak bytes)}
+    """
+    parser = ReplayParser()
+    timings = {}
+
+    def stage(label, func):
+        result, seconds, peak = measure(func, memory)
+        timings[label] = seconds, peak
+        return result
+
+    filepaths = stage('find_replays', lambda: ReplayParser.find_replays(directory))
+    replays = stage('parse', lambda: [
+        parsed for _, parsed in parser.parse_replays_parallel(filepaths, workers=workers)
+        if isinstance(parsed, ReplayParser.Replay)])
+    table = stage('build ReplayTable', lambda: ReplayTable(replays))
+    for name, query in QUERIES.items():
+        stage(f'criteria per replay, {name}', lambda: [replay for replay in replays if query.matches(replay)])
+        matched = stage(f'criteria as table mask, {name}', lambda: table.select(table.mask(query)))
+        stage(f'aggregate, {name}', lambda: ReplayRollups(matched))
+    return timings
+
+
+def main():
+    arguments = ArgumentParser(description='End to end benchmark of discovery, parsing, criteria and aggregation '
+                                           'over synthetic replay libraries of growing size, without any windows.')
+    arguments.add_argument('--sizes', type=int, nargs='*', default=[10000, 100000],
+                           help='library sizes, such as 10000 100000 1000000')
+    arguments.add_argument('--seed', type=int, default=0)
+    arguments.add_argument('--directory', help='where to keep the libraries, so large ones are only written once '
+                                               '(default: a temporary directory)')
+    arguments.add_argument('-j', '--workers', type=int, help='parsing processes (default: one per CPU)')
+    arguments.add_argument('--no-memory', action='store_true', help="don't trace peak memory, halving the run time")
+    options = arguments.parse_args()
+
+    with TemporaryDirectory() as temporary:
+        directory = options.directory or temporary
+        results = {}
+        for size in options.sizes:
+            library(directory, size, options.seed)  # written beneath directory/size-seed
+            results[size] = end_to_end(path.join(directory, f'{size}-{options.seed}'), options.workers,
+                                       not options.no_memory)
+            print(f'{size:,} replays done')
+
+    sizes = options.sizes
+    stages = list(results[sizes[0]])
+    print(f'\n{"wall time (s)":<44}' + ''.join(f'{size:>12,}' for size in sizes) + '   growth')
+    for label in stages:
+        seconds = [results[size][label][0] for size in sizes]
+        print(f'{label:<44}' + ''.join(f'{value:>12.3f}' for value in seconds) + growth(sizes, seconds))
+    if not options.no_memory:
+        print(f'\n{"peak memory (MB)":<44}' + ''.join(f'{size:>12,}' for size in sizes) + '   growth')
+        for label in stages:
+            peaks = [results[size][label][1] for size in sizes]
+            print(f'{label:<44}' + ''.join(f'{value / 2 ** 20:>12.1f}' for value in peaks) + growth(sizes, peaks))
+    print('\ngrowth is the exponent k of cost ~ size^k between the two largest sizes; above 1 stops scaling')
+
+
+def growth(sizes, costs):
+    if len(sizes) < 2 or not costs[-2] or not costs[-1]:
+        return ''
+    return f'{log(costs[-1] / costs[-2]) / log(sizes[-1] / sizes[-2]):>9.2f}'
+
+
+if __name__ == '__main__':
+    main()
@@ -1,39 +1,38 @@
-from collections import Counter
-from tkinter import Tk, Label, Button, Frame, ttk, Canvas, Menu
+from bisect import bisect_left
+from tkinter import Tk, Label, ttk, Menu
 # from Filepaths import ROLE_IMAGES
 # from PIL import Image, ImageTk
 
 from QueriedSetsManager import QueriedSetModal
 from SettingsModal import SettingsModal
-
-
-class WinRecord:
-    def __init__(self, wins=0, total=0):
-        self.num = wins
-        self.den = total
-
-    def __str__(self):
-        return f'{self.num}/{self.den}'
-
-    def win(self):
-        self.num += 1
-        self.den += 1
-
-    def loss(self):
-        self.den += 1
-
-    def __add__(self, other):
-        return WinRecord(self.num + other.num, self.den + other.den) if isinstance(other, WinRecord) else self
-
-    def percentage_string(self):
-        return f'{round(100 * self.num / self.den, 1)}%' if self.den else 'UNDEFINED'
+from ReplayRollups import ReplayRollups
 
 
 class QueryResultsDashboard(Tk):
-    def __init__(self, replays):
+    ROLE_STRS = {ReplayRollups.ROLE_SPY: 'Spy', ReplayRollups.ROLE_SNIPER: 'Sniper'}
+    # ROLE_FILENAMES = {ROLE_SPY: 'spy.png', ROLE_SNIPER: 'sniper.png'}
+    # __loaded_images = {}
+    COL_WIDTH_PLAYERS = 16
+    COL_WIDTH_ROLES = 6
+    COL_WIDTH_RESULTS = 9
+    CHARACTER_PIXELS = 8  # Treeview columns are sized in pixels rather than characters
+    COLUMN_PLAYER = 'Player'
+    COLUMN_ROLE = 'Role'
+    COLUMN_OVERALL = 'Overall'
+
+    def __init__(self, replays, complete=True, summary=None):
+        """
+        :param
+            replays (list): replays matching the query, which more can be added to with add_replays
+        :param
+            complete (bool): whether every result has already been found, otherwise finish is called once they are
+        :param
+            summary (ReplayRollups): rollups of exactly these replays if they are already kept, such as by the index,
+            which must not change while the dashboard is open
+        """
         Tk.__init__(self)
-        self.title('ReParty: Analysis Dashboard')
-        self.replays = replays
+        self.title('ReParty: Analysis Dashboard' if complete else 'ReParty: Analysis Dashboard (still searching...)')
+        self.replays = list(replays)
         # could TECHNICALLY filter these replays further and open another AnalysisDashboard!
         # todo for david (big fan): create window in more friendly positions
 
@@ -47,109 +46,164 @@ class QueryResultsDashboard(Tk):
         menu_file.add_command(label="Exit", command=self.destroy)
         toolbar.add_cascade(label="Menu", menu=menu_file)
 
-        ROLE_SNIPER = 1
-        ROLE_SPY = 2
-        ROLE_STRS = {ROLE_SPY: 'Spy', ROLE_SNIPER: 'Sniper'}
-        # ROLE_FILENAMES = {ROLE_SPY: 'spy.png', ROLE_SNIPER: 'sniper.png'}
-        # __loaded_images = {}
-
-        self.record = {}
-        self.players = Counter()
-        self.venues = Counter()  # could pass venue selection through to avoid recollection
-        player_played_role = set()
-        for replay in self.replays:
-            self.players[replay.sniper] += 1
-            self.players[replay.spy] += 1
-            self.venues[replay.venue] += 1
-            player_played_role.add((replay.sniper, ROLE_SNIPER))
-            player_played_role.add((replay.spy, ROLE_SPY))
-            if replay.sniper_win():
-                self.record.setdefault((replay.venue, replay.sniper, ROLE_SNIPER), WinRecord()).win()
-                self.record.setdefault((replay.venue, replay.spy, ROLE_SPY), WinRecord()).loss()
-            elif replay.spy_win():
-                self.record.setdefault((replay.venue, replay.sniper, ROLE_SNIPER), WinRecord()).loss()
-                self.record.setdefault((replay.venue, replay.spy, ROLE_SPY), WinRecord()).win()
+        self.summary = ReplayRollups(self.replays) if summary is None else summary
+        self.record = self.summary.record
+        self.players = self.summary.players
+        self.venues = self.summary.venues  # could pass venue selection through to avoid recollection
 
+        # a Treeview only draws the rows which are scrolled into view, so every player can be listed
         container = ttk.Frame(self)
-        canvas = Canvas(container)
-        scrollbar = ttk.Scrollbar(container, orient="vertical", command=canvas.yview)
-        scrollbar.pack(side="right", fill="y")
-        canvas.configure(yscrollcommand=scrollbar.set)
-
-        header = Frame(container)
-        header.pack(side='top')
-        scrollable_frame = ttk.Frame(canvas)
-        scrollable_frame.bind("<Configure>", lambda e: canvas.configure(scrollregion=canvas.bbox("all")))
-        canvas.create_window((0, 0), window=scrollable_frame, anchor="nw")
-        canvas.pack(side="left", fill="both", expand=True)
-        canvas.bind_all("<MouseWheel>", lambda event: canvas.yview_scroll(int(-1 * (event.delta / 120)), "units"))
-        container.pack()
-
-        COL_WIDTH_PLAYERS = 16
-        COL_WIDTH_ROLES = 6
-        COL_WIDTH_RESULTS = 9
-
-        Label(header, text='Player', width=COL_WIDTH_PLAYERS).grid(row=0, column=0)
-        Label(header, text='Role', width=COL_WIDTH_ROLES).grid(row=0, column=1)
-        ordered_venues = [v for v, _ in self.venues.most_common()]
-        venue_paddings = [COL_WIDTH_RESULTS + (len(v) - COL_WIDTH_RESULTS) // 2 for v in ordered_venues]
-
-        def hover_label(event):
-            label = event.widget
-            if record := labels[label]:
-                label['text'] = record.percentage_string()
-                label['bg'] = '#42b3f5'
-
-        def unhover_label(event):
-            label = event.widget
-            record = labels[label]
-            label['text'] = record
-            label['bg'] = 'SystemButtonFace'
-
-        COL_OFFSET = 3
-        # this approach avoids checking against this boolean P*V*2 times during the loops
-        if len(ordered_venues) > 1:
-            Label(header, text='Overall', width=COL_WIDTH_RESULTS).grid(row=0, column=2)
-            COL_OFFSET += 1
-
-            def add_row(player_, role_):
-                cumulative = WinRecord()
-                for index, venue_ in enumerate(ordered_venues):
-                    venue_wl = self.record.get((venue_, player_, role_))
-                    venue_label = Label(scrollable_frame, text=venue_wl, width=venue_paddings[index])
-                    labels[venue_label] = venue_wl
-                    venue_label.grid(row=row_num, column=index + COL_OFFSET)
-                    cumulative += venue_wl
-                cumulative_label = Label(scrollable_frame, text=cumulative, width=COL_WIDTH_RESULTS)
-                labels[cumulative_label] = cumulative
-                cumulative_label.grid(row=row_num, column=2)
-        else:  # however, it does lead to some repetitious code
-            def add_row(player_, role_):
-                for index, venue_ in enumerate(ordered_venues):
-                    venue_wl = self.record.get((venue_, player_, role_))
-                    venue_label = Label(scrollable_frame, text=venue_wl, width=venue_paddings[index])
-                    labels[venue_label] = venue_wl
-                    venue_label.grid(row=row_num, column=index + COL_OFFSET)
-
-        for i, venue in enumerate(ordered_venues):
-            Label(header, text=venue, width=venue_paddings[i]).grid(row=0, column=i + COL_OFFSET)
-
-        labels = {}
-        row_num = 1
-        for player, _ in self.players.most_common(40):  # todo too many results causes severe lag...
-            roles_played = 0
-            for ROLE in (role for role in (ROLE_SPY, ROLE_SNIPER) if (player, role) in player_played_role):
-                roles_played += 1
-                # img = Image.open(ROLE_IMAGES / ROLE_FILENAMES[ROLE]).resize((23, 27), Image.ANTIALIAS)
-                # phim = ImageTk.PhotoImage(img)
-                role_label = Label(scrollable_frame, text=ROLE_STRS[ROLE], width=COL_WIDTH_ROLES)
-                # role_label.image = phim
-                role_label.grid(row=row_num, column=1)
-                add_row(player, ROLE)
-                row_num += 1
-            Label(scrollable_frame, text=player, width=COL_WIDTH_PLAYERS
-                  ).grid(row=row_num - roles_played, column=0, rowspan=roles_played)
-
-        for record_label in labels:
-            record_label.bind('<Enter>', hover_label)
-            record_label.bind('<Leave>', unhover_label)
+        self.__tree = ttk.Treeview(container, show='headings', selectmode='browse', height=20)
+        scrollbar_y = ttk.Scrollbar(container, orient="vertical", command=self.__tree.yview)
+        scrollbar_x = ttk.Scrollbar(container, orient="horizontal", command=self.__tree.xview)
+        self.__tree.configure(yscrollcommand=scrollbar_y.set, xscrollcommand=scrollbar_x.set)
+        self.__tree.grid(row=0, column=0, sticky='nsew')
+        scrollbar_y.grid(row=0, column=1, sticky='ns')
+        scrollbar_x.grid(row=1, column=0, sticky='ew')
+        container.grid_rowconfigure(0, weight=1)
+        container.grid_columnconfigure(0, weight=1)
+        container.pack(fill='both', expand=True)
+        # what the hovered record is as a percentage, which the grid of labels used to show in place
+        self.__hovered = Label(self, anchor='w')
+        self.__hovered.pack(fill='x')
+        self.__tree.bind('<Motion>', self.__hover)
+        self.__tree.bind('<Leave>', lambda event: self.__hovered.configure(text=''))
+
+        self.__ordered_venues = []
+        self.__items = {}  # (player, role) -> Treeview item
+        self.__keys = {}  # Treeview item -> (player, role), as reading a row's values back would convert numeric names
+        self.__sorting = None, False  # (column, descending), None being by how often the player appears
+        self.__sort_key = None  # (player, role) -> what the rows are ordered by, for the current sorting
+        self.__sorting_reversed = False  # whether the rows are shown in the reverse of __ordered
+        self.__ordered = []  # (sort key, (player, role)) of every row, ascending, so rows can be placed by bisection
+        self.__row_keys = {}  # (player, role) -> its sort key when it was last placed
+        self.__populate()
+
+    def add_replays(self, replays):
+        """Add newly found results to the records, and update the rows they affect"""
+        self.replays.extend(replays)
+        for replay in replays:
+            self.summary.add(replay)
+        if set(self.venues) != set(self.__ordered_venues):  # a new column is needed
+            self.__populate()
+            return
+        roles = ReplayRollups.ROLE_SPY, ReplayRollups.ROLE_SNIPER
+        played = {player_role for replay in replays for player_role in zip((replay.spy, replay.sniper), roles)}
+        # a game in either role moves both of a player's rows when they're ordered by how often the player appears
+        affected = played.union((player, role) for player, _ in played for role in roles
+                                if (player, role) in self.__items)
+        tree = self.__tree
+        # only the affected rows are moved, each straight to where it belongs, rather than sorting every row again
+        for player_role in affected:
+            if (item := self.__items.get(player_role)) is None:
+                item = tree.insert('', self.__place(player_role), values=self.__values(*player_role))
+                self.__items[player_role] = item
+                self.__keys[item] = player_role
+            else:
+                tree.item(item, values=self.__values(*player_role))
+                tree.detach(item)  # so that the position is among the other rows, wherever this one was
+                tree.move(item, '', self.__place(player_role))
+
+    def finish(self, cancelled=False):
+        """Every result has been found, or the query was cancelled before they could be"""
+        self.title('ReParty: Analysis Dashboard (cancelled, partial results)' if cancelled
+                   else 'ReParty: Analysis Dashboard')
+
+    def __records(self, player, role):
+        """The player's WinRecord (or None) on role at each displayed venue, preceded by the overall one if shown"""
+        records = [self.record.get((venue, player, role)) for venue in self.__ordered_venues]
+        if len(records) > 1:
+            records.insert(0, self.summary.player_record(player, role))
+        return records
+
+    def __values(self, player, role):
+        return (player, self.ROLE_STRS[role], *('' if record is None else str(record)
+                                                for record in self.__records(player, role)))
+
+    def __populate(self):
+        """(Re)create the columns, and a row for every role each player has played"""
+        tree = self.__tree
+        tree.delete(*tree.get_children())
+        self.__ordered_venues = [v for v, _ in self.venues.most_common()]
+        columns = [self.COLUMN_PLAYER, self.COLUMN_ROLE]
+        if len(self.__ordered_venues) > 1:
+            columns.append(self.COLUMN_OVERALL)
+        columns.extend(self.__ordered_venues)
+        tree.configure(columns=columns)
+        widths = [self.COL_WIDTH_PLAYERS, self.COL_WIDTH_ROLES] + [
+            max(self.COL_WIDTH_RESULTS, len(column)) for column in columns[2:]]
+        for column, width in zip(columns, widths):
+            tree.heading(column, text=column, command=lambda c=column: self.__sort_by(c))
+            tree.column(column, width=width * self.CHARACTER_PIXELS, anchor='w' if column == columns[0] else 'center',
+                        stretch=False)
+
+        self.__items = {
+            (player, role): tree.insert('', 'end', values=self.__values(player, role))
+            for player, role in self.summary.player_played_role
+        }
+        self.__keys = {item: player_role for player_role, item in self.__items.items()}
+        self.__sort(*self.__sorting)
+
+    def __sort_by(self, column):
+        """Sort by a column's heading being clicked, a second click reversing the order"""
+        sorted_column, descending = self.__sorting
+        self.__sort(column, not descending if column == sorted_column else column != self.COLUMN_PLAYER)
+
+    def __sort(self, column, descending):
+        """Order the rows by column, or by how often each player appears if column is None.
+        Records are ordered by win percentage, then by games played, with empty cells last."""
+        self.__sorting = column, descending
+        role_order = {ReplayRollups.ROLE_SPY: 0, ReplayRollups.ROLE_SNIPER: 1}
+        if column is None:
+            def key(player_role):
+                player, role = player_role
+                return -self.players[player], player, role_order[role]
+            descending = False
+        elif column == self.COLUMN_PLAYER:
+            def key(player_role):
+                return player_role[0].lower(), role_order[player_role[1]]
+        elif column == self.COLUMN_ROLE:
+            def key(player_role):
+                return role_order[player_role[1]], player_role[0].lower()
+        else:
+            record_index = 0 if column == self.COLUMN_OVERALL else self.__ordered_venues.index(column) + (
+                len(self.__ordered_venues) > 1)
+            sign = -1 if descending else 1
+
+            def key(player_role):
+                record = self.__records(*player_role)[record_index]
+                if record is None or not record.den:
+                    return 1, 0, 0  # empty cells go last, whichever way the records are ordered
+                return 0, sign * record.num / record.den, sign * record.den
+            descending = False  # already in the key, as reversing it would put the empty cells first
+        self.__sort_key, self.__sorting_reversed = key, descending
+        self.__ordered = sorted((key(player_role), player_role) for player_role in self.__items)
+        self.__row_keys = {player_role: row_key for row_key, player_role in self.__ordered}
+        move = self.__tree.move
+        for position, (_, player_role) in enumerate(reversed(self.__ordered) if descending else self.__ordered):
+            move(self.__items[player_role], '', position)
+
+    def __place(self, player_role):
+        """Put a row which is new, or whose records have changed, where its sort key now belongs in the ordering
+        :returns: the row's position among the others in the Treeview
+        """
+        if (old := self.__row_keys.get(player_role)) is not None:
+            del self.__ordered[bisect_left(self.__ordered, (old, player_role))]
+        row_key = self.__row_keys[player_role] = self.__sort_key(player_role)
+        position = bisect_left(self.__ordered, (row_key, player_role))
+        self.__ordered.insert(position, (row_key, player_role))
+        return len(self.__ordered) - 1 - position if self.__sorting_reversed else position
+
+    def __hover(self, event):
+        tree = self.__tree
+        item, column = tree.identify_row(event.y), tree.identify_column(event.x)
+        text = ''
+        if item and column:
+            index = int(column[1:]) - 1  # columns are identified as #1, #2...
+            columns = tree['columns']
+            if index >= 2 and index < len(columns):
+                player, role = self.__keys[item]
+                if record := self.__records(player, role)[index - 2]:
+                    where = 'overall' if columns[index] == self.COLUMN_OVERALL else f'at {columns[index]}'
+                    text = f'{player} as {self.ROLE_STRS[role]} {where}: {record.percentage_string()}'
+        self.__hovered.configure(text=text)
@@ -1,33 +1,33 @@
+from time import perf_counter
+STARTED = perf_counter()  # so that the startup report includes the time spent importing
 from queue import Queue, Empty
-from threading import Thread
+from contextlib import closing
+from threading import Thread, Event
 from time import time
-from PIL import Image, ImageTk
 from Helpers import Cleaner, font_verdana, dialog_modal, lister
 from Filepaths import *
 from tkinter import Tk, Menu, Entry, Label, Button, Listbox, Frame, StringVar, IntVar
 # importing common UI elements and tk for CONSTANTS
 import tkinter as tk
 import tkinter.ttk as ttk
-from SettingsModal import SettingsModal
-from QueryResultsDashboard import QueryResultsDashboard
 from GameVars import game_result_list, venue_list, mission_list
 from ReplayParser import ReplayParser
+from ReplayIndex import ReplayIndex
+from ReplayCatalog import ReplayCatalog
+from ReplayWatcher import ReplayWatcher
+from ThumbnailCache import ThumbnailCache
+from ScanMetrics import ScanMetrics, STAGE_FIND, STAGE_CRITERIA, STAGE_DASHBOARD, COUNTER_FILES, COUNTER_CACHED, \
+    COUNTER_MATCHED
+from ReplayQuery import ReplayQuery, ROLE_EITHER, ROLE_SNIPER, ROLE_SPY, MWC_EITHER, MWC_YES, MWC_NO, \
+    clean_player_name, date_bound
 from os import listdir
-
-ROLE_EITHER = 'both'
-ROLE_SNIPER = 'sniper'
-ROLE_SPY = 'spy'
-
-MWC_EITHER = 'Either'
-# might be desirable
-# MWC_EXTRA = 'Overcompleted'
-MWC_YES = 'Yes'
-MWC_NO = 'No'
+from multiprocessing import freeze_support
 
 
 class ReParty(Tk):
     def __init__(self, VENUE_DISPLAY_WIDTH: int = 6):
         """Initialize User Interface"""
+        self.__startup = [('imports', perf_counter())]  # (stage, when it finished), for report_startup
 
         Tk.__init__(self)
         self.title('ReParty')
@@ -37,12 +37,16 @@ class ReParty(Tk):
         self._loaded_images = {}  # holds images in memory so they aren't garbage collected
 
         # might as well persist per session rather than per query, if the intent is to avoid recleaning multiple times
-        self.cleaner = Cleaner(lambda user: user.lower().replace(' ', ''))
+        self.cleaner = Cleaner(clean_player_name)
+        # headers are cached between queries (and sessions), so only new replays ever need to be parsed
+        self.index = ReplayIndex(REPLAY_INDEX_FILE)
+        # optionally mirrored into SQLite, which then answers queries over the index with one indexed SQL query
+        self.catalog = ReplayCatalog(REPLAY_CATALOG_FILE) if REPARTY_CONFIG[KEYWORD_SQL_CATALOG] else None
 
         toolbar = Menu(self)
         self.config(menu=toolbar)
         menu_file = Menu(toolbar, tearoff=0)
-        menu_file.add_command(label="Settings", command=lambda: SettingsModal().mainloop())
+        menu_file.add_command(label="Settings", command=self.open_settings)
         menu_file.add_separator()
         menu_file.add_command(label="Exit", command=self.on_window_close)
         toolbar.add_cascade(label="Menu", menu=menu_file)
@@ -52,6 +56,7 @@ class ReParty(Tk):
         container.grid_columnconfigure(0, weight=1)
 
         self.player_left, self.player_right = StringVar(), StringVar()
+        self.date_from, self.date_until = StringVar(), StringVar()
         self.progress = IntVar()
         self.query_in_progress = False
         self.displayed_venues = list(filter(lambda ven: ven.selected, venue_list))
@@ -79,13 +84,13 @@ class ReParty(Tk):
         (venues_frame := Frame(self.tabs)).pack()
         self.tabs.add(venues_frame, text='  Venues  ')
 
+        self.__startup.append(('window', perf_counter()))
         self.__venue_buttons = {}
         self.__loaded_images = {}
+        # resized once and then kept on disk, so PIL isn't even imported unless a venue's image has changed
+        thumbnails = ThumbnailCache(THUMBNAILS_DIRECTORY)
         for i, venue in enumerate(self.displayed_venues):
-            normal = Image.open(venue.get_image_path()).resize((160, 90), Image.ANTIALIAS)
-            thumb_color = ImageTk.PhotoImage(normal)
-            thumb_grey = ImageTk.PhotoImage(normal.convert('LA'))
-            self.__loaded_images[venue] = thumb_grey, thumb_color
+            self.__loaded_images[venue] = thumbnails.thumbnails(venue.get_image_path(), (160, 90), self)
             (v_butt := Button(
                 venues_frame,
                 command=lambda v=i: self.toggle_venue(v), width=160, height=90,
@@ -93,6 +98,7 @@ class ReParty(Tk):
                 background='#0a0' if venue.selected else '#a00', foreground='white', font=font_verdana(13)
             )).grid(row=i // VENUE_DISPLAY_WIDTH, column=i % VENUE_DISPLAY_WIDTH)
             self.__venue_buttons[venue] = v_butt
+        self.__startup.append(('thumbnails', perf_counter()))
 
         # todo this shall be replaced... v2: per venue A/B selection
         # i = len(self.displayed_venues)
@@ -131,6 +137,12 @@ class ReParty(Tk):
         self.combo_mwc.grid(row=6, column=4, sticky=tk.W, padx=6)
         self.combo_mwc.set(MWC_EITHER)
 
+        # YYYY, YYYY-MM or YYYY-MM-DD, such as a season or a tournament's window, and either may be left blank
+        Label(settings_frame, text='Played From').grid(row=7, column=3, sticky=tk.W, padx=6)
+        Entry(settings_frame, textvariable=self.date_from, width=10).grid(row=7, column=4, sticky=tk.W, padx=6)
+        Label(settings_frame, text='Played Until').grid(row=8, column=3, sticky=tk.W, padx=6)
+        Entry(settings_frame, textvariable=self.date_until, width=10).grid(row=8, column=4, sticky=tk.W, padx=6)
+
         Label(settings_frame, text='Replay Directories').grid(row=1, column=5, sticky=tk.W, padx=6)
         self.listbox_directories = Listbox(
             settings_frame, selectmode=tk.MULTIPLE, exportselection=False, width=25, height=8)
@@ -140,6 +152,15 @@ class ReParty(Tk):
         self.populate_listbox(self.listbox_directories, subdirectories)
         for default_dir in ('Matches', 'Spectations'):
             self.listbox_directories.selection_set(subdirectories.index(default_dir))
+        # new replays are indexed as they land in the selected directories, so queries over them needn't scan
+        self.watcher = None
+        if interval := REPARTY_CONFIG[KEYWORD_WATCH_INTERVAL]:
+            self.watcher = ReplayWatcher(
+                self.index, interval, workers=REPARTY_CONFIG[KEYWORD_PARSE_WORKERS] or None,
+                on_change=lambda indexed: self.query_in_progress or self.set_status(f'{indexed} Replays Indexed'))
+            self.listbox_directories.bind('<<ListboxSelect>>', lambda event: self.watch_selected_directories())
+            self.watch_selected_directories()
+            self.watcher.start()
 
         self.progress_bar_style = ttk.Style(self)
         self.progress_bar_style.layout(
@@ -152,6 +173,24 @@ class ReParty(Tk):
         # self.progress_bar_style.configure('LabeledProgressbar', bg='green')  # todo figure out bar color
         self.loading_bar = ttk.Progressbar(self, variable=self.progress, maximum=1, style='LabeledProgressbar')
         self.loading_bar.pack(side=tk.BOTTOM, fill=tk.X)
+        self.__startup.append(('widgets', perf_counter()))
+        if REPARTY_CONFIG[KEYWORD_PROFILE_SCANS]:  # a diagnostic, like the scan profiles
+            self.after_idle(self.report_startup)
+
+    def report_startup(self):
+        """Print how long each stage of starting up took, once the window has first been drawn"""
+        self.update_idletasks()
+        self.__startup.append(('first paint', perf_counter()))
+        previous = STARTED
+        for stage, finished in self.__startup:
+            print(f'{stage:<12} {(finished - previous) * 1000:>7.1f} ms')
+            previous = finished
+        print(f'interactive after {(previous - STARTED) * 1000:.1f} ms')
+
+    def open_settings(self):
+        from SettingsModal import SettingsModal  # not needed until it's opened
+
+        SettingsModal().mainloop()
 
     @staticmethod
     def populate_listbox(box: tk.Listbox, options: list):
@@ -164,6 +203,11 @@ class ReParty(Tk):
         for option in options:
             box.insert(tk.END, option)
 
+    def watch_selected_directories(self):
+        """Have the watcher keep the index current with the selected replay directories"""
+        self.watcher.watch(
+            REPLAYS_DIRECTORY() / self.listbox_directories.get(i) for i in self.listbox_directories.curselection())
+
     def set_status(self, text):
         """Update the Label embedded into the Progress Bar"""
         self.progress_bar_style.configure("LabeledProgressbar", text=text)
@@ -171,6 +215,14 @@ class ReParty(Tk):
     def on_window_close(self):
         """Save the user's config when when the window exits."""
         REPARTY_CONFIG.save()
+        if self.watcher is not None:
+            self.watcher.stop()
+        # unless a query or the watcher is still writing to the index, which saves it once it has finished
+        if not self.query_in_progress and self.index.lock.acquire(blocking=False):
+            self.index.save()
+            self.index.lock.release()
+        if self.catalog is not None:
+            self.catalog.close()
         self.destroy()
 
     def toggle_venue(self, venue_index):
@@ -198,53 +250,21 @@ class ReParty(Tk):
             self.scroll_setup_of.set(setup_any)
 
     def submit_query(self):
-        """Assemble a list of user-specified criteria to apply as a query"""
-        left_player = self.cleaner.clean(self.player_left.get())
-        right_player = self.cleaner.clean(self.player_right.get())
-        role_match = self.combo_role.get()
-        # print(left_player, right_player, role_match)
-
+        """Assemble the user-specified criteria into a query"""
         # todo v2 allow multiple player search, but for v1 just one plz
         # left_players, right_players = ({
         #     sanitized for pl in group.get().split(",")
         #     if (sanitized := cleaner.clean(pl))
         # } for group in (self.player_left, self.player_right))
 
-        criteria = []
-        if left_player and right_player:
-            if role_match == ROLE_EITHER:
-                criteria.append(lambda replay: right_player in self.cleaner.clean(replay.spy + replay.sniper))
-                criteria.append(lambda replay: left_player in self.cleaner.clean(replay.spy + replay.sniper))
-            elif role_match == ROLE_SNIPER:
-                criteria.append(lambda replay: right_player in self.cleaner.clean(replay.sniper))
-                criteria.append(lambda replay: left_player in self.cleaner.clean(replay.spy))
-            elif role_match == ROLE_SPY:
-                criteria.append(lambda replay: right_player in self.cleaner.clean(replay.spy))
-                criteria.append(lambda replay: left_player in self.cleaner.clean(replay.sniper))
-        elif right_player:
-            if role_match == ROLE_EITHER:
-                criteria.append(lambda replay: right_player in self.cleaner.clean(replay.spy + replay.sniper))
-            elif role_match == ROLE_SNIPER:
-                criteria.append(lambda replay: right_player in self.cleaner.clean(replay.sniper))
-            elif role_match == ROLE_SPY:
-                criteria.append(lambda replay: right_player in self.cleaner.clean(replay.spy))
-        elif left_player:
-            if role_match == ROLE_EITHER:
-                criteria.append(lambda replay: left_player in self.cleaner.clean(replay.spy + replay.sniper))
-            elif role_match == ROLE_SNIPER:
-                criteria.append(lambda replay: left_player in self.cleaner.clean(replay.spy))
-            elif role_match == ROLE_SPY:
-                criteria.append(lambda replay: left_player in self.cleaner.clean(replay.sniper))
-        # role_match is only relevant if one or more players are specified
-
         # if (setup_any := self.scroll_setup_any.get()) != "X":
         #     criteria.append(lambda rep: rep.setup[1] == setup_any)
         # if (setup_of := self.scroll_setup_of.get()) != "X":
         #     criteria.append(lambda rep: rep.setup[3] == setup_of)
 
         if venues_wanted := {v.name for v in self.displayed_venues if v.selected}:
-            if len(venues_wanted) < len(self.displayed_venues):  # don't add a criteria if any venue is ok
-                criteria.append(lambda rep: rep.venue in venues_wanted)
+            if len(venues_wanted) == len(self.displayed_venues):  # don't add a criteria if any venue is ok
+                venues_wanted = None
         else:
             dialog_modal("No venues selected.", "Please select at least one venue and try again.")
             return
@@ -255,105 +275,216 @@ class ReParty(Tk):
             dialog_modal("No directories selected.", "Please select at least one directory to search and try again.")
             return
 
-        # if missions_wanted:
-        #     criteria.append(lambda rep: len(missions_wanted - rep["completed_missions"]) == 0)
-        if results_wanted := {game_result_list[i] for i in self.listbox_results.curselection()}:
-            criteria.append(lambda replay: replay.result in results_wanted)
-
-        mwc_match = self.combo_mwc.get()
-        if mwc_match == MWC_YES:
-            criteria.append(lambda replay: len(replay.completed_missions) >= int(replay.setup[1]))
-        elif mwc_match == MWC_NO:
-            criteria.append(lambda replay: len(replay.completed_missions) < int(replay.setup[1]))
+        try:
+            start, end = date_bound(self.date_from.get()), date_bound(self.date_until.get(), end=True)
+        except ValueError as e:
+            dialog_modal("Invalid date.", f"{e}, please correct it and try again.")
+            return
 
-        print(len(criteria), 'criteria applied')
-        self.begin_query(criteria, directories_wanted)
+        query = ReplayQuery(
+            left_player=self.player_left.get(),
+            right_player=self.player_right.get(),
+            role=self.combo_role.get(),
+            venues=venues_wanted,
+            results={game_result_list[i] for i in self.listbox_results.curselection()},
+            mwc=self.combo_mwc.get(),
+            missions={mission_list[i].shortened for i in self.listbox_missions.curselection()},
+            start=start,
+            end=end
+        )
+        print(len(query), 'criteria applied')
+        self.begin_query(query, directories_wanted)
 
-    def begin_query(self, criteria, directories):
-        """Apply criteria to .replay files found in directories.
+    def begin_query(self, query, directories):
+        """Apply a query to .replay files found in directories, streaming matches into a dashboard as they're found.
         :param
-            criteria (list): list of lambda functions which, when passed a .replay file, returns a boolean
+            query (ReplayQuery): criteria which the replays must satisfy
         :param:
             directories (list): list of paths containing .replay files
         """
-        # todo with my improved threading knowledge, turn the disabled submit button into a cancel button!
         if self.query_in_progress:
             return
         self.query_in_progress = True
-        self.submission['state'] = tk.DISABLED  # prevent another load until the previous one has finished
+        # the submit button cancels the query until it has finished, which then hands back whatever was found
+        cancelled = Event()
+        self.submission.configure(text='Cancel', command=cancelled.set)
 
-        replays = []
-        hummus = ReplayParser()
         replay_dir = REPLAYS_DIRECTORY()
-        for subdir in directories:
-            # This part is relatively fast, so it is done first to set up the progress bar.
-            replays.extend(hummus.find_replays(replay_dir / subdir))
-        if not (count := len(replays)):
-            dialog_modal("Alert!", f"No replays were found in your {lister(directories)} folder(s).")
-            self.submission['state'] = tk.NORMAL
-            return
-
         using_progress_bar = REPARTY_CONFIG[KEYWORD_PROGRESS_BAR]
         self.progress.set(0)
+        if using_progress_bar:
+            # replays are parsed while they are still being found, so there's no total to measure progress against
+            self.loading_bar.configure(mode='indeterminate', maximum=50)
+            self.loading_bar.start()
+        index = self.index
+        catalog = self.catalog
+        workers = REPARTY_CONFIG[KEYWORD_PARSE_WORKERS] or None  # None for one per CPU
+        io_threads = REPARTY_CONFIG[KEYWORD_IO_THREADS]
+        clean = self.cleaner.clean
+        # where the query's time goes, shown once it's over and kept in SCAN_METRICS_FILE for a closer look
+        metrics = ScanMetrics()
+        profile_path = SCAN_PROFILE_FILE if REPARTY_CONFIG[KEYWORD_PROFILE_SCANS] else None
+        explaining = REPARTY_CONFIG[KEYWORD_EXPLAIN_QUERIES]
+
+        def __explain(explanation):
+            """Keep the query's plan for the metrics report, and print it too if the config asks for that"""
+            nonlocal explained
+            explained = explanation
+            if explaining:
+                print(explanation)
 
         def __threaded_parsing(output: Queue):
-            if using_progress_bar:
-                start = time()
-                blank = f'Matched %d / {count} (%d:%02d elapsed) '
-                self.loading_bar.configure(maximum=count)
-
-                results = []
-                i = 0
-                t = 1
-                while i < count:
-                    while i < count and time() - start < t:  # 1 second intervals
-                        try:
-                            parsed = hummus.parse(replays[i])
-                            if all(criterion(parsed) for criterion in criteria):
-                                results.append(parsed)
-                        except ReplayParser.ReplayParseException as e:
-                            print(e)
-                        i += 1
-                    # Remnant of v0, I don't remember what it does so hopefully it's not important... (lmao)
-                    # self.update_idletasks()
-
-                    self.set_status(blank % (len(results), t // 60, t % 60))
-                    self.progress.set(i)
-                    t += 1
-                output.put(results)
-            else:
-                self.set_status(f'Parsing {count} replays... ')
-                results = []
-                for replay in replays:
-                    try:
-                        parsed = hummus.parse(replay)
-                        if all(crit(parsed) for crit in criteria):
-                            results.append(parsed)
-                    except ReplayParser.ReplayParseException as er:
-                        print(er)
-                output.put(results)
-
+            """Puts (matches, None) for each batch found, then (last matches, scanned) once finished or cancelled"""
+            nonlocal summary
+            paths = [replay_dir / subdir for subdir in directories]
+            watcher = self.watcher
+            if watcher is not None and watcher.is_synced(paths):
+                # the index is already current with these directories, bar anything which has landed since the last poll
+                with metrics.stage(STAGE_FIND):
+                    watcher.poll()
+                    present = watcher.replays(paths)
+                metrics.count(COUNTER_FILES, len(present))
+                metrics.count(COUNTER_CACHED, len(present))
+                with index.lock:
+                    if not len(query) and index.within(set(present)):
+                        # the dashboard's records are those the index keeps of every replay, so needn't be recounted
+                        summary = index.rollups().copy()
+                    if catalog is not None:
+                        catalog.sync(index)
+                    else:
+                        table = index.table()
+                if catalog is not None:
+                    __explain(catalog.explain(query, paths))
+                    with metrics.stage(STAGE_CRITERIA):
+                        matches = catalog.replays(query, paths)
+                    output.put((matches, len(present)))
+                    return
+                plan = query.plan(table)
+                __explain(plan.explain())
+                with metrics.stage(STAGE_CRITERIA):
+                    matches = table.select(table.rows(present) & table.mask(query, plan))
+                output.put((matches, len(present)))
+                return
+
+            # replays which were already indexed are looked up in the query's mask over the table of them,
+            # while new ones are checked as they are parsed
+            batch = []
+            found = 0
+            scanned = 0
+            start = time()
+            sent = 0  # when the last batch was put, the first match going out at once
+            blank = 'Matched %d / %d scanned (%d:%02d elapsed) '
+            t = 1
+            failures = []  # summarized once the scan is over, rather than printed one by one
+            self.set_status('Scanning replays... ')
+            with index.lock:
+                table = index.table()
+                plan = query.plan(table)
+                __explain(plan.explain())
+                with metrics.stage(STAGE_CRITERIA):
+                    matched = table.mask(query, plan)
+                # closing the scan early stops the parsing processes, and leaves out pruning, which needs a full walk
+                # replays older than the query's date range can't match it, so new ones which are aren't even read
+                with closing(index.scan(paths, workers=workers, io_threads=io_threads, modified_since=query.start,
+                                        metrics=metrics)) as parsed_replays:
+                    for filepath, parsed in parsed_replays:
+                        if cancelled.is_set():
+                            break
+                        scanned += 1
+                        if isinstance(parsed, ReplayParser.ReplayParseException):
+                            failures.append(parsed)
+                            continue
+                        if (row := table.row(filepath)) is not None and table.replays[row] is parsed:
+                            if matched[row]:
+                                batch.append(parsed)
+                        else:
+                            with metrics.stage(STAGE_CRITERIA):
+                                if query.matches(parsed, clean):
+                                    batch.append(parsed)
+                        if batch and (now := time()) - sent >= 0.5:
+                            found += len(batch)
+                            output.put((batch, None))
+                            batch, sent = [], now
+                        if (elapsed := int(time() - start)) >= t:  # 1 second intervals
+                            self.set_status(blank % (found + len(batch), scanned, elapsed // 60, elapsed % 60))
+                            t = elapsed + 1
+                index.save()
+            if failures:
+                print(ReplayParser.failure_report(failures))
+            output.put((batch, scanned))
+
+        def __profiled_parsing(output: Queue):
+            with ScanMetrics.profiled(profile_path):  # only profiled if the config asks for it
+                try:
+                    __threaded_parsing(output)
+                except Exception:
+                    output.put(([], 0))  # still finish the query, so the submit button isn't left as Cancel
+                    raise
+
+        summary = None  # rollups of the results, if they happen to be kept already
+        explained = None  # the query's plan, for the metrics report
         q = Queue()
-        Thread(target=lambda: __threaded_parsing(q), daemon=True).start()  # Damon finally does something useful!
+        Thread(target=lambda: __profiled_parsing(q), daemon=True).start()  # Damon finally does something useful!
         # todo this doesn't have to be daemon?
+        dashboard = None
+        found = 0
 
         def __thread_finished_check():
+            nonlocal dashboard, found
+            new = []
+            scanned = None
             try:
-                results = q.get_nowait()
-                self.submission['state'] = tk.NORMAL
-                self.query_in_progress = False
-                if results:
-                    self.set_status(f'{len(results)} Replays Found')
-                    QueryResultsDashboard(results).mainloop()
-                else:
-                    self.set_status('No Replays Found')
-            except Empty:  # the Queue has not had results inserted yet, wait longer
-                self.after(1000, __thread_finished_check)
+                while scanned is None:
+                    replays, scanned = q.get_nowait()
+                    new.extend(replays)
+            except Empty:  # every batch put so far has been taken, check for more later
+                pass
+            if new:
+                found += len(new)
+                try:
+                    with metrics.stage(STAGE_DASHBOARD):
+                        if dashboard is None:
+                            from QueryResultsDashboard import QueryResultsDashboard  # not needed until the first query
+
+                            dashboard = QueryResultsDashboard(new, complete=scanned is not None, summary=summary)
+                        elif dashboard.winfo_exists():
+                            dashboard.add_replays(new)
+                except tk.TclError:  # the dashboard was closed while it was still being filled
+                    pass
+            if scanned is None:
+                self.after(250, __thread_finished_check)
+                return
+
+            self.submission.configure(text='Submit', command=self.submit_query)
+            self.query_in_progress = False
+            if using_progress_bar:
+                self.loading_bar.stop()
+                self.loading_bar.configure(mode='determinate', maximum=1)
+                self.progress.set(1)
+            try:
+                if dashboard is not None and dashboard.winfo_exists():
+                    dashboard.finish(cancelled.is_set())
+            except tk.TclError:
+                pass
+            metrics.count(COUNTER_MATCHED, found)
+            metrics.save(SCAN_METRICS_FILE, directories=list(directories), criteria=len(query), plan=explained,
+                         cancelled=cancelled.is_set())
+            measured = f' | {metrics.summary()}'
+            if cancelled.is_set():
+                self.set_status(f'Cancelled, {found} Replays Found in {scanned} Scanned{measured}')
+            elif not scanned:
+                self.set_status('No Replays Found')
+                dialog_modal("Alert!", f"No replays were found in your {lister(directories)} folder(s).")
+            elif found:
+                self.set_status(f'{found} Replays Found{measured}')
+            else:
+                self.set_status(f'No Replays Found{measured}')
 
-        self.after(1500, __thread_finished_check)
+        self.after(100, __thread_finished_check)
 
 
 def main():
+    freeze_support()  # parsing processes re-enter the frozen executable, which must hand them back to multiprocessing
     try:
         ReParty().mainloop()
     except Exception as e:
@@ -0,0 +1,265 @@
+import csv
+import json
+import sys
+from argparse import ArgumentParser
+from contextlib import redirect_stdout
+from inspect import signature
+from pathlib import Path
+from ReplayParser import ReplayParser
+from ReplayIndex import ReplayIndex
+from ReplayCatalog import ReplayCatalog
+from ScanMetrics import ScanMetrics, STAGE_FIND, STAGE_CRITERIA, COUNTER_FILES, COUNTER_PARSED, COUNTER_FAILURES, \
+    COUNTER_MATCHED
+from ReplayQuery import ReplayQuery, date_bound, ROLE_EITHER, ROLE_SNIPER, ROLE_SPY, MWC_EITHER, MWC_YES, MWC_NO
+
+FORMAT_JSONL = 'jsonl'
+FORMAT_CSV = 'csv'
+
+# the keys of Replay.to_dictionary, each of which can be renamed or dropped
+DICTIONARY_KEYS = tuple(signature(ReplayParser.Replay.to_dictionary).parameters)[1:]
+
+
+def dictionary_keys(fields=None, renames=()):
+    """Keyword arguments for Replay.to_dictionary, keeping only fields (all if None) and renaming as given
+    :param
+        renames (iterable): 'key=name' strings
+    """
+    keys = {key: key if fields is None or key in fields else None for key in DICTIONARY_KEYS}
+    for rename in renames:
+        key, _, name = rename.partition('=')
+        if key not in keys:
+            raise ValueError(f'"{key}" is not one of {", ".join(DICTIONARY_KEYS)}')
+        keys[key] = name
+    return keys
+
+
+class JsonLinesWriter:
+    def __init__(self, stream):
+        self.stream = stream
+
+    def write(self, row):
+        self.stream.write(json.dumps(row) + '\n')
+
+
+class CsvWriter:
+    """Writes the header from the first row, with lists of missions joined by semicolons"""
+    def __init__(self, stream):
+        self.stream = stream
+        self.writer = None
+
+    def write(self, row):
+        row = {key: ';'.join(value) if isinstance(value, list) else value for key, value in row.items()}
+        if self.writer is None:
+            self.writer = csv.DictWriter(self.stream, fieldnames=list(row), lineterminator='\n')
+            self.writer.writeheader()
+        self.writer.writerow(row)
+
+
+WRITERS = {FORMAT_JSONL: JsonLinesWriter, FORMAT_CSV: CsvWriter}
+
+
+def recent_entries(directories, modified_since=None):
+    """Generator of an os.DirEntry for each .replay beneath directories, leaving out those last modified before
+    modified_since. Files which can't be stat'ed are left in, so that parsing them reports them as unreadable."""
+    for directory in directories:
+        for entry in ReplayParser.scan_replays(directory):
+            if modified_since is not None:
+                try:
+                    if entry.stat().st_mtime < modified_since:
+                        continue
+                except OSError:  # such as a replay deleted since it was listed
+                    pass
+            yield entry
+
+
+def matching_replays(plan, directories, index=None, workers=None, io_threads=0, modified_since=None, failures=None,
+                     metrics=None):
+    """Stream the replays beneath directories which satisfy a query, as they are decoded
+    :param
+        plan (QueryPlan): the query's plan, for checking one replay at a time
+    :param
+        index (ReplayIndex): index to read headers from and bring up to date, or None to parse every replay
+    :param
+        io_threads (int): reads in flight when reading headers in inode order, or 0 to read them in turn
+    :param
+        modified_since (int): timestamp the query's replays were played from, so older files needn't be read
+    :param
+        failures (list): where to put the ReplayParseExceptions of replays which couldn't be parsed
+    :param
+        metrics (ScanMetrics): to count the files in and time each stage in, if given
+    :returns: generator of Replays
+    """
+    if index is not None:
+        parsed_replays = index.scan(directories, workers=workers, io_threads=io_threads, modified_since=modified_since,
+                                    metrics=metrics)
+    else:
+        parser = ReplayParser()
+        entries = recent_entries(directories, modified_since)
+        if metrics is not None:
+            entries = metrics.timed(entries, STAGE_FIND)
+        parsed_replays = parser.parse_replays_parallel(entries, workers, io_threads=io_threads, metrics=metrics)
+    for _, parsed in parsed_replays:
+        failed = isinstance(parsed, ReplayParser.ReplayParseException)
+        if index is None and metrics is not None:  # which the index counts for itself
+            metrics.count(COUNTER_FILES)
+            metrics.count(COUNTER_FAILURES if failed else COUNTER_PARSED)
+        if failed:
+            if failures is not None:
+                failures.append(parsed)
+        elif metrics is None:
+            if plan.matches(parsed):
+                yield parsed
+        else:
+            with metrics.stage(STAGE_CRITERIA):
+                matched = plan.matches(parsed)
+            if matched:
+                yield parsed
+
+
+def main(args=None):
+    arguments = ArgumentParser(description='Query SpyParty replays without the interface, '
+                                           'streaming each match as a JSON line or CSV row.')
+    arguments.add_argument('left_player', nargs='?', default='', help='partial name of a player')
+    arguments.add_argument('right_player', nargs='?', default='', help='partial name of their opponent')
+    arguments.add_argument('--role', choices=[ROLE_EITHER, ROLE_SNIPER, ROLE_SPY], default=ROLE_EITHER,
+                           help='role of the right player, the left player being on the other')
+    arguments.add_argument('--venue', action='append', dest='venues', choices=ReplayParser.VENUES,
+                           help='allowed venue, may be repeated (default: any)')
+    arguments.add_argument('--result', action='append', dest='results', choices=ReplayParser.RESULTS,
+                           help='allowed game result, may be repeated (default: any)')
+    arguments.add_argument('--mwc', choices=[MWC_EITHER, MWC_YES, MWC_NO], default=MWC_EITHER,
+                           help='whether the spy reached mission win countdown')
+    arguments.add_argument('--mission', action='append', dest='missions', choices=ReplayParser.MISSIONS,
+                           help='mission which must have been completed, may be repeated')
+    arguments.add_argument('--since', metavar='DATE', default='',
+                           help='played on or after DATE, as YYYY, YYYY-MM or YYYY-MM-DD in local time')
+    arguments.add_argument('--until', metavar='DATE', default='',
+                           help='played on or before DATE, the whole of a year or month being included')
+    arguments.add_argument('-d', '--directory', action='append', dest='directories',
+                           help='replay subdirectory to search, may be repeated (default: Matches and Spectations)')
+    arguments.add_argument('--replays', type=Path, help='replays directory (default: from ReParty_config.json)')
+    arguments.add_argument('-f', '--format', choices=list(WRITERS), default=FORMAT_JSONL)
+    arguments.add_argument('-o', '--output', help='file to write to (default: standard output)')
+    arguments.add_argument('--fields', help=f'comma separated keys to keep, of {",".join(DICTIONARY_KEYS)}')
+    arguments.add_argument('--rename', action='append', default=[], metavar='KEY=NAME', help='rename an output key')
+    arguments.add_argument('--no-index', action='store_true', help="parse every replay, and don't update the index")
+    arguments.add_argument('-j', '--workers', type=int, help='parsing processes (default: parse_workers config)')
+    arguments.add_argument('--io-threads', type=int, help='read headers in inode order with this many reads in flight, '
+                                                          'for cold caches and spinning disks '
+                                                          '(default: io_threads config)')
+    arguments.add_argument('--catalog', action='store_true', help='answer the query with one SQL query over the SQLite '
+                                                                  'catalog of the index (default: sql_catalog config)')
+    arguments.add_argument('--archive', type=Path, help='query a replay archive written by ReplayArchive.py, '
+                                                         'rather than the replays directory')
+    arguments.add_argument('--count', action='store_true', help='only write how many replays matched')
+    arguments.add_argument('--explain', action='store_true', help='describe the query plan before running it')
+    arguments.add_argument('--profile', action='store_true', help='time each step of the query plan, and describe it '
+                                                                  'with what actually passed each step afterwards')
+    arguments.add_argument('--cprofile', metavar='FILE', help='run the query under cProfile, dumping its stats to FILE '
+                                                              '(default: ReParty_scan.pstats if profile_scans config)')
+    options = arguments.parse_args(args)
+
+    try:
+        keys = dictionary_keys(options.fields and options.fields.split(','), options.rename)
+        start, end = date_bound(options.since), date_bound(options.until, end=True)
+    except ValueError as e:
+        arguments.error(str(e))
+
+    close_output = bool(options.output)  # decided now, as sys.stdout is redirected to stderr below
+    output = open(options.output, 'w', newline='', encoding='utf-8') if close_output else sys.stdout
+    # diagnostics such as parse errors are printed, so keep them out of the results
+    with redirect_stdout(sys.stderr):
+        from Filepaths import REPARTY_CONFIG, KEYWORD_PARSE_WORKERS, KEYWORD_IO_THREADS, KEYWORD_SQL_CATALOG, \
+            KEYWORD_PROFILE_SCANS, REPLAYS_DIRECTORY, REPLAY_INDEX_FILE, REPLAY_CATALOG_FILE, SCAN_METRICS_FILE, \
+            SCAN_PROFILE_FILE
+        replay_dir = options.replays or REPLAYS_DIRECTORY()
+        directories = [replay_dir / subdir for subdir in options.directories or ('Matches', 'Spectations')]
+        workers = options.workers or REPARTY_CONFIG[KEYWORD_PARSE_WORKERS] or None
+        io_threads = REPARTY_CONFIG[KEYWORD_IO_THREADS] if options.io_threads is None else options.io_threads
+        index = None if options.no_index else ReplayIndex(REPLAY_INDEX_FILE)
+        catalog = None
+        if options.archive is None and (options.catalog or (REPARTY_CONFIG[KEYWORD_SQL_CATALOG] and index is not None)):
+            if index is None:
+                arguments.error('the catalog mirrors the index, so --catalog cannot be used with --no-index')
+            catalog = ReplayCatalog(REPLAY_CATALOG_FILE)
+        query = ReplayQuery(
+            left_player=options.left_player,
+            right_player=options.right_player,
+            role=options.role,
+            venues=options.venues,
+            results=options.results,
+            mwc=options.mwc,
+            missions=options.missions,
+            start=start,
+            end=end
+        )
+
+        archive = None
+        if options.archive is not None:
+            from ReplayArchive import ReplayArchive
+
+            archive = ReplayArchive(options.archive)
+        plan = query.plan(archive, profile=options.profile)
+        if options.explain and catalog is None:
+            print(plan.explain())
+        writer = WRITERS[options.format](output)
+        count = 0
+        failures = []  # summarized once the query is over, rather than printed one by one
+        metrics = ScanMetrics()
+        profile_path = options.cprofile or (SCAN_PROFILE_FILE if REPARTY_CONFIG[KEYWORD_PROFILE_SCANS] else None)
+        with ScanMetrics.profiled(profile_path):
+            try:
+                if archive is not None:
+                    # the whole archive is masked at once, and only the matching records are made into Replays
+                    with metrics.stage(STAGE_CRITERIA):
+                        mask = archive.mask(query, plan)
+                    if options.count:
+                        count = int(mask.sum())
+                        matches = ()
+                    else:
+                        matches = archive.select(mask)
+                elif catalog is not None:
+                    # the catalog can only answer once the index is current, so there's nothing to stream until then
+                    for _, parsed in index.scan(directories, workers=workers, io_threads=io_threads,
+                                                modified_since=start, metrics=metrics):
+                        if isinstance(parsed, ReplayParser.ReplayParseException):
+                            failures.append(parsed)
+                    catalog.sync(index)
+                    if options.explain:
+                        print(catalog.explain(query, directories))
+                    with metrics.stage(STAGE_CRITERIA):
+                        if options.count:  # counted by SQLite, without making any Replays
+                            count = catalog.count(query, directories)
+                            matches = ()
+                        else:
+                            matches = catalog.replays(query, directories)
+                else:
+                    matches = matching_replays(plan, directories, index, workers, io_threads, start, failures, metrics)
+                for replay in matches:
+                    if not options.count:
+                        writer.write(replay.to_dictionary(**keys))
+                    count += 1
+                if options.count:
+                    output.write(f'{count}\n')
+            finally:
+                if index is not None:
+                    index.save()
+                if catalog is not None:
+                    catalog.close()
+                if archive is not None:
+                    archive.close()
+                if close_output:
+                    output.close()
+        if failures:
+            print(ReplayParser.failure_report(failures))
+        print(f'{count} replays matched {len(query)} criteria')
+        metrics.count(COUNTER_MATCHED, count)
+        metrics.save(SCAN_METRICS_FILE, directories=[str(directory) for directory in directories], criteria=len(query),
+                     plan=plan.explain())
+        print(metrics.summary())
+        if options.profile and catalog is None:
+            print(plan.explain())
+
+
+if __name__ == '__main__':
+    main()
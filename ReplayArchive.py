@@ -0,0 +1,318 @@
+import json
+import mmap
+from argparse import ArgumentParser
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from os import replace
+from pathlib import Path
+from struct import Struct
+from ReplayParser import ReplayParser
+from ReplayQuery import clean_player_name, DatePredicate, ROLE_EITHER, ROLE_SPY, ROLE_SNIPER
+
+# Layout of an archive, every offset being from the start of the file:
+#   HEADER, padded to RECORDS_AT
+#   RECORD for each replay, in the order they were written
+#   the player name string table, then the filepath string table, each being (count + 1) little-endian u64 offsets
+#       followed by the UTF-8 bytes of every string, where string i is bytes[offsets[i]:offsets[i + 1]]
+#   metadata, as JSON: the venue, result and variant names that codes refer to
+MAGIC = b'RPAR'
+HEADER = Struct('<4sI7Q')  # magic, version, count, names_at/count, paths_at/count, metadata_at/length
+RECORDS_AT = 128
+# filepath, spy, sniper, spy username, sniper username (string ids), timestamp, duration, clock, playid,
+# setup word, guests, venue, result, variant codes, selected, picked and completed mission bitmasks, then the uuid
+RECORD = Struct('<8I3H6B16s4x')
+RECORD_FIELDS = (
+    'filepath', 'spy', 'sniper', 'spy_username', 'sniper_username', 'timestamp', 'duration', 'clock', 'playid',
+    'setup', 'guests', 'venue', 'result', 'variant', 'selected_missions', 'picked_missions', 'completed_missions',
+    'uuid'
+)
+NONE_U8, NONE_U16, NONE_U32 = 0xFF, 0xFFFF, 0xFFFFFFFF  # fields which older file versions don't record
+MODES = 'kpa'
+
+
+def setup_word(setup):
+    """A setup such as 'a4/7' as mode << 8 | required << 4 | available"""
+    required, available = setup[1:].split('/')
+    return MODES.index(setup[0]) << 8 | int(required) << 4 | int(available)
+
+
+def setup_string(word):
+    return f'{MODES[word >> 8]}{word >> 4 & 0xF}/{word & 0xF}'
+
+
+class ReplayArchive:
+    """A compact, read-only index of a replay archive, for libraries too large to hold as Replays: one fixed-width
+    record per replay, with repeated strings interned into shared tables. The file is memory mapped, so opening it
+    costs the same however many replays it holds, and scans read the records where they lie, through NumPy views
+    if wanted. An archive can stand in for a ReplayTable, so a QueryPlan's mask runs over it directly."""
+    VERSION = 1
+
+    def __init__(self, archive_path):
+        self.__file = open(archive_path, 'rb')
+        self.__map = mmap.mmap(self.__file.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, version, self.__count, names_at, names_count, paths_at, paths_count, metadata_at,
+         metadata_length) = HEADER.unpack_from(self.__map)
+        if magic != MAGIC or version != self.VERSION:
+            self.close()
+            raise ValueError(f'{archive_path} is not a version {self.VERSION} replay archive')
+        self.__names = self.__string_table(names_at, names_count)
+        self.__paths = self.__string_table(paths_at, paths_count)
+        metadata = json.loads(self.__map[metadata_at:metadata_at + metadata_length])
+        self.venues, self.results, self.variants = metadata['venues'], metadata['results'], metadata['variants']
+        self.__columns = None
+        self.__cleaned_players = None
+        self.__statistics = None
+        self.__reached = None
+        self.__player_rows = {}  # (partial name, role) -> rows, as a plan may need them for both estimate and lookup
+
+    def __string_table(self, at, count):
+        """(memoryview of the offsets, position of the bytes) of a string table"""
+        return memoryview(self.__map)[at:at + 8 * (count + 1)].cast('Q'), at + 8 * (count + 1)
+
+    def __string(self, table, string_id):
+        offsets, at = table
+        return str(self.__map[at + offsets[string_id]:at + offsets[string_id + 1]], 'utf-8')
+
+    def close(self):
+        self.__columns = None
+        self.__names = self.__paths = None  # views of the map must be released before it can close
+        self.__map.close()
+        self.__file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def __len__(self):
+        return self.__count
+
+    def player(self, player_id):
+        return self.__string(self.__names, player_id)
+
+    def filepath(self, row):
+        return self.__string(self.__paths, RECORD.unpack_from(self.__map, RECORDS_AT + row * RECORD.size)[0])
+
+    def records(self):
+        """Generator of every record as a tuple ordered like RECORD_FIELDS, unpacked straight from the map"""
+        view = memoryview(self.__map)[RECORDS_AT:RECORDS_AT + self.__count * RECORD.size]
+        try:
+            yield from RECORD.iter_unpack(view)
+        finally:
+            view.release()
+
+    def replay(self, row):
+        """The Replay of a record, with every string looked up"""
+        return self.__replay(RECORD.unpack_from(self.__map, RECORDS_AT + row * RECORD.size))
+
+    def __replay(self, record):
+        (filepath, spy, sniper, spy_username, sniper_username, timestamp, duration, clock, playid, setup, guests,
+         venue, result, variant, selected, picked, completed, uuid) = record
+        name = self.player
+        return ReplayParser.Replay.from_record(self.__string(self.__paths, filepath), (
+            urlsafe_b64encode(uuid).decode().rstrip('='), playid, timestamp, name(spy), name(spy_username),
+            name(sniper), name(sniper_username), self.results[result], setup_string(setup), self.venues[venue],
+            None if variant == NONE_U8 else self.variants[variant], None if guests == NONE_U16 else guests,
+            None if clock == NONE_U32 else clock, duration, selected, picked, completed))
+
+    @staticmethod
+    def write(archive_path, replays):
+        """Write replays, which may be a generator, to a new archive at archive_path, replacing any already there.
+        Records are written as replays arrive, so only the string tables are held in memory.
+        :returns: the number of replays written
+        """
+        archive_path = Path(archive_path)
+        names, paths, variants = {}, [], {}
+        venue_codes = {venue: code for code, venue in enumerate(ReplayParser.VENUES)}
+        result_codes = {result: code for code, result in enumerate(ReplayParser.RESULTS)}
+        temporary = archive_path.with_suffix('.tmp')
+        count = 0
+        with open(temporary, 'wb') as f:
+            f.write(bytes(RECORDS_AT))  # the header is written last, once everything it points at is known
+            for replay in replays:
+                name_ids = [names.setdefault(name, len(names)) for name in (
+                    replay.spy, replay.sniper, replay.spy_username, replay.sniper_username)]
+                paths.append(replay.filepath)
+                variant = NONE_U8 if replay.variant is None else variants.setdefault(replay.variant, len(variants))
+                f.write(RECORD.pack(
+                    len(paths) - 1, *name_ids, replay.timestamp, replay.duration,
+                    NONE_U32 if replay.clock is None else replay.clock, replay.playid, setup_word(replay.setup),
+                    NONE_U16 if replay.guests is None else replay.guests, venue_codes[replay.venue],
+                    result_codes[replay.result], variant, replay.selected_mask, replay.picked_mask,
+                    replay.completed_mask, urlsafe_b64decode(replay.uuid + '=' * (-len(replay.uuid) % 4))))
+                count += 1
+            tables = []
+            for strings in (names, paths):
+                tables.append((f.tell(), len(strings)))
+                encoded = [string.encode('utf-8') for string in strings]
+                offset = 0
+                offsets = [offset]
+                for string in encoded:
+                    offset += len(string)
+                    offsets.append(offset)
+                f.write(Struct(f'<{len(offsets)}Q').pack(*offsets))
+                f.write(b''.join(encoded))
+            metadata = json.dumps({'venues': ReplayParser.VENUES, 'results': ReplayParser.RESULTS,
+                                   'variants': list(variants)}).encode('utf-8')
+            metadata_at = f.tell()
+            f.write(metadata)
+            f.seek(0)
+            f.write(HEADER.pack(MAGIC, ReplayArchive.VERSION, count, *tables[0], *tables[1], metadata_at,
+                                len(metadata)))
+        replace(temporary, archive_path)  # never leave a half-written archive behind
+        return count
+
+    # what follows lets an archive stand in for a ReplayTable, and needs numpy
+
+    def columns(self):
+        """numpy structured array over every record, viewing the map rather than copying it"""
+        if self.__columns is None:
+            import numpy
+
+            dtype = numpy.dtype({
+                'names': list(RECORD_FIELDS),
+                'formats': ['<u4'] * 8 + ['<u2'] * 3 + ['u1'] * 6 + ['V16'],
+                'offsets': [4 * i for i in range(8)] + [32, 34, 36] + [38 + i for i in range(6)] + [44],
+                'itemsize': RECORD.size})
+            if self.venues != list(ReplayParser.VENUES) or self.results != list(ReplayParser.RESULTS):
+                raise ValueError('replay archive was written with different venues or results, and must be rebuilt')
+            self.__columns = numpy.frombuffer(self.__map, dtype, count=self.__count, offset=RECORDS_AT)
+        return self.__columns
+
+    @property
+    def venue(self):
+        return self.columns()['venue']
+
+    @property
+    def result(self):
+        return self.columns()['result']
+
+    @property
+    def spy(self):
+        return self.columns()['spy']
+
+    @property
+    def sniper(self):
+        return self.columns()['sniper']
+
+    @property
+    def timestamp(self):
+        return self.columns()['timestamp']
+
+    @property
+    def completed_missions(self):
+        return self.columns()['completed_missions']
+
+    def player_ids(self, partial_name):
+        """Ids of the players whose cleaned name contains partial_name"""
+        if self.__cleaned_players is None:
+            self.__cleaned_players = [clean_player_name(self.player(player_id))
+                                      for player_id in range(len(self.__names[0]) - 1)]
+        return [player_id for player_id, name in enumerate(self.__cleaned_players) if partial_name in name]
+
+    def player_allowed(self, player_ids):
+        import numpy
+
+        allowed = numpy.zeros(len(self.__names[0]) - 1, bool)
+        allowed[player_ids] = True
+        return allowed
+
+    def player_rows(self, partial_name, role):
+        """Rows where a player matching partial_name played role, found by scanning the player columns"""
+        if (rows := self.__player_rows.get((partial_name, role))) is None:
+            import numpy
+
+            if len(self.__player_rows) >= 64:
+                self.__player_rows.clear()
+            allowed = self.player_allowed(self.player_ids(partial_name))
+            found = numpy.zeros(self.__count, bool)
+            for column, column_role in ((self.spy, ROLE_SPY), (self.sniper, ROLE_SNIPER)):
+                if role in (column_role, ROLE_EITHER):
+                    found |= allowed[column]
+            rows = self.__player_rows[partial_name, role] = numpy.flatnonzero(found)
+        return rows
+
+    def player_count(self, partial_name, role):
+        return len(self.player_rows(partial_name, role))
+
+    def time_rows(self, start, end):
+        """Rows whose timestamp is within [start, end). Records are in the order they were written rather than by
+        time, so this is a scan of the timestamp column."""
+        import numpy
+
+        return numpy.flatnonzero(DatePredicate(start, end).mask(self, slice(None)))
+
+    def time_count(self, start, end):
+        return len(self.time_rows(start, end))
+
+    def venue_allowed(self, codes):
+        from ReplayTable import ReplayTable
+
+        return ReplayTable.venue_allowed(codes)
+
+    def result_allowed(self, codes):
+        from ReplayTable import ReplayTable
+
+        return ReplayTable.result_allowed(codes)
+
+    def reached_mwc(self):
+        """Whether each record's spy completed at least as many missions as their setup required"""
+        if self.__reached is None:
+            import numpy
+
+            counts = numpy.array([bin(bitmask).count('1') for bitmask in range(256)], numpy.int8)
+            required = (self.columns()['setup'] >> 4 & 0xF).astype(numpy.int8)
+            self.__reached = counts[self.completed_missions] >= required
+        return self.__reached
+
+    def statistics(self):
+        if self.__statistics is None:
+            import numpy
+
+            self.__statistics = {
+                'venue': numpy.bincount(self.venue, minlength=len(ReplayParser.VENUES)),
+                'result': numpy.bincount(self.result, minlength=len(ReplayParser.RESULTS)),
+                'completed': numpy.bincount(self.completed_missions, minlength=256),
+                'reached': int(self.reached_mwc().sum()),
+            }
+        return self.__statistics
+
+    def mask(self, query, plan=None):
+        """Mask of the records which satisfy every criterion of query"""
+        return (plan or query.plan(self)).mask(self)
+
+    def select(self, mask):
+        """The Replays of the records in mask"""
+        import numpy
+
+        return [self.replay(row) for row in numpy.flatnonzero(mask).tolist()]
+
+
+def main():
+    arguments = ArgumentParser(description='Write every replay beneath the given directories to a replay archive, '
+                                           'which RePartyCLI --archive can then query.')
+    arguments.add_argument('archive', help='archive file to write')
+    arguments.add_argument('directories', nargs='+')
+    arguments.add_argument('-j', '--workers', type=int, help='parsing processes (default: one per CPU)')
+    arguments.add_argument('--io-threads', type=int, default=0, help='read headers in inode order with this many '
+                                                                     'reads in flight')
+    options = arguments.parse_args()
+
+    parser = ReplayParser()
+    failures = []
+
+    def parsed_replays():
+        entries = (entry for directory in options.directories for entry in ReplayParser.scan_replays(directory))
+        for _, parsed in parser.parse_replays_parallel(entries, options.workers, io_threads=options.io_threads):
+            if isinstance(parsed, ReplayParser.ReplayParseException):
+                failures.append(parsed)
+            else:
+                yield parsed
+    archived = ReplayArchive.write(options.archive, parsed_replays())
+    if failures:
+        print(ReplayParser.failure_report(failures))
+    print(f'{archived} replays archived')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,131 @@
+import sqlite3
+from os import sep
+from pathlib import Path
+from threading import RLock
+from ReplayParser import ReplayParser
+from ReplayQuery import clean_player_name
+
+
+class ReplayCatalog:
+    """Optional SQLite mirror of a ReplayIndex, with indexes on the columns queries select by, so that a ReplayQuery
+    runs as a single indexed SQL query, and can be counted without making a Replay for any of its matches."""
+    __SCHEMA_VERSION = 1
+    __RECORD_FIELDS = ReplayParser.Replay.RECORD_FIELDS
+    __COLUMNS = ('filepath', 'size', 'mtime_ns', *__RECORD_FIELDS,
+                 'spy_clean', 'sniper_clean', 'required', 'completed_count')
+    __SCHEMA = f'''
+        CREATE TABLE replays (
+            filepath TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER,
+            uuid TEXT, playid INTEGER, timestamp INTEGER, spy TEXT, spy_username TEXT, sniper TEXT,
+            sniper_username TEXT, result TEXT, setup TEXT, venue TEXT, variant TEXT, guests INTEGER, clock INTEGER,
+            duration INTEGER, selected_mask INTEGER, picked_mask INTEGER, completed_mask INTEGER,
+            spy_clean TEXT, sniper_clean TEXT, required INTEGER, completed_count INTEGER
+        );
+        CREATE INDEX replays_venue ON replays (venue);
+        CREATE INDEX replays_spy_clean ON replays (spy_clean);
+        CREATE INDEX replays_sniper_clean ON replays (sniper_clean);
+        CREATE INDEX replays_result ON replays (result);
+        CREATE INDEX replays_setup ON replays (setup);
+        CREATE INDEX replays_timestamp ON replays (timestamp);
+        CREATE TABLE players (name TEXT PRIMARY KEY);  -- every distinct cleaned name, for substring searches
+        PRAGMA user_version = {__SCHEMA_VERSION};
+    '''
+
+    def __init__(self, catalog_path):
+        self.__path = Path(catalog_path)
+        self.__connection = None  # opened on first use
+        self.lock = RLock()  # the connection is shared between threads, one at a time
+
+    def __connect(self):
+        if self.__connection is None:
+            connection = sqlite3.connect(self.__path, check_same_thread=False)
+            if connection.execute('PRAGMA user_version').fetchone()[0] != self.__SCHEMA_VERSION:
+                # the catalog only mirrors the index, so an old one is simply rebuilt
+                connection.executescript('DROP TABLE IF EXISTS replays; DROP TABLE IF EXISTS players;')
+                connection.executescript(self.__SCHEMA)
+            self.__connection = connection
+        return self.__connection
+
+    def close(self):
+        with self.lock:
+            if self.__connection is not None:
+                self.__connection.close()
+                self.__connection = None
+
+    def __row(self, filepath, size, mtime, replay):
+        record = replay.to_record()
+        return (filepath, size, mtime, *record, clean_player_name(replay.spy), clean_player_name(replay.sniper),
+                int(replay.setup[1]), bin(replay.completed_mask).count('1'))
+
+    def sync(self, index):
+        """Bring the catalog up to date with a ReplayIndex, only writing the replays which differ.
+        Hold the index's lock while syncing, so that it isn't changed part way through.
+        :returns: (replays written, replays deleted)
+        """
+        with self.lock:
+            connection = self.__connect()
+            catalogued = {filepath: (size, mtime) for filepath, size, mtime in
+                          connection.execute('SELECT filepath, size, mtime_ns FROM replays')}
+            rows = []
+            for filepath, size, mtime, replay in index.entries():
+                if catalogued.pop(filepath, None) != (size, mtime):
+                    rows.append(self.__row(filepath, size, mtime, replay))
+            with connection:  # a single transaction
+                if catalogued:  # whatever is left is no longer indexed
+                    connection.executemany('DELETE FROM replays WHERE filepath = ?', ((f,) for f in catalogued))
+                connection.executemany(
+                    f'INSERT OR REPLACE INTO replays ({", ".join(self.__COLUMNS)}) '
+                    f'VALUES ({", ".join("?" * len(self.__COLUMNS))})', rows)
+                if catalogued:
+                    connection.execute('DELETE FROM players')
+                if catalogued or rows:
+                    connection.execute('INSERT OR IGNORE INTO players SELECT spy_clean FROM replays '
+                                       'UNION SELECT sniper_clean FROM replays')
+            return len(rows), len(catalogued)
+
+    @staticmethod
+    def where(query, directories=None):
+        """(WHERE clause, parameters) selecting the replays beneath directories (all if None) which satisfy query"""
+        conditions, parameters = [], []
+        for predicate in query.predicates():
+            condition, values = predicate.sql()
+            conditions.append(condition)
+            parameters.extend(values)
+        if directories is not None:
+            # a range of filepaths, which is found through the primary key rather than tested row by row
+            ranges = []
+            for directory in directories:
+                prefix = str(directory).rstrip(sep) + sep
+                ranges.append('(filepath >= ? AND filepath < ?)')
+                parameters.extend((prefix, prefix[:-1] + chr(ord(sep) + 1)))
+            conditions.append(f'({" OR ".join(ranges)})' if ranges else '0')
+        return ' AND '.join(conditions) or '1', parameters
+
+    def count(self, query, directories=None):
+        """The number of replays which satisfy query, counted within SQLite"""
+        condition, parameters = self.where(query, directories)
+        with self.lock:
+            return self.__connect().execute(f'SELECT count(*) FROM replays WHERE {condition}', parameters).fetchone()[0]
+
+    def filepaths(self, query, directories=None):
+        condition, parameters = self.where(query, directories)
+        with self.lock:
+            return [filepath for filepath, in self.__connect().execute(
+                f'SELECT filepath FROM replays WHERE {condition}', parameters)]
+
+    def replays(self, query, directories=None):
+        """Replays which satisfy query, rebuilt from their rows without reading their files"""
+        condition, parameters = self.where(query, directories)
+        from_record = ReplayParser.Replay.from_record
+        with self.lock:
+            rows = self.__connect().execute(
+                f'SELECT filepath, {", ".join(self.__RECORD_FIELDS)} FROM replays WHERE {condition}', parameters)
+            return [from_record(filepath, record) for filepath, *record in rows]
+
+    def explain(self, query, directories=None):
+        """SQLite's plan for query, as lines"""
+        condition, parameters = self.where(query, directories)
+        with self.lock:
+            plan = self.__connect().execute(
+                f'EXPLAIN QUERY PLAN SELECT filepath FROM replays WHERE {condition}', parameters).fetchall()
+        return '\n'.join(['SQL QUERY PLAN'] + [f'  {detail}' for *_, detail in plan])
@@ -0,0 +1,137 @@
+import json
+from concurrent.futures import ThreadPoolExecutor
+from os import link, symlink, replace, remove, stat, path
+from shutil import copy2
+from threading import Lock
+
+METHOD_HARDLINK = 'hardlink'
+METHOD_SYMLINK = 'symlink'
+METHOD_COPY = 'copy'
+MANIFEST_FILENAME = 'ReParty_manifest.json'
+
+
+class ReplayExporter:
+    """Puts replays into a replay set's directory, by hardlink, then symlink, and only copying once neither works,
+    so a set costs next to no disk space. A manifest of what was exported from where is kept in the directory,
+    so exporting to it again only touches the replays which are new or whose source has changed."""
+    __MANIFEST_VERSION = 1
+
+    def __init__(self, directory, link=True, workers=8):
+        """
+        :param
+            directory (Path): the replay set's directory, which must exist
+        :param
+            link (bool): whether to try linking the replays before copying them
+        :param
+            workers (int): threads copying replays at once, as copies spend their time waiting on the disk
+        """
+        self.directory = directory
+        self.methods = (METHOD_HARDLINK, METHOD_SYMLINK, METHOD_COPY) if link else (METHOD_COPY,)
+        self.workers = workers
+        self.__manifest_path = directory / MANIFEST_FILENAME
+        self.__manifest = self.__load_manifest()
+        self.__failed = set()  # (method, source device) which have failed once, and so aren't attempted again
+        self.__lock = Lock()
+
+    def __load_manifest(self):
+        """filename -> [source filepath, size, mtime_ns, method]"""
+        try:
+            with open(self.__manifest_path, encoding='utf-8') as f:
+                stored = json.load(f)
+            if stored.get('version') == self.__MANIFEST_VERSION:
+                return stored['files']
+        except FileNotFoundError:
+            pass
+        except Exception as e:  # the manifest only saves work, so do it all again rather than crash
+            print("ERROR WHILE READING EXPORT MANIFEST:", e)
+        return {}
+
+    def __save_manifest(self):
+        temporary = self.__manifest_path.with_suffix('.tmp')
+        with open(temporary, 'w', encoding='utf-8') as f:
+            json.dump({'version': self.__MANIFEST_VERSION, 'files': self.__manifest}, f)
+        replace(temporary, self.__manifest_path)
+
+    def export(self, filepaths, progress=None):
+        """Export every file in filepaths, skipping those already exported unchanged
+        :param
+            progress (function): called with (files done, total files) as they finish, from the copying threads
+        :returns: dict of how many files were exported by each method, skipped as unchanged, or no longer exist
+        """
+        filepaths = list(dict.fromkeys(str(filepath) for filepath in filepaths))
+        total = len(filepaths)
+        counts = dict.fromkeys((*self.methods, 'unchanged', 'missing'), 0)
+        pending = {}  # filename -> job, where a later replay with the same filename replaces an earlier one
+        for filepath in filepaths:
+            try:
+                source_stat = stat(filepath)
+            except FileNotFoundError:  # deleted since it was indexed
+                counts['missing'] += 1
+                continue
+            filename = path.basename(filepath)
+            exported = self.__manifest.get(filename)
+            if exported is not None and exported[:3] == [filepath, source_stat.st_size, source_stat.st_mtime_ns] \
+                    and path.lexists(self.directory / filename):
+                counts['unchanged'] += 1
+            else:
+                pending[filename] = filepath, filename, source_stat
+        pending = list(pending.values())
+        done = total - len(pending)
+        if progress is not None:
+            progress(done, total)
+
+        def export_one(job):
+            nonlocal done
+            filepath, filename, source_stat = job
+            exported = self.__manifest.get(filename)
+            destination = self.directory / filename
+            if exported is not None and path.exists(destination) and path.samefile(filepath, destination):
+                method = exported[3]  # still linked to the same file, such as after its mtime alone was changed
+            else:
+                method = self.__export_file(filepath, destination, source_stat.st_dev)
+            with self.__lock:
+                self.__manifest[filename] = [filepath, source_stat.st_size, source_stat.st_mtime_ns, method]
+                counts[method] = counts.get(method, 0) + 1
+                done += 1
+                if progress is not None:
+                    progress(done, total)
+
+        try:
+            if len(pending) > 1 and self.workers > 1:
+                with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                    for _ in pool.map(export_one, pending):
+                        pass
+            else:
+                for job in pending:
+                    export_one(job)
+        finally:
+            if pending:
+                self.__save_manifest()
+        return counts
+
+    def __export_file(self, source, destination, device):
+        """Export source by the first method which works, into a temporary name and then over destination,
+        so that an existing file is replaced whole rather than deleted first
+        :returns: the method used
+        """
+        temporary = destination.with_name(destination.name + '.tmp')
+        if path.lexists(temporary):  # left behind by an interrupted export, and links can't be made over it
+            remove(temporary)
+        for method in self.methods:
+            if (method, device) in self.__failed:
+                continue
+            try:
+                if method == METHOD_HARDLINK:
+                    link(source, temporary)
+                elif method == METHOD_SYMLINK:
+                    symlink(path.abspath(source), temporary)
+                else:
+                    copy2(source, temporary)
+                replace(temporary, destination)
+                return method
+            except OSError:
+                if method == METHOD_COPY:
+                    raise
+                # such as linking across drives, file systems without links, or symlinks needing privileges
+                with self.__lock:
+                    self.__failed.add((method, device))
@@ -0,0 +1,302 @@
+from struct import Struct, calcsize
+from operator import itemgetter
+from base64 import urlsafe_b64encode
+
+# The decoding shared by ReplayParser and SpyPartyReplay: where each file version keeps its fields, what their codes
+# mean, and ReplayHeader, which decodes the fixed-position fields at once but leaves everything costly until asked.
+
+
+class ReplayVersionConstants:
+    def __init__(
+            self, magic_number=0x00, file_version=0x04, protocol_version=0x08, spyparty_version=0x0C,
+            duration=0x14, uuid=0x18, timestamp=0x28, playid=0x2C, players=0x50,
+            len_user_spy=0x2E, len_user_sniper=0x2F, len_disp_spy=None, len_disp_sniper=None,
+            guests=None, clock=None, result=0x30, setup=0x34, venue=0x38, variant=None,
+            missions_s=0x3C, missions_p=0x40, missions_c=0x44
+    ):
+        self.magic_number = magic_number
+        self.file_version = file_version
+        self.protocol_version = protocol_version
+        self.spyparty_version = spyparty_version
+        self.duration = duration
+        self.uuid = uuid
+        self.timestamp = timestamp
+        self.playid = playid
+        self.players = players
+        self.len_user_spy = len_user_spy
+        self.len_user_sniper = len_user_sniper
+        self.len_disp_spy = len_disp_spy
+        self.len_disp_sniper = len_disp_sniper
+        self.guests = guests
+        self.clock = clock
+        self.result = result
+        self.setup = setup
+        self.venue = venue
+        self.variant = variant
+        self.missions_s = missions_s
+        self.missions_p = missions_p
+        self.missions_c = missions_c
+
+        # every fixed-position field is decoded by a single precompiled unpack_from call
+        fields = [
+            (offset, name, code) for name, code in FIELD_CODES
+            if (offset := getattr(self, name)) is not None
+        ]
+        fields.sort()
+        layout, position = ['<'], 0
+        for offset, name, code in fields:
+            if offset < position:
+                raise ValueError(f"Overlapping replay header field: {name} at {offset:#x}")
+            if offset > position:
+                layout.append(f'{offset - position}x')
+            layout.append(code)
+            position = offset + calcsize('<' + code)
+        self.layout = Struct(''.join(layout))
+        self.fields = fields
+        self.__dtypes = {}
+        # maps the unpacked tuple back into FIELD_CODES order, where the extra index points at a None
+        missing = len(fields)
+        by_name = {name: i for i, (_, name, _) in enumerate(fields)}
+        self.__order = itemgetter(*(by_name.get(name, missing) for name, _ in FIELD_CODES))
+
+    __DTYPE_CODES = {'B': 'u1', 'H': '<u2', 'I': '<u4', 'f': '<f4', '16s': 'V16'}
+
+    def dtype(self, numpy, itemsize):
+        """numpy structured dtype of the same fields as layout, for records spaced itemsize bytes apart"""
+        if itemsize not in self.__dtypes:
+            self.__dtypes[itemsize] = numpy.dtype({
+                'names': [name for _, name, _ in self.fields],
+                'formats': [self.__DTYPE_CODES[code] for _, _, code in self.fields],
+                'offsets': [offset for offset, _, _ in self.fields],
+                'itemsize': itemsize
+            })
+        return self.__dtypes[itemsize]
+
+    def unpack(self, header):
+        """Decode every fixed-position field at once, as a tuple ordered like FIELD_CODES (None if absent)"""
+        return self.__order(self.layout.unpack_from(header) + (None,))
+
+    def extract_names(self, header, spy_user_len, sni_user_len, spy_disp_len, sni_disp_len):
+        total_offset = self.players
+
+        spy_username = str(header[total_offset:total_offset + spy_user_len], 'utf-8')
+        total_offset += spy_user_len
+        sniper_username = str(header[total_offset:total_offset + sni_user_len], 'utf-8')
+
+        spy_display_name, sniper_display_name = spy_username, sniper_username
+        if self.len_disp_spy or self.len_disp_sniper:
+            total_offset += sni_user_len
+            spy_display_name = str(header[total_offset:total_offset + spy_disp_len], 'utf-8')
+            total_offset += spy_disp_len
+            sniper_display_name = str(header[total_offset:total_offset + sni_disp_len], 'utf-8')
+
+            if not spy_display_name:
+                spy_display_name = spy_username
+            if not sniper_display_name:
+                sniper_display_name = sniper_username
+        return spy_display_name, sniper_display_name, spy_username, sniper_username
+
+
+FIELD_CODES = (
+    ('spyparty_version', 'I'), ('duration', 'f'), ('uuid', '16s'), ('timestamp', 'I'), ('playid', 'H'),
+    ('len_user_spy', 'B'), ('len_user_sniper', 'B'), ('len_disp_spy', 'B'), ('len_disp_sniper', 'B'),
+    ('guests', 'I'), ('clock', 'I'), ('result', 'I'), ('setup', 'I'), ('venue', 'I'), ('variant', 'I'),
+    ('missions_s', 'I'), ('missions_p', 'I'), ('missions_c', 'I')
+)
+
+HEADER_DATA_MINIMUM_BYTES = 416
+HEADER_DATA_USERNAME_LIMIT = 33
+HEADER_DATA_DISPLAYNAME_LIMIT = 135
+HEADER_DATA_MAXIMUM_BYTES = HEADER_DATA_MINIMUM_BYTES + 2 * (HEADER_DATA_USERNAME_LIMIT +
+                                                             HEADER_DATA_DISPLAYNAME_LIMIT)
+OFFSETS_DICT = {
+    3: ReplayVersionConstants(),
+    4: ReplayVersionConstants(
+        players=0x54,
+        result=0x34,
+        setup=0x38,
+        venue=0x3C,
+        missions_s=0x40,
+        missions_p=0x44,
+        missions_c=0x48
+    ),
+    5: ReplayVersionConstants(
+        players=0x60,
+        len_user_spy=0x2E,
+        len_user_sniper=0x2F,
+        len_disp_spy=0x30,
+        len_disp_sniper=0x31,
+        guests=0x50,
+        clock=0x54,
+        result=0x38,
+        setup=0x3C,
+        venue=0x40,
+        missions_s=0x44,
+        missions_p=0x48,
+        missions_c=0x4C
+    ),
+    6: ReplayVersionConstants(
+        players=0x64,
+        len_user_spy=0x2E,
+        len_user_sniper=0x2F,
+        len_disp_spy=0x30,
+        len_disp_sniper=0x31,
+        guests=0x54,
+        clock=0x58,
+        result=0x38,
+        setup=0x3C,
+        venue=0x40,
+        variant=0x44,
+        missions_s=0x48,
+        missions_p=0x4C,
+        missions_c=0x50
+    )
+}
+OFFSETS_DICT[2] = OFFSETS_DICT[3]  # v2 is nearly identical to v3 according to plastikqs!
+VENUE_MAP = {
+    0x8802482A: "Old High-rise",
+    0x3A30C326: "High-rise",
+    0x5996FAAA: "Ballroom",
+    0x5B121925: "Ballroom",
+    0x1A56C5A1: "High-rise",
+    0x28B3AA5E: "Old Gallery",
+    0x290A0C75: "Old Courtyard 2",
+    0x3695F583: "Panopticon",
+    0xA8BEA091: "Old Veranda",
+    0xB8891FBC: "Old Balcony",
+    0x0D027340: "Pub",
+    0x3B85FFF3: "Pub",
+    0x09C2E7B0: "Old Ballroom",
+    0xB4CF686B: "Old Courtyard",
+    0x7076E38F: "Double Modern",
+    0xE6146120: "Modern",
+    0x6F81A558: "Veranda",
+    0x9DC5BB5E: "Courtyard",
+    0x168F4F62: "Library",
+    0x1DBD8E41: "Balcony",
+    0x7173B8BF: "Gallery",
+    0x9032CE22: "Terrace",
+    0x2E37F15B: "Moderne",
+    0x79DFA0CF: "Teien",
+    0x98E45D99: "Aquarium",
+    0x35AC5135: "Redwoods",
+    0xF3E61461: "Modern"
+}
+VARIANT_MAP = {
+    "Teien": [
+        "BooksBooksBooks",
+        "BooksStatuesBooks",
+        "StatuesBooksBooks",
+        "StatuesStatuesBooks",
+        "BooksBooksStatues",
+        "BooksStatuesStatues",
+        "StatuesBooksStatues",
+        "StatuesStatuesStatues"
+    ],
+    "Aquarium": [
+        "Bottom",
+        "Top"
+    ],
+}
+RESULT_MAP = {
+    0: "Missions Win",
+    1: "Time Out",
+    2: "Spy Shot",
+    3: "Civilian Shot",
+    4: "In Progress"
+}
+MODE_MAP = {
+    0: "k",
+    1: "p",
+    2: "a"
+}
+MISSION_OFFSETS = {
+    "Bug": 0,
+    "Contact": 1,
+    "Transfer": 2,
+    "Swap": 3,
+    "Inspect": 4,
+    "Seduce": 5,
+    "Purloin": 6,
+    "Fingerprint": 7,
+}
+PREAMBLE = Struct('<4sI')  # magic number and file version
+# every combination of the 8 missions, so that decoding never has to test bits one by one
+MISSIONS_BY_BITMASK = tuple(
+    tuple(mission for mission, offset in MISSION_OFFSETS.items() if bitmask & (1 << offset))
+    for bitmask in range(1 << len(MISSION_OFFSETS))
+)
+
+
+def venue_name(venue, spyparty_version):
+    """:raises KeyError: for a venue code which isn't in VENUE_MAP"""
+    venue = VENUE_MAP[venue]
+    if venue == 'Terrace' and spyparty_version < 6016:  # Thanks checker!
+        venue = 'Old Terrace'
+    return venue
+
+
+def variant_name(venue, variant):
+    """The name of a venue's variant, or None if the venue has no variants or the file version doesn't record them"""
+    if variant is not None:
+        try:
+            return VARIANT_MAP[venue][variant]
+        except (KeyError, IndexError):
+            pass
+    return None
+
+
+def split_setup(setup):
+    """(mode code, missions required, missions available) from the setup word"""
+    return setup >> 28, setup & 0x00003FFF, (setup & 0x0FFFC000) >> 14
+
+
+def game_type(setup):
+    """Setup as displayed, such as a4/7; known setups must complete every mission they select"""
+    mode, required, available = split_setup(setup)
+    real_mode = MODE_MAP[mode]
+    if real_mode == 'k':
+        available = required
+    return "%s%d/%d" % (real_mode, required, available)
+
+
+class ReplayHeader:
+    """The fixed-position fields of a replay's header, all unpacked at once, with just enough of the raw bytes
+    kept that the names, uuid and variant are only decoded if they are ever asked for."""
+    __slots__ = (
+        'offsets', 'raw', 'spyparty_version', 'duration', 'timestamp', 'playid', 'name_lengths',
+        'guests', 'clock', 'result', 'setup', 'venue', 'variant', 'missions_s', 'missions_p', 'missions_c'
+    )
+
+    def __init__(self, header, offsets: ReplayVersionConstants):
+        """
+        :param
+            header (bytes-like): header of a replay, whose magic number and file version have been checked
+        :param
+            offsets (ReplayVersionConstants): layout of the header's file version
+        """
+        (self.spyparty_version, self.duration, _, self.timestamp, self.playid,
+         spy_user_len, sni_user_len, spy_disp_len, sni_disp_len,
+         self.guests, self.clock, self.result, self.setup, self.venue, self.variant,
+         self.missions_s, self.missions_p, self.missions_c) = offsets.unpack(header)
+        self.name_lengths = spy_user_len, sni_user_len, spy_disp_len or 0, sni_disp_len or 0
+        self.offsets = offsets
+        # the names are the last thing in the header, so nothing beyond them is kept
+        self.raw = bytes(header[:offsets.players + sum(self.name_lengths)])
+
+    def names(self):
+        """(spy display name, sniper display name, spy username, sniper username), with display names defaulting
+        to usernames"""
+        return self.offsets.extract_names(memoryview(self.raw), *self.name_lengths)
+
+    def check_names(self):
+        """Decode the names now if they might not be valid, so a header with undecodable names fails while it's
+        parsed rather than whenever its names are first read. ASCII names are always valid, so stay undecoded.
+        :raises UnicodeDecodeError: if a name isn't UTF-8
+        """
+        if not self.raw[self.offsets.players:].isascii():
+            self.names()
+
+    def uuid(self):
+        uuid_offset = self.offsets.uuid
+        return urlsafe_b64encode(self.raw[uuid_offset:uuid_offset + 16]).decode()
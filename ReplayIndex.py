@@ -0,0 +1,278 @@
+import pickle
+from os import stat, replace, sep, DirEntry
+from pathlib import Path
+from threading import RLock
+from ReplayParser import ReplayParser
+from ReplayRollups import ReplayRollups
+from ScanMetrics import STAGE_FIND, COUNTER_FILES, COUNTER_CACHED, COUNTER_QUARANTINED, COUNTER_PARSED, \
+    COUNTER_FAILURES, COUNTER_SKIPPED
+
+
+class ReplayIndex:
+    """Persistent store of decoded replay headers, keyed by filepath and validated by file size and mtime.
+    Replay files never change once SpyParty has written them, so a rescan only has to parse new or changed files.
+    Files which couldn't be parsed are quarantined the same way, so they aren't read again until they change."""
+    __FORMAT_VERSION = 2  # records are compact Replays
+
+    def __init__(self, index_path, parser=None):
+        self.__path = Path(index_path)
+        self.__parser = ReplayParser() if parser is None else parser
+        self.__entries = None  # filepath -> (size, mtime_ns, Replay), loaded on first use
+        self.__quarantine = {}  # filepath -> (size, mtime_ns, reason it couldn't be parsed), loaded with the entries
+        self.__saved = True
+        self.__table = None  # ReplayTable of every entry, rebuilt after they change
+        self.__rollups = None  # ReplayRollups of every entry, built on first use and then kept current
+        self.lock = RLock()  # held by whichever thread is updating the index, such as a ReplayWatcher
+        self.revision = 0  # counts changes to the entries or quarantine, so a caller can tell whether it made any
+
+    def __len__(self):
+        return len(self.__get_entries())
+
+    def __get_entries(self):
+        if self.__entries is None:
+            self.__entries = {}
+            if self.__path.exists():
+                try:
+                    with open(self.__path, "rb") as f:
+                        stored = pickle.load(f)
+                    if stored.get('version') == self.__FORMAT_VERSION:
+                        self.__entries = {
+                            filepath: (size, mtime, ReplayParser.Replay.from_record(filepath, record))
+                            for filepath, (size, mtime, record) in stored['entries'].items()
+                        }
+                        self.__quarantine = stored.get('quarantine', {})
+                except Exception as e:  # a corrupt index is only a cache, so start over rather than crash
+                    print("ERROR WHILE READING REPLAY INDEX:", e)
+        return self.__entries
+
+    def save(self):
+        if self.__saved or self.__entries is None:
+            return
+        records = {}
+        for filepath, (size, mtime, replay) in list(self.__entries.items()):
+            try:
+                records[filepath] = size, mtime, replay.to_record()
+            except Exception as e:  # a field decoded only now was unreadable, so it can't be kept as a replay
+                failure = ReplayParser.ReplayParseException("Undecodable header: %s" % e, filepath)
+                self.__quarantine_failure(self.__entries, filepath, size, mtime, failure)
+        temporary = self.__path.with_suffix('.tmp')
+        try:
+            stored = {'version': self.__FORMAT_VERSION, 'entries': records, 'quarantine': self.__quarantine}
+            with open(temporary, "wb") as f:
+                pickle.dump(stored, f, protocol=pickle.HIGHEST_PROTOCOL)
+            replace(temporary, self.__path)  # never leave a half-written index behind
+            self.__saved = True
+        except Exception as e:
+            print("ERROR WHILE WRITING REPLAY INDEX:", e)
+
+    def __changed(self):
+        self.__saved = False
+        self.__table = None
+        self.revision += 1
+
+    def __store(self, entries, filepath, entry):
+        if self.__rollups is not None:
+            if (replaced := entries.get(filepath)) is not None:
+                self.__rollups.remove(replaced[2])
+            self.__rollups.add(entry[2])
+        entries[filepath] = entry
+        self.__changed()
+
+    def __drop(self, entries, filepath):
+        """:returns: whether filepath was indexed"""
+        if (dropped := entries.pop(filepath, None)) is None:
+            return False
+        if self.__rollups is not None:
+            self.__rollups.remove(dropped[2])
+        self.__changed()
+        return True
+
+    def __quarantined(self, filepath, file_stat):
+        """The ReplayParseException filepath was quarantined for, if the file has not changed since"""
+        known = self.__quarantine.get(filepath)
+        if known is not None and known[0] == file_stat.st_size and known[1] == file_stat.st_mtime_ns:
+            return ReplayParser.ReplayParseException(known[2], filepath)
+
+    def __quarantine_failure(self, entries, filepath, size, mtime, failure):
+        self.__drop(entries, filepath)  # whatever was indexed for it is no longer what the file holds
+        self.__quarantine[filepath] = size, mtime, failure.reason
+        self.__saved = False
+        self.revision += 1
+
+    def __release(self, filepaths):
+        """Drop filepaths from the quarantine, having been parsed, or gone"""
+        for filepath in filepaths:
+            if self.__quarantine.pop(filepath, None) is not None:
+                self.__saved = False
+                self.revision += 1
+
+    def entries(self):
+        """Generator of (filepath, size, mtime_ns, Replay) for every indexed replay, such as to mirror them elsewhere"""
+        for filepath, (size, mtime, replay) in self.__get_entries().items():
+            yield filepath, size, mtime, replay
+
+    def within(self, filepaths):
+        """Whether every indexed replay is one of filepaths, a set, such as those beneath a query's directories"""
+        return all(filepath in filepaths for filepath in self.__get_entries())
+
+    def rollups(self):
+        """ReplayRollups of every indexed replay, which is only built once and then updated as replays come and go,
+        so take a copy of it while holding the lock to use it elsewhere"""
+        if self.__rollups is None:
+            self.__rollups = ReplayRollups(replay for _, _, replay in self.__get_entries().values())
+        return self.__rollups
+
+    def table(self):
+        """ReplayTable of every indexed replay, for evaluating queries over all of them at once"""
+        if self.__table is None:
+            from ReplayTable import ReplayTable  # which imports numpy, so is left until a table is first wanted
+
+            self.__table = ReplayTable(replay for _, _, replay in self.__get_entries().values())
+        return self.__table
+
+    @staticmethod
+    def __current(entries, filepath, file_stat):
+        """The indexed Replay for filepath, if the file has not changed since it was indexed"""
+        cached = entries.get(filepath)
+        if cached is not None and cached[0] == file_stat.st_size and cached[1] == file_stat.st_mtime_ns:
+            return cached[2]
+
+    def lookup(self, filepath):
+        """Return the Replay for filepath, only parsing the file if it is new or has changed since it was indexed.
+        :raises ReplayParser.ReplayParseException: if the file cannot be read or parsed, or is quarantined as such
+        """
+        entries = self.__get_entries()
+        try:
+            file_stat = stat(filepath)
+        except OSError as e:  # such as a replay deleted since it was listed
+            self.__drop(entries, filepath)
+            raise ReplayParser.ReplayParseException("Unreadable file: %s" % e.strerror, filepath) from None
+        if (cached := self.__current(entries, filepath, file_stat)) is not None:
+            return cached
+        if (failure := self.__quarantined(filepath, file_stat)) is not None:
+            raise failure
+        try:
+            replay = self.__parser.parse(filepath)
+        except ReplayParser.ReplayParseException as e:
+            self.__quarantine_failure(entries, filepath, file_stat.st_size, file_stat.st_mtime_ns, e)
+            raise
+        self.__release((filepath,))
+        self.__store(entries, filepath, (file_stat.st_size, file_stat.st_mtime_ns, replay))
+        return replay
+
+    def update(self, filepaths, workers=1, io_threads=0, modified_since=None, metrics=None):
+        """Bring the index up to date with filepaths, parsing only new or changed files, across processes if asked.
+        filepaths may be a generator, and may hold os.DirEntry objects (such as from ReplayParser.scan_replays),
+        whose cached stat is used rather than asking the file system again.
+        With io_threads, each chunk of files to parse is read in inode order, as ReplayParser.read_headers describes.
+        With modified_since, a timestamp, files last modified before it are left unread and unindexed, and aren't
+        yielded unless they were already indexed. A replay is written once its game is over, so none of those
+        can have been played since modified_since.
+        Files which fail to parse are quarantined, and yielded again as ReplayParseExceptions without being read
+        until they change, so ReplayParser.failure_report can summarize every one. Files which can't be stat'ed,
+        such as those deleted since they were listed, are yielded as ReplayParseExceptions too.
+        With metrics, a ScanMetrics, the files are counted by what became of them, and parsing is timed.
+        Anything stored or quarantined along the way advances revision.
+        :returns: generator of (filepath, Replay or ReplayParseException), streamed as each is ready
+        """
+        entries = self.__get_entries()
+        stale = {}
+        # counted here and only added to metrics at the end, as most files just need a lookup
+        counts = dict.fromkeys((COUNTER_FILES, COUNTER_CACHED, COUNTER_SKIPPED, COUNTER_QUARANTINED, COUNTER_PARSED,
+                                COUNTER_FAILURES), 0)
+
+        def store(parsed_replays):
+            for parsed_path, parsed in parsed_replays:
+                if isinstance(parsed, ReplayParser.Replay):
+                    self.__release((parsed_path,))
+                    self.__store(entries, parsed_path, (*stale.pop(parsed_path), parsed))
+                    counts[COUNTER_PARSED] += 1
+                else:
+                    self.__quarantine_failure(entries, parsed_path, *stale.pop(parsed_path), parsed)
+                    counts[COUNTER_FAILURES] += 1
+                yield parsed_path, parsed
+
+        try:
+            with ReplayParser.ParsingPool(self.__parser, workers, io_threads=io_threads, metrics=metrics) as pool:
+                for filepath in filepaths:
+                    counts[COUNTER_FILES] += 1
+                    entry, filepath = filepath, filepath.path if isinstance(filepath, DirEntry) else filepath
+                    try:
+                        file_stat = entry.stat() if isinstance(entry, DirEntry) else stat(filepath)
+                    except OSError as e:  # such as a replay deleted or renamed since it was listed
+                        counts[COUNTER_FAILURES] += 1
+                        self.__drop(entries, filepath)
+                        yield filepath, ReplayParser.ReplayParseException("Unreadable file: %s" % e.strerror, filepath)
+                        continue
+                    if (cached := self.__current(entries, filepath, file_stat)) is not None:
+                        counts[COUNTER_CACHED] += 1
+                        yield filepath, cached
+                    elif modified_since is not None and file_stat.st_mtime < modified_since:
+                        counts[COUNTER_SKIPPED] += 1
+                    elif (failure := self.__quarantined(filepath, file_stat)) is not None:
+                        counts[COUNTER_QUARANTINED] += 1
+                        yield filepath, failure
+                    else:
+                        stale[filepath] = file_stat.st_size, file_stat.st_mtime_ns
+                        yield from store(pool.submit(filepath, file_stat.st_ino))
+                yield from store(pool.finish())
+        finally:  # including when the caller stops early, such as a cancelled query
+            if metrics is not None:
+                for counter, amount in counts.items():
+                    metrics.count(counter, amount)
+
+    def scan(self, directories, workers=1, io_threads=0, modified_since=None, metrics=None):
+        """Stream every replay beneath directories while they are still being found, read and decoded,
+        bringing the index up to date with them, and dropping any which have since been deleted.
+        modified_since leaves older files unread, and metrics records what happened, as update describes,
+        along with the time spent walking the directories.
+        :returns: generator of (filepath, Replay or ReplayParseException)
+        """
+        present = {directory: [] for directory in directories}
+
+        def discovered():
+            for directory, found in present.items():
+                for entry in ReplayParser.scan_replays(directory):
+                    found.append(entry.path)
+                    yield entry
+        found_replays = discovered() if metrics is None else metrics.timed(discovered(), STAGE_FIND)
+        yield from self.update(found_replays, workers, io_threads, modified_since, metrics)
+        for directory, found in present.items():  # only reached once every directory has been walked completely
+            self.prune(directory, found)
+
+    def prune(self, directory, present):
+        """Drop indexed replays beneath directory which are not among the present filepaths.
+        :returns: the number of replays dropped
+        """
+        entries = self.__get_entries()
+        prefix = str(directory).rstrip(sep) + sep
+        present = set(present)
+        missing = [filepath for filepath in entries if filepath.startswith(prefix) and filepath not in present]
+        for filepath in missing:
+            self.__drop(entries, filepath)
+        self.__release([filepath for filepath in self.__quarantine
+                        if filepath.startswith(prefix) and filepath not in present])
+        return len(missing)
+
+    def remove(self, filepaths):
+        """Drop the given filepaths from the index, such as replays which have been deleted.
+        :returns: the number of replays dropped
+        """
+        entries = self.__get_entries()
+        filepaths = list(filepaths)
+        self.__release(filepaths)
+        return sum(self.__drop(entries, filepath) for filepath in filepaths)
+
+    def refresh(self, directory):
+        """Bring the index up to date with directory and return the replays found within it."""
+        present = ReplayParser.find_replays(directory)
+        self.prune(directory, present)
+        replays, failures = [], []
+        for filepath in present:
+            try:
+                replays.append(self.lookup(filepath))
+            except ReplayParser.ReplayParseException as e:
+                failures.append(e)
+        if failures:
+            print(ReplayParser.failure_report(failures))
+        return replays
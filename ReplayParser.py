@@ -1,41 +1,146 @@
-from struct import unpack, pack
 from datetime import datetime
-from base64 import urlsafe_b64encode
-from os import walk, path
+from time import perf_counter
+from sys import intern
+from collections import deque
+import os
+from os import scandir, cpu_count
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+import ReplayHeader as Header
+from ScanMetrics import ScanMetrics, STAGE_READ, STAGE_DECODE, COUNTER_BYTES
 
 
 # Replay Parser originally created by LtHummus, modified for this project
 class ReplayParser:
     class ReplayParseException(Exception):
-        pass
+        """A file which couldn't be parsed as a replay, with why in reason"""
+        def __init__(self, reason, filepath=None):
+            super().__init__(reason, filepath)  # kept as args, so that it pickles back from parsing processes
+            self.reason = reason
+            self.filepath = filepath
+
+        def __str__(self):
+            return f'{self.reason} ({self.filepath})'
 
     class Replay:
+        """A decoded replay header, kept small enough to hold a whole library of them in memory:
+        strings which repeat between replays are interned, missions are stored as bitmasks (bit i being
+        ReplayParser.MISSIONS[i]) and the date as a timestamp, with the sets and datetime built on demand.
+        Replays made by ReplayParser.parse hold on to their ReplayHeader and only decode the names, uuid and
+        variant when they are first read, so queries which never look at them never pay for them."""
+        __slots__ = (
+            'filepath', 'uuid', 'playid', 'timestamp', 'spy', 'spy_username', 'sniper', 'sniper_username',
+            'result', 'setup', 'venue', 'variant', 'guests', 'clock', 'duration',
+            'selected_mask', 'picked_mask', 'completed_mask', 'mission_container', '__header'
+        )
+        __RECORD_FIELDS = __slots__[1:-2]
+        RECORD_FIELDS = __RECORD_FIELDS  # what each item of to_record's tuple is
+        __NAME_FIELDS = ('spy', 'sniper', 'spy_username', 'sniper_username')
+        __INTERNED_FIELDS = ('spy', 'spy_username', 'sniper', 'sniper_username', 'result', 'setup', 'venue', 'variant')
+
         def __init__(
-                self, filepath, uuid, playid, date,
+                self, filepath, uuid, playid, timestamp,
                 spy_displayname, sniper_displayname, spy_username, sniper_username,
                 result, venue, variant, setup, guests, clock, duration,
-                selected_missions, picked_missions, completed_missions
+                selected_mask, picked_mask, completed_mask, mission_container=set
         ):
             self.filepath = filepath
-            if x := uuid.find('='):
+            if (x := uuid.find('=')) >= 0:
                 uuid = uuid[:x]
             self.uuid = uuid
             self.playid = playid
-            self.date = date
-            self.spy = spy_displayname[:-6] if spy_displayname.endswith('/steam') else spy_displayname
-            self.spy_username = spy_username
-            self.sniper = sniper_displayname[:-6] if sniper_displayname.endswith('/steam') else sniper_displayname
-            self.sniper_username = sniper_username
-            self.result = result
-            self.setup = setup
-            self.venue = venue
-            self.variant = variant
+            self.timestamp = timestamp
+            self.spy = intern(spy_displayname[:-6] if spy_displayname.endswith('/steam') else spy_displayname)
+            self.spy_username = intern(spy_username)
+            self.sniper = intern(sniper_displayname[:-6] if sniper_displayname.endswith('/steam')
+                                 else sniper_displayname)
+            self.sniper_username = intern(sniper_username)
+            self.result = intern(result)
+            self.setup = intern(setup)
+            self.venue = intern(venue)
+            self.variant = variant and intern(variant)
             self.guests = guests
             self.clock = clock
             self.duration = duration
-            self.selected_missions = selected_missions
-            self.completed_missions = completed_missions
-            self.picked_missions = picked_missions
+            self.selected_mask = selected_mask
+            self.picked_mask = picked_mask
+            self.completed_mask = completed_mask
+            self.mission_container = mission_container
+            self.__header = None
+
+        @classmethod
+        def from_header(cls, filepath, header, mission_container=set):
+            """A Replay of a ReplayHeader, decoding only its fixed-position fields until the rest are read
+            :raises KeyError: if the venue, result or setup mode is unknown
+            """
+            replay = cls.__new__(cls)
+            replay.filepath = filepath
+            replay.playid = header.playid
+            replay.timestamp = header.timestamp
+            replay.result = intern(Header.RESULT_MAP[header.result])
+            replay.venue = intern(Header.venue_name(header.venue, header.spyparty_version))
+            replay.setup = intern(Header.game_type(header.setup))
+            replay.guests = header.guests
+            replay.clock = header.clock
+            replay.duration = int(header.duration)
+            replay.selected_mask = header.missions_s & 0xFF
+            replay.picked_mask = header.missions_p & 0xFF
+            replay.completed_mask = header.missions_c & 0xFF
+            replay.mission_container = mission_container
+            replay.__header = header
+            return replay
+
+        def __getattr__(self, name):
+            """Decode a field which was left in the header, only called while its slot is still empty"""
+            if name.startswith('_') or (header := self.__header) is None:
+                raise AttributeError(name)
+            if name in self.__NAME_FIELDS:
+                spy, sniper, self.spy_username, self.sniper_username = map(intern, header.names())
+                self.spy = intern(spy[:-6]) if spy.endswith('/steam') else spy
+                self.sniper = intern(sniper[:-6]) if sniper.endswith('/steam') else sniper
+            elif name == 'uuid':
+                uuid = header.uuid()
+                self.uuid = uuid[:x] if (x := uuid.find('=')) >= 0 else uuid
+            elif name == 'variant':
+                self.variant = (variant := Header.variant_name(self.venue, header.variant)) and intern(variant)
+            else:
+                raise AttributeError(name)
+            return getattr(self, name)
+
+        @property
+        def date(self):
+            return datetime.fromtimestamp(self.timestamp)
+
+        @property
+        def selected_missions(self):
+            return self.mission_container(ReplayParser.missions_in(self.selected_mask))
+
+        @property
+        def picked_missions(self):
+            return self.mission_container(ReplayParser.missions_in(self.picked_mask))
+
+        @property
+        def completed_missions(self):
+            return self.mission_container(ReplayParser.missions_in(self.completed_mask))
+
+        def to_record(self):
+            """Flatten the decoded fields into a tuple, so they can be stored without the class"""
+            record = tuple(getattr(self, field) for field in self.__RECORD_FIELDS)
+            self.__header = None  # everything has been decoded now
+            return record
+
+        @classmethod
+        def from_record(cls, filepath, record, mission_container=set):
+            """Rebuild a Replay from to_record's output without decoding the file again"""
+            replay = cls.__new__(cls)
+            replay.filepath = filepath
+            for field, value in zip(cls.__RECORD_FIELDS, record):
+                setattr(replay, field, value)
+            for field in cls.__INTERNED_FIELDS:  # records which crossed a process boundary arrive as copies
+                if (value := getattr(replay, field)) is not None:
+                    setattr(replay, field, intern(value))
+            replay.mission_container = mission_container
+            replay.__header = None
+            return replay
 
         def spy_win(self):
             return self.result in {"Missions Win", "Civilian Shot"}
@@ -74,303 +179,515 @@ class ReplayParser:
                 ) if key
             }
 
-    class __ReplayVersionConstants:
-        def __init__(
-                self, magic_number=0x00, file_version=0x04, protocol_version=0x08, spyparty_version=0x0C,
-                duration=0x14, uuid=0x18, timestamp=0x28, playid=0x2C, players=0x50,
-                len_user_spy=0x2E, len_user_sniper=0x2F, len_disp_spy=None, len_disp_sniper=None,
-                guests=None, clock=None, result=0x30, setup=0x34, venue=0x38, variant=None,
-                missions_s=0x3C, missions_p=0x40, missions_c=0x44
-        ):
-            self.magic_number = magic_number
-            self.file_version = file_version
-            self.protocol_version = protocol_version
-            self.spyparty_version = spyparty_version
-            self.duration = duration
-            self.uuid = uuid
-            self.timestamp = timestamp
-            self.playid = playid
-            self.players = players
-            self.len_user_spy = len_user_spy
-            self.len_user_sniper = len_user_sniper
-            self.len_disp_spy = len_disp_spy
-            self.len_disp_sniper = len_disp_sniper
-            self.guests = guests
-            self.clock = clock
-            self.result = result
-            self.setup = setup
-            self.venue = venue
-            self.variant = variant
-            self.missions_s = missions_s
-            self.missions_p = missions_p
-            self.missions_c = missions_c
+    class ReplayBatch:
+        """Headers of many replays decoded into columns by parse_batch, where row i describes filepaths[i].
+        Venues and results are stored as their index into ReplayParser.VENUES and ReplayParser.RESULTS,
+        setups as the raw setup word, missions as 8 bit masks, and absent guests, clock or variant as -1.
+        Names are kept as the bytes they were read as, name_bytes[i] holding row i's four names end to end with
+        their lengths in name_lengths[i], and are only decoded by names, or by reading a column of them."""
+        def __init__(self, filepaths, columns, name_bytes, name_lengths, failures):
+            self.filepaths = filepaths
+            self.uuid = columns['uuid']
+            self.playid = columns['playid']
+            self.timestamp = columns['timestamp']
+            self.duration = columns['duration']
+            self.venue = columns['venue']
+            self.variant = columns['variant']
+            self.result = columns['result']
+            self.setup = columns['setup']
+            self.guests = columns['guests']
+            self.clock = columns['clock']
+            self.selected_missions = columns['missions_s']
+            self.picked_missions = columns['missions_p']
+            self.completed_missions = columns['missions_c']
+            self.name_bytes = name_bytes
+            self.name_lengths = name_lengths  # spy username, sniper username, spy and sniper display name
+            self.failures = failures  # (filepath, reason) of every file which could not be decoded
+            self.__names = None  # every row's names, once a column of them has been read
+
+        def __len__(self):
+            return len(self.filepaths)
 
         @staticmethod
-        def read_bytes(sector, start, length):
-            return sector[start:(start + length)]
-
-        def extract_names(self, sector):
-            total_offset = self.players
-
-            spy_user_len = sector[self.len_user_spy]
-            spy_username = self.read_bytes(sector, total_offset, spy_user_len).decode()
-            total_offset += spy_user_len
-
-            sni_user_len = sector[self.len_user_sniper]
-            sniper_username = self.read_bytes(sector, total_offset, sni_user_len).decode()
-
-            spy_display_name, sniper_display_name = spy_username, sniper_username
-            if self.len_disp_spy or self.len_disp_sniper:
-                total_offset += sni_user_len
-                spy_disp_len = sector[self.len_disp_spy]
-                spy_display_name = self.read_bytes(sector, total_offset, spy_disp_len).decode()
-
-                total_offset += spy_disp_len
-                sni_disp_len = sector[self.len_disp_sniper]
-                sniper_display_name = self.read_bytes(sector, total_offset, sni_disp_len).decode()
-
-                if not spy_display_name:
-                    spy_display_name = spy_username
-                if not sniper_display_name:
-                    sniper_display_name = sniper_username
-            return spy_display_name, sniper_display_name, spy_username, sniper_username
-
-    __HEADER_DATA_MINIMUM_BYTES = 416
-    __HEADER_DATA_USERNAME_LIMIT = 33
-    __HEADER_DATA_DISPLAYNAME_LIMIT = 135
-    __HEADER_DATA_MAXIMUM_BYTES = __HEADER_DATA_MINIMUM_BYTES + 2 * (__HEADER_DATA_USERNAME_LIMIT +
-                                                                     __HEADER_DATA_DISPLAYNAME_LIMIT)
-    __OFFSETS_DICT = {
-        3: __ReplayVersionConstants(),
-        4: __ReplayVersionConstants(
-            players=0x54,
-            result=0x34,
-            setup=0x38,
-            venue=0x3C,
-            missions_s=0x40,
-            missions_p=0x44,
-            missions_c=0x48
-        ),
-        5: __ReplayVersionConstants(
-            players=0x60,
-            len_user_spy=0x2E,
-            len_user_sniper=0x2F,
-            len_disp_spy=0x30,
-            len_disp_sniper=0x31,
-            guests=0x50,
-            clock=0x54,
-            result=0x38,
-            setup=0x3C,
-            venue=0x40,
-            missions_s=0x44,
-            missions_p=0x48,
-            missions_c=0x4C
-        ),
-        6: __ReplayVersionConstants(
-            players=0x64,
-            len_user_spy=0x2E,
-            len_user_sniper=0x2F,
-            len_disp_spy=0x30,
-            len_disp_sniper=0x31,
-            guests=0x54,
-            clock=0x58,
-            result=0x38,
-            setup=0x3C,
-            venue=0x40,
-            variant=0x44,
-            missions_s=0x48,
-            missions_p=0x4C,
-            missions_c=0x50
-        )
-    }
-    __VENUE_MAP = None
-    __VARIANT_MAP = {
-        "Teien": [
-            "BooksBooksBooks",
-            "BooksStatuesBooks",
-            "StatuesBooksBooks",
-            "StatuesStatuesBooks",
-            "BooksBooksStatues",
-            "BooksStatuesStatues",
-            "StatuesBooksStatues",
-            "StatuesStatuesStatues"
-        ],
-        "Aquarium": [
-            "Bottom",
-            "Top"
-        ],
-    }
-    __RESULT_MAP = {
-        0: "Missions Win",
-        1: "Time Out",
-        2: "Spy Shot",
-        3: "Civilian Shot",
-        4: "In Progress"
-    }
-    __MODE_MAP = {
-        0: "k",
-        1: "p",
-        2: "a"
-    }
-    __MISSION_OFFSETS = {
-        "Bug": 0,
-        "Contact": 1,
-        "Transfer": 2,
-        "Swap": 3,
-        "Inspect": 4,
-        "Seduce": 5,
-        "Purloin": 6,
-        "Fingerprint": 7,
-    }
-
-    def __init__(self):
-        if self.__VENUE_MAP is None:
-            self.__OFFSETS_DICT[2] = self.__OFFSETS_DICT[3]
-            # v2 is nearly identical to v3 according to plastikqs!
-
-            def endian_swap(value):
-                return unpack("<I", pack(">I", value))[0]
-
-            self.__VENUE_MAP = {
-                0x8802482A: "Old High-rise",
-                endian_swap(0x26C3303A): "High-rise",
-                endian_swap(0xAAFA9659): "Ballroom",
-                endian_swap(0x2519125B): "Ballroom",
-                endian_swap(0xA1C5561A): "High-rise",
-                endian_swap(0x5EAAB328): "Old Gallery",
-                endian_swap(0x750C0A29): "Old Courtyard 2",
-                endian_swap(0x83F59536): "Panopticon",
-                endian_swap(0x91A0BEA8): "Old Veranda",
-                endian_swap(0xBC1F89B8): "Old Balcony",
-                endian_swap(0x4073020D): "Pub",
-                endian_swap(0xF3FF853B): "Pub",
-                endian_swap(0xB0E7C209): "Old Ballroom",
-                endian_swap(0x6B68CFB4): "Old Courtyard",
-                endian_swap(0x8FE37670): "Double Modern",
-                endian_swap(0x206114E6): "Modern",
-                0x6f81a558: "Veranda",
-                0x9dc5bb5e: "Courtyard",
-                0x168f4f62: "Library",
-                0x1dbd8e41: "Balcony",
-                0x7173b8bf: "Gallery",
-                0x9032ce22: "Terrace",
-                0x2e37f15b: "Moderne",
-                0x79dfa0cf: "Teien",
-                0x98e45d99: "Aquarium",
-                0x35ac5135: "Redwoods",
-                0xf3e61461: "Modern"
-            }
-
-    def __unpack_missions(self, sector, offset, container_type):
-        data = self.__unpack_int(sector, offset)
-        missions = container_type()
-        if container_type == set:
-            for mission in self.__MISSION_OFFSETS:
-                if data & (1 << self.__MISSION_OFFSETS[mission]):
-                    missions.add(mission)
-        elif container_type == list:
-            for mission in self.__MISSION_OFFSETS:
-                if data & (1 << self.__MISSION_OFFSETS[mission]):
-                    missions.append(mission)
-        return missions
-
-    def __get_game_type(self, info):
-        mode = info >> 28
-        available = (info & 0x0FFFC000) >> 14
-        required = info & 0x00003FFF
-        real_mode = self.__MODE_MAP[mode]
-        if real_mode == 'k':
-            available = required
-        return "%s%d/%d" % (real_mode, required, available)
+        def decode_names(data, lengths):
+            """(spy, sniper, spy username, sniper username) of names laid end to end in data, with display names
+            defaulting to usernames and without any /steam suffix
+            :raises UnicodeDecodeError: if a name isn't UTF-8
+            """
+            names, start = [], 0
+            for length in lengths:
+                names.append(str(data[start:start + length], 'utf-8'))
+                start += length
+            spy_username, sniper_username, spy, sniper = names
+            spy, sniper = spy or spy_username, sniper or sniper_username
+            return (spy[:-6] if spy.endswith('/steam') else spy, sniper[:-6] if sniper.endswith('/steam') else sniper,
+                    spy_username, sniper_username)
+
+        def names(self, row):
+            """(spy, sniper, spy username, sniper username) of row, decoded now"""
+            return self.decode_names(self.name_bytes[row].tobytes(), self.name_lengths[row].tolist())
+
+        def __columns(self):
+            if self.__names is None:
+                self.__names = tuple(map(list, zip(*map(self.names, range(len(self))))) or ([], [], [], []))
+            return self.__names
+
+        @property
+        def spy(self):
+            return self.__columns()[0]
+
+        @property
+        def sniper(self):
+            return self.__columns()[1]
+
+        @property
+        def spy_username(self):
+            return self.__columns()[2]
+
+        @property
+        def sniper_username(self):
+            return self.__columns()[3]
+
+    class ParsingPool:
+        """Feeds replays to worker processes a chunk at a time, so that parsing overlaps with whatever is producing
+        the filepaths. Nothing is started until a whole chunk is waiting, and with a single worker
+        (or too few replays to be worth the processes) each replay is simply parsed where it is submitted.
+        With io_threads, replays are always chunked, and each chunk is read in inode order through
+        ReplayParser.read_headers; the order is only within a chunk, so submit replays in roughly the order they
+        were found to keep the chunks close together on the disk.
+        With metrics, a ScanMetrics, reads and decodes are timed wherever they happen."""
+        def __init__(self, parser, workers=None, chunk_size=256, io_threads=0, metrics=None):
+            self.__parser = parser
+            self.__workers = workers or cpu_count() or 1
+            self.__chunk_size = chunk_size
+            self.__io_threads = io_threads
+            self.__metrics = metrics
+            self.__chunk = []
+            self.__inodes = []
+            self.__pool = None
+            self.__pending = set()
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *_):
+            self.close()
+
+        def close(self):
+            if self.__pool is not None:
+                for future in self.__pending:
+                    future.cancel()
+                self.__pool.shutdown()
+                self.__pool = None
+
+        def __parse_here(self, replays, inodes=None):
+            if self.__io_threads:
+                yield from self.__parser.parse_cold(replays, inodes, self.__io_threads, metrics=self.__metrics)
+                return
+            for filepath in replays:
+                try:
+                    yield filepath, self.__parser.parse(filepath, metrics=self.__metrics)
+                except ReplayParser.ReplayParseException as e:
+                    yield filepath, e
+
+        def __submit_chunk(self):
+            self.__pending.add(self.__pool.submit(
+                _parse_chunk, self.__chunk, self.__inodes, self.__io_threads, self.__metrics is not None))
+
+        def __results(self, future):
+            parsed_replays, snapshot = future.result()
+            if snapshot is not None:
+                self.__metrics.merge(snapshot)
+            for filepath, parsed in parsed_replays:
+                if isinstance(parsed, tuple):
+                    parsed = ReplayParser.Replay.from_record(filepath, parsed)
+                yield filepath, parsed
+
+        def submit(self, filepath, inode=None):
+            """Queue filepath for parsing
+            :param
+                inode (int): the file's inode number if it's known, which reads are ordered by with io_threads
+            :returns: generator of (filepath, Replay or ReplayParseException) for whichever replays have finished
+            """
+            if self.__workers <= 1 and not self.__io_threads:
+                yield from self.__parse_here((filepath,))
+                return
+            self.__chunk.append(filepath)
+            self.__inodes.append(inode)
+            if len(self.__chunk) >= self.__chunk_size:
+                if self.__workers <= 1:  # only chunked so that the reads could be ordered
+                    yield from self.__parse_here(self.__chunk, self.__inodes)
+                else:
+                    if self.__pool is None:
+                        self.__pool = ProcessPoolExecutor(max_workers=self.__workers)
+                    self.__submit_chunk()
+                self.__chunk, self.__inodes = [], []
+            for future in [future for future in self.__pending if future.done()]:
+                self.__pending.remove(future)
+                yield from self.__results(future)
+
+        def finish(self):
+            """Parse whatever is still queued
+            :returns: generator of (filepath, Replay or ReplayParseException) for every replay not yet returned
+            """
+            if self.__pool is None:  # starting the pool would cost more than it saves
+                yield from self.__parse_here(self.__chunk, self.__inodes)
+            else:
+                if self.__chunk:
+                    self.__submit_chunk()
+                for future in as_completed(self.__pending):
+                    yield from self.__results(future)
+                self.__pending.clear()
+            self.__chunk, self.__inodes = [], []
+
+    __HEADER_DATA_MINIMUM_BYTES = Header.HEADER_DATA_MINIMUM_BYTES
+    __HEADER_DATA_MAXIMUM_BYTES = Header.HEADER_DATA_MAXIMUM_BYTES
+    __OFFSETS_DICT = Header.OFFSETS_DICT
+    __VENUE_MAP = Header.VENUE_MAP
+    __PREAMBLE = Header.PREAMBLE
+    VENUES = tuple(sorted({*__VENUE_MAP.values(), 'Old Terrace'}))  # a venue's index is its code in a ReplayBatch
+    RESULTS = tuple(map(Header.RESULT_MAP.get, sorted(Header.RESULT_MAP)))  # likewise for results, by file code
+    MISSIONS = tuple(sorted(Header.MISSION_OFFSETS, key=Header.MISSION_OFFSETS.get))  # a mission's index is its bit
 
     @staticmethod
-    def __read_bytes(sector, start, length):
-        return sector[start:(start + length)]
-
-    @staticmethod
-    def __unpack_byte(sector, offset):
-        return unpack('B', sector[offset])[0]
-
-    def __unpack_float(self, sector, offset):
-        return unpack('f', self.__read_bytes(sector, offset, 4))[0]
-
-    def __unpack_int(self, sector, start):
-        return unpack('I', self.__read_bytes(sector, start, 4))[0]
-
-    def __unpack_short(self, sector, start):
-        return unpack('H', self.__read_bytes(sector, start, 2))[0]
-
-    def parse(self, replay_file_path, mission_container=set):
-        with open(replay_file_path, "rb") as replay_file:
-            # Again, thanks to Checker for a fantastic suggestion!
-            bytes_read = bytearray(replay_file.read(self.__HEADER_DATA_MAXIMUM_BYTES))
-
-        if len(bytes_read) < self.__HEADER_DATA_MINIMUM_BYTES:
-            raise ReplayParser.ReplayParseException("A minimum of %d bytes are required for replay parsing (%s)"
-                                                    % (self.__HEADER_DATA_MINIMUM_BYTES, replay_file_path))
-
-        if bytes_read[:4] != b"RPLY":
-            raise ReplayParser.ReplayParseException("Unknown File (%s)" % replay_file_path)
+    def missions_in(bitmask):
+        """Names of the missions in a bitmask, in the order of MISSIONS"""
+        return Header.MISSIONS_BY_BITMASK[bitmask]
+
+    def parse(self, replay_file_path, mission_container=set, metrics=None):
+        """
+        :param
+            metrics (ScanMetrics): to time the read and the decode in, if given
+        """
+        start = perf_counter()
+        try:
+            with open(replay_file_path, "rb") as replay_file:
+                # Again, thanks to Checker for a fantastic suggestion!
+                header = replay_file.read(self.__HEADER_DATA_MAXIMUM_BYTES)
+        except OSError as e:
+            raise ReplayParser.ReplayParseException("Unreadable file: %s" % e.strerror, replay_file_path) from None
+        if metrics is None:
+            return self.decode(header, replay_file_path, mission_container)
+        read = perf_counter()
+        metrics.record(STAGE_READ, read - start)
+        metrics.count(COUNTER_BYTES, len(header))
+        try:
+            return self.decode(header, replay_file_path, mission_container)
+        finally:
+            metrics.record(STAGE_DECODE, perf_counter() - read)
+
+    # only where the platform has them, so Windows reads each header with a plain open and read
+    __pread = getattr(os, 'pread', None)
+    __fadvise = getattr(os, 'posix_fadvise', None)
+
+    def __read_header(self, replay_file_path):
+        """Read one header by file descriptor, advising the OS to fetch just the header rather than read ahead"""
+        width = self.__HEADER_DATA_MAXIMUM_BYTES
+        fd = os.open(replay_file_path, os.O_RDONLY | getattr(os, 'O_BINARY', 0))
+        try:
+            if self.__fadvise is not None:
+                self.__fadvise(fd, 0, 0, os.POSIX_FADV_RANDOM)
+                self.__fadvise(fd, 0, width, os.POSIX_FADV_WILLNEED)
+            return self.__pread(fd, width, 0) if self.__pread is not None else os.read(fd, width)
+        finally:
+            os.close(fd)
+
+    def read_headers(self, replay_file_paths, inodes=None, threads=8):
+        """Read many replays' headers the way a cold cache or a spinning disk wants them: in inode order,
+        which file systems mostly allocate in disk order, with a bounded number of reads in flight on a pool of
+        threads, so that the disk can serve several from one sweep rather than seeking back and forth for each.
+        Only the files of one call are ordered together, so a ParsingPool orders each chunk by itself.
+        :param
+            inodes (list): inode number of each filepath, such as from an earlier stat, or None to look them up
+        :returns: generator of (filepath, header bytes or OSError), those which couldn't be looked up and then
+            the rest in inode order
+        """
+        replay_file_paths = list(replay_file_paths)
+        if inodes is None:
+            inodes = [None] * len(replay_file_paths)
+        ordered = []
+        for filepath, inode in zip(replay_file_paths, inodes):
+            if inode is None:
+                try:
+                    inode = os.stat(filepath).st_ino
+                except OSError as e:  # as if its read had failed
+                    yield filepath, e
+                    continue
+            ordered.append((inode, filepath))
+        ordered = [filepath for _, filepath in sorted(ordered)]
+
+        def read(filepath):
+            try:
+                return filepath, self.__read_header(filepath)
+            except OSError as e:
+                return filepath, e
+
+        in_flight = deque()
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            for filepath in ordered:
+                in_flight.append(pool.submit(read, filepath))
+                if len(in_flight) >= threads * 2:  # enough queued for the disk to order, without reading ahead of use
+                    yield in_flight.popleft().result()
+            while in_flight:
+                yield in_flight.popleft().result()
+
+    def parse_cold(self, replay_file_paths, inodes=None, threads=8, mission_container=set, metrics=None):
+        """Parse replays whose headers probably aren't cached, reading them through read_headers
+        :param
+            metrics (ScanMetrics): to time the reads in, as the wait for each header, and the decodes, if given
+        :returns: generator of (filepath, Replay or ReplayParseException), in the order read_headers reads them
+        """
+        headers = self.read_headers(replay_file_paths, inodes, threads)
+        for filepath, header in headers if metrics is None else metrics.timed(headers, STAGE_READ):
+            try:
+                if isinstance(header, OSError):
+                    raise ReplayParser.ReplayParseException("Unreadable file: %s" % header.strerror, filepath)
+                if metrics is None:
+                    yield filepath, self.decode(header, filepath, mission_container)
+                    continue
+                metrics.count(COUNTER_BYTES, len(header))
+                with metrics.stage(STAGE_DECODE):
+                    replay = self.decode(header, filepath, mission_container)
+                yield filepath, replay
+            except ReplayParser.ReplayParseException as e:
+                yield filepath, e
+
+    def decode(self, header, replay_file_path=None, mission_container=set):
+        """Decode the header bytes of a .replay file, as read by parse
+        :raises ReplayParser.ReplayParseException: if the header is too short, isn't a replay's, is of a file
+            version, venue, result or game mode which isn't known, or has a name which isn't UTF-8
+        """
+        if len(header) < self.__HEADER_DATA_MINIMUM_BYTES:
+            raise ReplayParser.ReplayParseException("A minimum of %d bytes are required for replay parsing"
+                                                    % self.__HEADER_DATA_MINIMUM_BYTES, replay_file_path)
+
+        header = memoryview(header)
+        magic_number, read_file_version = self.__PREAMBLE.unpack_from(header)
+        if magic_number != b"RPLY":
+            raise ReplayParser.ReplayParseException("Unknown File", replay_file_path)
 
-        read_file_version = self.__unpack_int(bytes_read, 0x04)
         try:
             offsets = self.__OFFSETS_DICT[read_file_version]
         except KeyError:
-            raise ReplayParser.ReplayParseException("Unknown file version %d (%s)"
-                                                    % (replay_file_path, read_file_version))
+            raise ReplayParser.ReplayParseException("Unknown file version %d" % read_file_version,
+                                                    replay_file_path) from None
 
-        name_extracts = offsets.extract_names(bytes_read)
-        uuid_offset = offsets.uuid
-
-        date = datetime.fromtimestamp(self.__unpack_int(bytes_read, offsets.timestamp))
-        venue = self.__VENUE_MAP[self.__unpack_int(bytes_read, offsets.venue)]
-        if venue == 'Terrace' and self.__unpack_int(bytes_read, offsets.spyparty_version) < 6016:  # Thanks checker!
-            venue = 'Old Terrace'
+        # only the cheap fields are decoded now, the Replay decodes the rest from the header if they're asked for
+        header = Header.ReplayHeader(header, offsets)
+        try:
+            header.check_names()
+            return ReplayParser.Replay.from_header(replay_file_path, header, mission_container)
+        except KeyError as e:  # such as a venue added since this version of ReParty, or an alpha's
+            raise ReplayParser.ReplayParseException("Unknown venue, result or game mode %r" % e.args[0],
+                                                    replay_file_path) from None
+        except UnicodeDecodeError as e:
+            raise ReplayParser.ReplayParseException("Undecodable player name: %s" % e.reason,
+                                                    replay_file_path) from None
+
+    def parse_batch(self, replay_file_paths, block_size=16384):
+        """Decode many headers at once into a ReplayBatch of columns, for scans which want those rather than Replays.
+        Headers are read block_size at a time into one contiguous buffer, then each file version's rows are
+        decoded together through a numpy structured dtype. Names are only copied out, and left for the batch to
+        decode when they're read; only rows with names beyond ASCII are decoded now, to check they're UTF-8.
+        """
+        import numpy  # only bulk scans need numpy, so it isn't imported with the module
+
+        width = self.__HEADER_DATA_MAXIMUM_BYTES
+        # every byte which can follow the players offset of any file version, so no name is cut shorter than by parse
+        names_width = width - min(offsets.players for offsets in self.__OFFSETS_DICT.values())
+        venue_keys = numpy.array(sorted(self.__VENUE_MAP), dtype=numpy.uint32)
+        venue_codes = numpy.array([self.VENUES.index(self.__VENUE_MAP[key]) for key in venue_keys], numpy.int8)
+        terrace, old_terrace = self.VENUES.index('Terrace'), self.VENUES.index('Old Terrace')
+        preamble = numpy.dtype({'names': ['magic', 'version'], 'formats': ['V4', '<u4'], 'offsets': [0, 4],
+                                'itemsize': width})
+        length_fields = ('len_user_spy', 'len_user_sniper', 'len_disp_spy', 'len_disp_sniper')
+
+        filepaths, failures, order, name_bytes, name_lengths = [], [], [], [], []
+        blocks = {name: [] for name in (
+            'uuid', 'playid', 'timestamp', 'duration', 'venue', 'variant', 'result', 'setup', 'guests', 'clock',
+            'missions_s', 'missions_p', 'missions_c')}
+        buffer = bytearray(width * block_size)
+        view = memoryview(buffer)
+        replay_file_paths = list(replay_file_paths)
+        for start in range(0, len(replay_file_paths), block_size):
+            block_paths = replay_file_paths[start:start + block_size]
+            lengths = []
+            for row, filepath in enumerate(block_paths):
+                try:
+                    with open(filepath, "rb", buffering=0) as replay_file:  # unbuffered, as it reads straight in
+                        length = replay_file.readinto(view[row * width:(row + 1) * width])
+                except OSError as e:
+                    failures.append((filepath, "Unreadable file: %s" % e.strerror))
+                    length = -1  # so that it isn't also reported as too short
+                if length < width:  # don't let the previous block's header show through a short file
+                    buffer[row * width + max(length, 0):(row + 1) * width] = bytes(width - max(length, 0))
+                lengths.append(length)
+            lengths = numpy.array(lengths)
+
+            rows = numpy.frombuffer(buffer, preamble, count=len(block_paths))
+            valid = (lengths >= self.__HEADER_DATA_MINIMUM_BYTES) & (rows['magic'] == numpy.void(b'RPLY'))
+            for version, offsets in self.__OFFSETS_DICT.items():
+                if not (selected := numpy.flatnonzero(valid & (rows['version'] == version))).size:
+                    continue
+                decoded = numpy.frombuffer(buffer, offsets.dtype(numpy, width), count=len(block_paths))[selected]
+
+                position = numpy.searchsorted(venue_keys, decoded['venue'])
+                known = venue_keys[numpy.minimum(position, len(venue_keys) - 1)] == decoded['venue']
+                known &= decoded['result'] < len(self.RESULTS)
+                for row in selected[~known]:
+                    failures.append((block_paths[row], "Unknown venue or result"))
+                selected, decoded, position = selected[known], decoded[known], position[known]
+
+                # each row's names, with whatever follows them in the header zeroed out. Like parse, names running
+                # past what was read of the file are cut short there, rather than failing
+                lengths_of_names = numpy.zeros((len(selected), 4), numpy.int32)
+                for column, field in enumerate(length_fields):
+                    if getattr(offsets, field) is not None:
+                        lengths_of_names[:, column] = decoded[field]
+                available = numpy.minimum(lengths[selected], width) - offsets.players
+                starts = numpy.cumsum(lengths_of_names, axis=1) - lengths_of_names
+                lengths_of_names = numpy.clip(available[:, None] - starts, 0, lengths_of_names).astype(numpy.int32)
+                total = lengths_of_names.sum(axis=1)
+                names = numpy.zeros((len(selected), names_width), numpy.uint8)
+                names[:, :width - offsets.players] = numpy.frombuffer(
+                    buffer, numpy.uint8, count=len(block_paths) * width).reshape(-1, width)[selected, offsets.players:]
+                names[numpy.arange(names_width) >= total[:, None]] = 0
+                decodable = numpy.ones(len(selected), bool)
+                for row in numpy.flatnonzero((names >= 0x80).any(axis=1)):  # ASCII is always UTF-8
+                    try:
+                        ReplayParser.ReplayBatch.decode_names(names[row].tobytes(), lengths_of_names[row].tolist())
+                    except UnicodeDecodeError as e:
+                        failures.append((block_paths[selected[row]], "Undecodable player name: %s" % e.reason))
+                        decodable[row] = False
+                selected, decoded, position = selected[decodable], decoded[decodable], position[decodable]
+                name_bytes.append(names[decodable])
+                name_lengths.append(lengths_of_names[decodable])
+
+                venue = venue_codes[position]
+                venue[(venue == terrace) & (decoded['spyparty_version'] < 6016)] = old_terrace  # Thanks checker!
+
+                filepaths.extend(block_paths[row] for row in selected)
+                order.append(selected + start)
+                for name in ('uuid', 'playid', 'timestamp', 'setup', 'missions_s', 'missions_p', 'missions_c'):
+                    blocks[name].append(decoded[name])
+                blocks['duration'].append(decoded['duration'].astype(numpy.int32))
+                blocks['venue'].append(venue)
+                blocks['result'].append(decoded['result'].astype(numpy.uint8))
+                for name in ('variant', 'guests', 'clock'):
+                    blocks[name].append(decoded[name].astype(numpy.int32) if getattr(offsets, name)
+                                        else numpy.full(len(selected), -1, numpy.int32))
+            for row in numpy.flatnonzero(~valid & (lengths >= 0)):
+                failures.append((block_paths[row], "Too short or not a replay"))
+            for row in numpy.flatnonzero(valid & ~numpy.isin(rows['version'], list(self.__OFFSETS_DICT))):
+                failures.append((block_paths[row], "Unknown file version %d" % rows['version'][row]))
+
+        # rows were decoded one file version at a time, so put them back in the order they were given
+        order = numpy.argsort(numpy.concatenate(order), kind='stable') if order else numpy.zeros(0, numpy.intp)
+        columns = {name: numpy.concatenate(parts)[order] if parts else numpy.zeros(0, numpy.int32)
+                   for name, parts in blocks.items()}
+        for name in ('missions_s', 'missions_p', 'missions_c'):
+            columns[name] = (columns[name] & 0xFF).astype(numpy.uint8)
+        name_bytes = numpy.concatenate(name_bytes)[order] if name_bytes else numpy.zeros((0, names_width), numpy.uint8)
+        name_lengths = numpy.concatenate(name_lengths)[order] if name_lengths else numpy.zeros((0, 4), numpy.int32)
+        return ReplayParser.ReplayBatch(
+            [filepaths[i] for i in order.tolist()], columns, name_bytes, name_lengths, failures)
 
-        variant = None
-        if offsets.variant:
+    @staticmethod
+    def scan_replays(from_directory):
+        """Generator of an os.DirEntry for each .replay beneath from_directory, yielded as soon as it is found.
+        Each entry's stat() is cached with it, and on Windows comes free with the directory listing."""
+        directories = [from_directory]
+        while directories:
             try:
-                variant = self.__VARIANT_MAP[venue][self.__unpack_int(bytes_read, offsets.variant)]
-            except KeyError:
-                pass
-
-        return ReplayParser.Replay(
-            filepath=replay_file_path,
-            uuid=urlsafe_b64encode(bytes_read[uuid_offset:uuid_offset + 16]).decode(),
-            playid=self.__unpack_short(bytes_read, offsets.playid), date=date,
-            spy_displayname=name_extracts[0], sniper_displayname=name_extracts[1],
-            spy_username=name_extracts[2], sniper_username=name_extracts[3],
-            result=self.__RESULT_MAP[self.__unpack_int(bytes_read, offsets.result)],
-            venue=venue, variant=variant, setup=self.__get_game_type(self.__unpack_int(bytes_read, offsets.setup)),
-            guests=self.__unpack_int(bytes_read, offsets.guests) if offsets.guests else None,
-            clock=self.__unpack_int(bytes_read, offsets.clock) if offsets.clock else None,
-            duration=int(self.__unpack_float(bytes_read, offsets.duration)),
-            selected_missions=self.__unpack_missions(bytes_read, offsets.missions_s, mission_container),
-            picked_missions=self.__unpack_missions(bytes_read, offsets.missions_p, mission_container),
-            completed_missions=self.__unpack_missions(bytes_read, offsets.missions_c, mission_container)
-        )
+                entries = scandir(directories.pop())
+            except OSError:  # as os.walk did, skip directories which can't be listed
+                continue
+            with entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        if not entry.name.startswith("__"):  # escape prefix for ignored directories
+                            directories.append(entry.path)
+                    elif entry.name.endswith(".replay"):
+                        if len(entry.path) > 255:
+                            # todo deal with excessively long paths later
+                            continue
+                        yield entry
+
+    @staticmethod
+    def failure_report(failures, limit=10):
+        """A summary of replays which couldn't be parsed, grouped by why, rather than a line for every one
+        :param
+            failures (iterable): ReplayParseExceptions
+        :param
+            limit (int): filepaths listed for each reason, before the rest are only counted
+        :returns: the summary's lines joined, or '' if there were no failures
+        """
+        by_reason = {}
+        for failure in failures:
+            by_reason.setdefault(failure.reason, []).append(failure.filepath)
+        if not by_reason:
+            return ''
+        lines = [f'{sum(map(len, by_reason.values()))} replays could not be parsed:']
+        for reason, filepaths in sorted(by_reason.items(), key=lambda item: -len(item[1])):
+            lines.append(f'  {reason}: {len(filepaths)}')
+            lines.extend(f'    {filepath}' for filepath in sorted(filepaths, key=str)[:limit])
+            if len(filepaths) > limit:
+                lines.append(f'    and {len(filepaths) - limit} more')
+        return '\n'.join(lines)
 
     @staticmethod
     def find_replays(from_directory):
-        replays = []
-        for root, _, files in walk(from_directory):
-            if root.startswith("__"):  # escape prefix for ignored directories
-                continue
-            for file in files:
-                if file.endswith(".replay"):
-                    file_path = path.join(root, file)
-                    if len(file_path) > 255:
-                        # todo deal with excessively long paths later
-                        continue
-                    replays.append(file_path)
-        return replays
+        return [entry.path for entry in ReplayParser.scan_replays(from_directory)]
 
     def parse_replays(self, replays):
         return map(self.parse, replays)
 
+    def parse_replays_parallel(self, replays, workers=None, chunk_size=256, io_threads=0, metrics=None):
+        """Parse replays across a pool of processes, since decoding is bound to a single core by the GIL.
+        replays may be a generator, such as scan_replays, in which case parsing starts before it is exhausted.
+        They may be filepaths or os.DirEntry objects, whose inode numbers order the reads with io_threads.
+        :param
+            workers (int): number of processes to parse with, defaults to one per CPU
+        :param
+            chunk_size (int): number of replays sent to a process at once
+        :param
+            io_threads (int): read each chunk's headers in inode order on this many threads, or 0 to read each in turn
+        :param
+            metrics (ScanMetrics): to time the reads and decodes in, if given
+        :returns: generator of (filepath, Replay or ReplayParseException), in the order the chunks finish
+        """
+        with ReplayParser.ParsingPool(self, workers, chunk_size, io_threads, metrics) as pool:
+            for filepath in replays:
+                if isinstance(filepath, os.DirEntry):
+                    yield from pool.submit(filepath.path, filepath.inode())
+                else:
+                    yield from pool.submit(filepath)
+            yield from pool.finish()
+
     @staticmethod
     def filter_replays(replays, criteria):
         return list(filter(lambda replay: not any(not crit(replay) for crit in criteria), replays))
 
     def find_and_filter_replays(self, replays_directory, criteria):
         return self.filter_replays(self.parse_replays(self.find_replays(replays_directory)), criteria)
+
+
+def _parse_chunk(replays, inodes=None, io_threads=0, measured=False):
+    """Worker process half of ReplayParser.parse_replays_parallel, which must live at module level to be picklable.
+    Records are sent back rather than Replays, as they are much cheaper to pass between processes.
+    :returns: (list of (filepath, record or ReplayParseException), ScanMetrics snapshot if measured, else None)
+    """
+    parser = ReplayParser()
+    metrics = ScanMetrics() if measured else None
+    parsed = []
+    if io_threads:
+        for filepath, replay in parser.parse_cold(replays, inodes, io_threads, metrics=metrics):
+            parsed.append((filepath, replay if isinstance(replay, ReplayParser.ReplayParseException)
+                           else replay.to_record()))
+    else:
+        for filepath in replays:
+            try:
+                parsed.append((filepath, parser.parse(filepath, metrics=metrics).to_record()))
+            except ReplayParser.ReplayParseException as e:
+                parsed.append((filepath, e))
+    return parsed, metrics.snapshot() if measured else None
@@ -0,0 +1,423 @@
+from datetime import datetime, timedelta
+from time import perf_counter
+from ReplayParser import ReplayParser
+
+ROLE_EITHER = 'both'
+ROLE_SNIPER = 'sniper'
+ROLE_SPY = 'spy'
+
+MWC_EITHER = 'Either'
+# might be desirable
+# MWC_EXTRA = 'Overcompleted'
+MWC_YES = 'Yes'
+MWC_NO = 'No'
+
+__OPPOSITE_ROLES = {ROLE_EITHER: ROLE_EITHER, ROLE_SNIPER: ROLE_SPY, ROLE_SPY: ROLE_SNIPER}
+
+
+def clean_player_name(name):
+    """Normalize a player name, so that searches ignore case and spaces"""
+    return name.lower().replace(' ', '')
+
+
+def opposite_role(role):
+    return __OPPOSITE_ROLES[role]
+
+
+def date_bound(text, end=False):
+    """Timestamp of the start of a date written as YYYY, YYYY-MM or YYYY-MM-DD, in local time as replays are dated,
+    or with end, of the start of the year, month or day after it, so that a range ending on it includes it
+    :returns: None if text is blank
+    :raises ValueError: if text isn't such a date
+    """
+    if not (text := text.strip()):
+        return None
+    try:
+        parts = [int(part) for part in text.split('-')]
+        if len(parts) > 3:
+            raise ValueError
+        start = datetime(*parts, *[1] * (3 - len(parts)))
+        if end:
+            if len(parts) == 1:
+                start = start.replace(year=start.year + 1)
+            elif len(parts) == 2:
+                start = start.replace(year=start.year + start.month // 12, month=start.month % 12 + 1)
+            else:
+                start += timedelta(days=1)
+    except ValueError:
+        raise ValueError(f'"{text}" is not a date of the form YYYY, YYYY-MM or YYYY-MM-DD') from None
+    return int(start.timestamp())
+
+
+class Predicate:
+    """A single criterion, which can be checked against one Replay at a time or over the columns of a ReplayTable.
+    Costs are relative to checking one replay's venue, and are what the QueryPlan orders predicates by."""
+    COST = 1  # of checking one Replay
+    COLUMN_COST = 1  # of checking one row of a ReplayTable
+    DEFAULT_SELECTIVITY = 0.5  # fraction of replays expected to pass, without a table to measure it on
+    INDEXED = False  # whether index_rows can find the passing rows of a table
+
+    def matches(self, replay, cleaner):
+        raise NotImplementedError
+
+    def mask(self, table, rows):
+        """Boolean array of which of the given rows of table pass"""
+        raise NotImplementedError
+
+    def selectivity(self, table=None):
+        return self.DEFAULT_SELECTIVITY
+
+    def index_rows(self, table):
+        """Sorted rows of table which pass, found through an index, for predicates which are INDEXED"""
+        raise NotImplementedError
+
+    def sql(self):
+        """(condition, parameters) of an SQL WHERE clause over a ReplayCatalog's replays table"""
+        raise NotImplementedError
+
+
+class VenuePredicate(Predicate):
+    def __init__(self, venues):
+        self.venues = frozenset(venues)
+        self.__codes = sorted(ReplayParser.VENUES.index(venue) for venue in self.venues)
+
+    def __str__(self):
+        return f'venue in {{{", ".join(sorted(self.venues))}}}'
+
+    def matches(self, replay, cleaner):
+        return replay.venue in self.venues
+
+    def mask(self, table, rows):
+        return table.venue_allowed(self.__codes)[table.venue[rows]]
+
+    def sql(self):
+        return f'venue IN ({", ".join("?" * len(self.venues))})', sorted(self.venues)
+
+    def selectivity(self, table=None):
+        if table is None or not len(table):
+            return len(self.venues) / len(ReplayParser.VENUES)
+        return table.statistics()['venue'][self.__codes].sum() / len(table)
+
+
+class ResultPredicate(Predicate):
+    def __init__(self, results):
+        self.results = frozenset(results)
+        self.__codes = sorted(ReplayParser.RESULTS.index(result) for result in self.results)
+
+    def __str__(self):
+        return f'result in {{{", ".join(sorted(self.results))}}}'
+
+    def matches(self, replay, cleaner):
+        return replay.result in self.results
+
+    def mask(self, table, rows):
+        return table.result_allowed(self.__codes)[table.result[rows]]
+
+    def sql(self):
+        return f'result IN ({", ".join("?" * len(self.results))})', sorted(self.results)
+
+    def selectivity(self, table=None):
+        if table is None or not len(table):
+            return len(self.results) / (len(ReplayParser.RESULTS) - 1)  # games in progress are rarely saved
+        return table.statistics()['result'][self.__codes].sum() / len(table)
+
+
+class MissionsPredicate(Predicate):
+    COST = 3  # builds the completed missions' container
+
+    def __init__(self, missions):
+        self.missions = frozenset(missions)
+        self.__required = sum(1 << ReplayParser.MISSIONS.index(mission) for mission in self.missions)
+
+    def __str__(self):
+        return f'completed {{{", ".join(sorted(self.missions))}}}'
+
+    def matches(self, replay, cleaner):
+        return self.missions.issubset(replay.completed_missions)
+
+    def mask(self, table, rows):
+        return (table.completed_missions[rows] & self.__required) == self.__required
+
+    def sql(self):
+        return 'completed_mask & ? = ?', [self.__required, self.__required]
+
+    def selectivity(self, table=None):
+        if table is None or not len(table):
+            return 0.5 ** len(self.missions)
+        # every row's mask is one of 256, so this is exact
+        by_mask = table.statistics()['completed']
+        passing = sum(by_mask[bitmask] for bitmask in range(256) if bitmask & self.__required == self.__required)
+        return passing / len(table)
+
+
+class MwcPredicate(Predicate):
+    COST = 3
+
+    def __init__(self, reached):
+        self.reached = reached
+
+    def __str__(self):
+        return f'mission win countdown {"reached" if self.reached else "not reached"}'
+
+    def matches(self, replay, cleaner):
+        return (bin(replay.completed_mask).count('1') >= int(replay.setup[1])) == self.reached
+
+    def mask(self, table, rows):
+        reached = table.reached_mwc()[rows]
+        return reached if self.reached else ~reached
+
+    def sql(self):
+        return 'completed_count >= required' if self.reached else 'completed_count < required', []
+
+    def selectivity(self, table=None):
+        if table is None or not len(table):
+            return self.DEFAULT_SELECTIVITY
+        reached = table.statistics()['reached'] / len(table)
+        return reached if self.reached else 1 - reached
+
+
+class DatePredicate(Predicate):
+    INDEX_COST = 10  # per row found through the time index, which is gathered in Python
+    DEFAULT_SELECTIVITY = 0.25
+    INDEXED = True
+
+    def __init__(self, start, end):
+        """
+        :param
+            start, end (int): timestamps the replay must have been played from and before, either may be None
+        """
+        self.start = start
+        self.end = end
+
+    def __str__(self):
+        bounds = [f'{word} {datetime.fromtimestamp(bound):%Y-%m-%d %H:%M}'
+                  for word, bound in (('from', self.start), ('before', self.end)) if bound is not None]
+        return f'played {" and ".join(bounds)}'
+
+    def matches(self, replay, cleaner):
+        timestamp = replay.timestamp
+        return (self.start is None or timestamp >= self.start) and (self.end is None or timestamp < self.end)
+
+    def mask(self, table, rows):
+        timestamps = table.timestamp[rows]
+        if self.start is None:
+            return timestamps < self.end
+        if self.end is None:
+            return timestamps >= self.start
+        return (timestamps >= self.start) & (timestamps < self.end)
+
+    def sql(self):
+        bounds = [(condition, bound) for condition, bound in (
+            ('timestamp >= ?', self.start), ('timestamp < ?', self.end)) if bound is not None]
+        return f'({" AND ".join(condition for condition, _ in bounds)})', [bound for _, bound in bounds]
+
+    def selectivity(self, table=None):
+        if table is None or not len(table):
+            return self.DEFAULT_SELECTIVITY
+        return table.time_count(self.start, self.end) / len(table)
+
+    def index_rows(self, table):
+        return table.time_rows(self.start, self.end)
+
+
+class PlayerPredicate(Predicate):
+    COST = 4  # cleaning the name, even when cached, and a substring search
+    COLUMN_COST = 2  # membership of the role's player id among those matching
+    INDEX_COST = 80  # per row found through the player index, which is gathered in Python
+    DEFAULT_SELECTIVITY = 0.05
+    INDEXED = True
+
+    def __init__(self, player, role):
+        self.player = player
+        self.role = role
+        self.__roles = (ROLE_SPY, ROLE_SNIPER) if role == ROLE_EITHER else (role,)
+
+    def __str__(self):
+        return f'player "{self.player}" as {self.role if self.role != ROLE_EITHER else "either role"}'
+
+    def matches(self, replay, cleaner):
+        return any(self.player in cleaner(replay.spy if role == ROLE_SPY else replay.sniper) for role in self.__roles)
+
+    def mask(self, table, rows):
+        players = table.player_ids(self.player)
+        keep = None
+        for role in self.__roles:
+            found = table.player_allowed(players)[(table.spy if role == ROLE_SPY else table.sniper)[rows]]
+            keep = found if keep is None else keep | found
+        return keep
+
+    def selectivity(self, table=None):
+        if table is None or not len(table):
+            return self.DEFAULT_SELECTIVITY
+        # counted from the index without gathering the rows, and exact unless a replay matches on both roles
+        return min(table.player_count(self.player, self.role) / len(table), 1)
+
+    def index_rows(self, table):
+        return table.player_rows(self.player, self.role)
+
+    def sql(self):
+        # substrings can't be found through an index, but the few distinct names can be searched for them first,
+        # and the replays of the names found looked up through the indexes on each role's cleaned name
+        conditions = [f'{"spy" if role == ROLE_SPY else "sniper"}_clean IN '
+                      f'(SELECT name FROM players WHERE instr(name, ?) > 0)' for role in self.__roles]
+        return f'({" OR ".join(conditions)})', [self.player] * len(conditions)
+
+
+class QueryPlan:
+    """An order in which to evaluate a query's predicates: those served by an index whose lookup is cheaper than
+    scanning for them come first, then the rest ranked by cost / (1 - selectivity), the cheapest rejections first.
+    With profile set, each step's time and the replays or rows it passed are recorded for explain."""
+    def __init__(self, predicates, table=None, profile=False):
+        self.table = table
+        self.profile = profile
+        rows = len(table) if table is not None else None
+        estimates = [(predicate, predicate.selectivity(table)) for predicate in predicates]
+
+        self.indexed = []
+        if table is not None:
+            for predicate, selectivity in estimates:
+                if predicate.INDEXED and selectivity * rows * predicate.INDEX_COST < rows * predicate.COLUMN_COST:
+                    self.indexed.append((predicate, selectivity))
+            self.indexed.sort(key=lambda estimate: estimate[1])
+        cost = 'COLUMN_COST' if table is not None else 'COST'
+        self.filtered = sorted(
+            (estimate for estimate in estimates if estimate not in self.indexed),
+            key=lambda estimate: getattr(estimate[0], cost) / max(1 - estimate[1], 1e-9))
+        self.steps = [predicate for predicate, _ in self.indexed + self.filtered]
+        self.timings = [0.0] * len(self.steps)  # seconds spent in each step, while profiling
+        self.passed = [0] * len(self.steps)  # replays or rows which got through each step, while profiling
+        self.evaluated = 0
+
+    def matches(self, replay, cleaner=clean_player_name):
+        """Whether a single Replay satisfies every predicate, checking them in the planned order"""
+        if not self.profile:
+            for predicate in self.steps:
+                if not predicate.matches(replay, cleaner):
+                    return False
+            return True
+        self.evaluated += 1
+        for step, predicate in enumerate(self.steps):
+            start = perf_counter()
+            passed = predicate.matches(replay, cleaner)
+            self.timings[step] += perf_counter() - start
+            if not passed:
+                return False
+            self.passed[step] += 1
+        return True
+
+    def mask(self, table):
+        """Mask of the rows of table which satisfy every predicate. Index lookups give the starting rows,
+        and every later predicate is only evaluated over the rows which are still left."""
+        import numpy  # only tables need numpy, so it isn't imported with the module
+
+        rows = None
+        self.evaluated += len(table)
+        for step, predicate in enumerate(self.steps):
+            start = perf_counter()
+            if step < len(self.indexed):
+                found = predicate.index_rows(table)
+                rows = found if rows is None else numpy.intersect1d(rows, found, assume_unique=True)
+            else:
+                if rows is None:
+                    rows = numpy.arange(len(table))
+                rows = rows[predicate.mask(table, rows)]
+            self.timings[step] += perf_counter() - start
+            self.passed[step] += len(rows)
+            if not len(rows):
+                break
+        mask = numpy.zeros(len(table), bool)
+        mask[slice(None) if rows is None else rows] = True
+        return mask
+
+    def explain(self):
+        """Lines describing the plan and, if it was profiled, how each step actually went"""
+        total = len(self.table) if self.table is not None else None
+        lines = [f'QUERY PLAN over {f"a table of {total:,} replays" if total is not None else "one replay at a time"}']
+        if not self.steps:
+            lines.append('  every replay matches')
+        for step, (predicate, selectivity) in enumerate(self.indexed + self.filtered):
+            access = 'index ' if step < len(self.indexed) else 'filter'
+            line = f'  {step + 1}. {access} {str(predicate):<48} est. {selectivity:>7.2%}'
+            if total is not None:
+                line += f' ({round(selectivity * total):,} replays)'
+            if self.profile and self.evaluated:
+                line += f' | actual {self.passed[step]:,} passed in {self.timings[step] * 1000:.2f} ms'
+            lines.append(line)
+        return '\n'.join(lines)
+
+
+class ReplayQuery:
+    """User-specified criteria for replays, which can be checked one Replay at a time with matches,
+    or evaluated over every row of a ReplayTable at once with ReplayTable.mask, either way through a QueryPlan"""
+    def __init__(self, left_player='', right_player='', role=ROLE_EITHER,
+                 venues=None, results=None, mwc=MWC_EITHER, missions=None, start=None, end=None):
+        """
+        :param
+            left_player, right_player (str): partial player names, either may be empty
+        :param
+            role (str): the role of the right player, the left player being on the other
+        :param
+            venues, results (iterable): names which are allowed, or None to allow all of them
+        :param
+            mwc (str): whether the spy must (MWC_YES) or mustn't (MWC_NO) have reached mission win countdown
+        :param
+            missions (iterable): short mission names (Mission.shortened) which must all have been completed
+        :param
+            start, end (int): timestamps the replays must have been played from and before (see date_bound),
+            either may be None to leave that side of the range open
+        """
+        self.left_player = clean_player_name(left_player)
+        self.right_player = clean_player_name(right_player)
+        self.role = role
+        self.venues = frozenset(venues) if venues else None
+        self.results = frozenset(results) if results else None
+        self.mwc = mwc
+        self.missions = frozenset(missions) if missions else None
+        self.start = start
+        self.end = end
+        self.__plan = None
+
+    def players(self):
+        """(cleaned partial name, role) of each player the replays must contain"""
+        # role_match is only relevant if one or more players are specified
+        if self.left_player and self.right_player:
+            return [(self.right_player, self.role), (self.left_player, opposite_role(self.role))]
+        elif self.right_player:
+            return [(self.right_player, self.role)]
+        elif self.left_player:
+            return [(self.left_player, opposite_role(self.role))]
+        return []
+
+    def predicates(self):
+        """The criteria as Predicates, in no particular order"""
+        predicates = [PlayerPredicate(player, role) for player, role in self.players()]
+        if self.venues is not None:
+            predicates.append(VenuePredicate(self.venues))
+        if self.results is not None:
+            predicates.append(ResultPredicate(self.results))
+        if self.missions is not None:
+            predicates.append(MissionsPredicate(self.missions))
+        if self.mwc in (MWC_YES, MWC_NO):
+            predicates.append(MwcPredicate(self.mwc == MWC_YES))
+        if self.start is not None or self.end is not None:
+            predicates.append(DatePredicate(self.start, self.end))
+        return predicates
+
+    def plan(self, table=None, profile=False):
+        """QueryPlan for this query, estimated from table's statistics if given, or from defaults otherwise"""
+        return QueryPlan(self.predicates(), table, profile)
+
+    def __len__(self):
+        """The number of criteria applied"""
+        return len(self.players()) + sum(criterion is not None for criterion in (
+            self.venues, self.results, self.missions)) + (self.mwc in (MWC_YES, MWC_NO)) + \
+            (self.start is not None or self.end is not None)
+
+    def matches(self, replay, cleaner=clean_player_name):
+        """Whether a single Replay satisfies every criterion
+        :param
+            cleaner (function): cleans a player name, such as a caching Helpers.Cleaner.clean
+        """
+        if self.__plan is None:
+            self.__plan = self.plan()
+        return self.__plan.matches(replay, cleaner)
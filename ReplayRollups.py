@@ -0,0 +1,112 @@
+from collections import Counter
+
+
+class WinRecord:
+    def __init__(self, wins=0, total=0):
+        self.num = wins
+        self.den = total
+
+    def __str__(self):
+        return f'{self.num}/{self.den}'
+
+    def win(self, count=1):
+        self.num += count
+        self.den += count
+
+    def loss(self, count=1):
+        self.den += count
+
+    def __add__(self, other):
+        return WinRecord(self.num + other.num, self.den + other.den) if isinstance(other, WinRecord) else self
+
+    def percentage_string(self):
+        return f'{round(100 * self.num / self.den, 1)}%' if self.den else 'UNDEFINED'
+
+
+class ReplayRollups:
+    """Win records of a set of replays, rolled up by player, role, venue and pairing of players,
+    and kept current as replays are added and removed, so none of them are ever recounted.
+    Only games which ended count towards records, while every game counts towards how often players and venues appear.
+    """
+    ROLE_SNIPER = 1
+    ROLE_SPY = 2
+
+    def __init__(self, replays=()):
+        self.record = {}  # (venue, player, role) -> WinRecord
+        self.player_role_record = {}  # (player, role) -> WinRecord over every venue
+        self.venue_record = {}  # venue -> WinRecord of the spies who played there
+        self.pair_record = {}  # (spy, sniper) -> WinRecord of the spy
+        self.players = Counter()  # player -> games played
+        self.venues = Counter()  # venue -> games played
+        self.player_played_role = Counter()  # (player, role) -> games played, for which roles each player has played
+        for replay in replays:
+            self.add(replay)
+
+    def add(self, replay):
+        self.__count(replay, 1)
+
+    def remove(self, replay):
+        """Take back a replay which was previously added"""
+        self.__count(replay, -1)
+
+    def __count(self, replay, count):
+        spy, sniper, venue = replay.spy, replay.sniper, replay.venue
+        self.__appear(self.players, spy, count)
+        self.__appear(self.players, sniper, count)
+        self.__appear(self.venues, venue, count)
+        self.__appear(self.player_played_role, (sniper, self.ROLE_SNIPER), count)
+        self.__appear(self.player_played_role, (spy, self.ROLE_SPY), count)
+        if replay.spy_win():
+            spy_won = True
+        elif replay.sniper_win():
+            spy_won = False
+        else:  # still in progress
+            return
+        for records, key, won in (
+            (self.record, (venue, spy, self.ROLE_SPY), spy_won),
+            (self.record, (venue, sniper, self.ROLE_SNIPER), not spy_won),
+            (self.player_role_record, (spy, self.ROLE_SPY), spy_won),
+            (self.player_role_record, (sniper, self.ROLE_SNIPER), not spy_won),
+            (self.venue_record, venue, spy_won),
+            (self.pair_record, (spy, sniper), spy_won)
+        ):
+            record = records.setdefault(key, WinRecord())
+            if won:
+                record.win(count)
+            else:
+                record.loss(count)
+            if not record.den:
+                del records[key]
+
+    @staticmethod
+    def __appear(counter, key, count):
+        counter[key] += count
+        if not counter[key]:
+            del counter[key]
+
+    def player_record(self, player, role=None, venue=None):
+        """A player's WinRecord on one role or both, at one venue or all of them, without touching a single replay"""
+        roles = (self.ROLE_SPY, self.ROLE_SNIPER) if role is None else (role,)
+        combined = WinRecord()
+        for each_role in roles:
+            if venue is None:
+                combined += self.player_role_record.get((player, each_role))
+            else:
+                combined += self.record.get((venue, player, each_role))
+        return combined
+
+    def head_to_head(self, player, opponent):
+        """player's WinRecord against opponent, over the games where either was the spy"""
+        as_spy = self.pair_record.get((player, opponent))
+        as_sniper = self.pair_record.get((opponent, player))
+        return WinRecord() + as_spy + (as_sniper and WinRecord(as_sniper.den - as_sniper.num, as_sniper.den))
+
+    def copy(self):
+        """An independent snapshot, which later additions and removals to either won't affect"""
+        snapshot = ReplayRollups()
+        for name in ('record', 'player_role_record', 'venue_record', 'pair_record'):
+            setattr(snapshot, name, {key: record + WinRecord() for key, record in getattr(self, name).items()})
+        snapshot.players = self.players.copy()
+        snapshot.venues = self.venues.copy()
+        snapshot.player_played_role = self.player_played_role.copy()
+        return snapshot
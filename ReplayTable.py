@@ -0,0 +1,144 @@
+import numpy
+from ReplayParser import ReplayParser
+from ReplayQuery import ReplayQuery, clean_player_name
+from PlayerIndex import PlayerIndex
+from TimeIndex import TimeIndex
+
+
+class ReplayTable:
+    """Replays stored column by column, so that a ReplayQuery is evaluated over every row at once
+    as boolean mask operations, instead of calling Python code once per replay."""
+    __VENUE_CODES = {venue: code for code, venue in enumerate(ReplayParser.VENUES)}
+    __RESULT_CODES = {result: code for code, result in enumerate(ReplayParser.RESULTS)}
+    __MISSION_COUNTS = numpy.array([bin(bitmask).count('1') for bitmask in range(256)], numpy.int8)
+
+    def __init__(self, replays):
+        self.replays = list(replays)
+        self.player_index = PlayerIndex()
+        player_ids, setup_codes = {}, {}
+
+        venue, result, setup, spy, sniper, missions_s, missions_p, missions_c = [], [], [], [], [], [], [], []
+        timestamp = []
+        for row, replay in enumerate(self.replays):
+            self.player_index.add(row, replay.spy, replay.sniper)
+            venue.append(self.__VENUE_CODES[replay.venue])
+            result.append(self.__RESULT_CODES[replay.result])
+            setup.append(setup_codes.setdefault(replay.setup, len(setup_codes)))
+            spy.append(player_ids.setdefault(replay.spy, len(player_ids)))
+            sniper.append(player_ids.setdefault(replay.sniper, len(player_ids)))
+            missions_s.append(replay.selected_mask)
+            missions_p.append(replay.picked_mask)
+            missions_c.append(replay.completed_mask)
+            timestamp.append(replay.timestamp)
+        self.venue = numpy.array(venue, numpy.int8)
+        self.result = numpy.array(result, numpy.int8)
+        self.setup = numpy.array(setup, numpy.int16)
+        self.spy = numpy.array(spy, numpy.int32)
+        self.sniper = numpy.array(sniper, numpy.int32)
+        self.selected_missions = numpy.array(missions_s, numpy.uint8)
+        self.picked_missions = numpy.array(missions_p, numpy.uint8)
+        self.completed_missions = numpy.array(missions_c, numpy.uint8)
+        self.timestamp = numpy.array(timestamp, numpy.int64)
+
+        self.players = list(player_ids)  # a player's id is their index, displayed as they were in the replay
+        self.setups = list(setup_codes)  # likewise for setup strings, such as 'a4/7'
+        self.__required = numpy.array([int(setup[1]) for setup in self.setups], numpy.int8)
+        self.__rows = {replay.filepath: row for row, replay in enumerate(self.replays)}
+        self.__statistics = None
+        self.__reached = None
+        self.__cleaned_players = None
+        self.__player_rows = {}  # (partial name, role) -> rows, as a plan may need them for both estimate and lookup
+        self.__time_index = None  # built on the first date range
+
+    def __len__(self):
+        return len(self.replays)
+
+    def rows(self, filepaths):
+        """Mask of the rows holding the given filepaths"""
+        mask = numpy.zeros(len(self.replays), bool)
+        mask[[row for filepath in filepaths if (row := self.__rows.get(filepath)) is not None]] = True
+        return mask
+
+    def row(self, filepath):
+        """The row holding filepath, or None if it isn't in the table"""
+        return self.__rows.get(filepath)
+
+    def player_rows(self, partial_name, role):
+        """Sorted rows where a player matching partial_name played role, found through the player index"""
+        if (rows := self.__player_rows.get((partial_name, role))) is None:
+            if len(self.__player_rows) >= 64:
+                self.__player_rows.clear()
+            rows = self.__player_rows[partial_name, role] = numpy.unique(numpy.fromiter(
+                (row for rows in self.player_index.rows(partial_name, role) for row in rows), numpy.int64))
+        return rows
+
+    def player_count(self, partial_name, role):
+        """Number of rows player_rows would find, counted without gathering them"""
+        return sum(map(len, self.player_index.rows(partial_name, role)))
+
+    def time_rows(self, start, end):
+        """Sorted rows whose timestamp is within [start, end), found through the time index"""
+        return numpy.sort(numpy.array(self.time_index().rows(start, end), numpy.int64))
+
+    def time_count(self, start, end):
+        return self.time_index().count(start, end)
+
+    def time_index(self):
+        if self.__time_index is None:
+            self.__time_index = TimeIndex(self.timestamp.tolist())
+        return self.__time_index
+
+    def player_ids(self, partial_name):
+        """Ids (indices into players) of the players whose cleaned name contains partial_name"""
+        if self.__cleaned_players is None:
+            self.__cleaned_players = [clean_player_name(player) for player in self.players]
+        return [player_id for player_id, name in enumerate(self.__cleaned_players) if partial_name in name]
+
+    def player_allowed(self, player_ids):
+        """Lookup array from a player id to whether it's among player_ids"""
+        allowed = numpy.zeros(len(self.players), bool)
+        allowed[player_ids] = True
+        return allowed
+
+    @staticmethod
+    def venue_allowed(codes):
+        """Lookup array from a venue code to whether it's among codes"""
+        allowed = numpy.zeros(len(ReplayParser.VENUES), bool)
+        allowed[codes] = True
+        return allowed
+
+    @staticmethod
+    def result_allowed(codes):
+        allowed = numpy.zeros(len(ReplayParser.RESULTS), bool)
+        allowed[codes] = True
+        return allowed
+
+    def reached_mwc(self):
+        """Whether each row's spy completed at least as many missions as their setup required"""
+        if self.__reached is None:
+            self.__reached = self.__MISSION_COUNTS[self.completed_missions] >= self.__required[self.setup]
+        return self.__reached
+
+    def statistics(self):
+        """Counts of rows by venue code, by result code, by completed missions bitmask, and of rows reaching MWC,
+        which a QueryPlan estimates selectivity from"""
+        if self.__statistics is None:
+            self.__statistics = {
+                'venue': numpy.bincount(self.venue, minlength=len(ReplayParser.VENUES)),
+                'result': numpy.bincount(self.result, minlength=len(ReplayParser.RESULTS)),
+                'completed': numpy.bincount(self.completed_missions, minlength=256),
+                'reached': int(self.reached_mwc().sum()),
+            }
+        return self.__statistics
+
+    def mask(self, query: ReplayQuery, plan=None):
+        """Mask of the rows which satisfy every criterion of query
+        :param
+            plan (QueryPlan): how to evaluate query, such as one being profiled; planned against this table if None
+        """
+        return (plan or query.plan(self)).mask(self)
+
+    def select(self, mask):
+        """The Replays of the rows in mask"""
+        replays = self.replays
+        return [replays[row] for row in numpy.flatnonzero(mask).tolist()]
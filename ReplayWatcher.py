@@ -0,0 +1,148 @@
+from os import scandir, stat
+from threading import Thread, Event, RLock
+
+
+class ReplayWatcher:
+    """Keeps a ReplayIndex current with a set of directories by polling their modification times in the background.
+    A directory's mtime changes whenever an entry is added to or removed from it, so each poll only costs a stat
+    per directory, and only the directories which changed are listed again, and only their new or rewritten replays
+    parsed."""
+
+    def __init__(self, index, interval=5, workers=1, on_change=None):
+        """
+        :param
+            index (ReplayIndex): index which new replays are added to, and removed replays dropped from
+        :param
+            interval (float): seconds between polls
+        :param
+            on_change (function): called with the number of indexed replays, after a poll which changed the index
+        """
+        self.index = index
+        self.interval = interval
+        self.__workers = workers
+        self.__on_change = on_change
+        self.__roots = set()
+        self.__listed = {}  # directory -> (mtime_ns, replay filepaths, subdirectories) when it was last listed
+        self.__unparsed = set()  # replays which couldn't be parsed, likely because SpyParty was still writing them
+        self.__poll_lock = RLock()
+        self.__wake = Event()
+        self.__stopped = Event()
+        self.__thread = None
+
+    def watch(self, directories):
+        """Replace the watched directories, which are synced on the next poll"""
+        with self.__poll_lock:
+            self.__roots = {str(directory) for directory in directories}
+        self.__wake.set()
+
+    def start(self):
+        if self.__thread is None:
+            self.__thread = Thread(target=self.__run, daemon=True)
+            self.__thread.start()
+
+    def stop(self):
+        self.__stopped.set()
+        self.__wake.set()
+
+    def __run(self):
+        while not self.__stopped.is_set():
+            try:
+                self.poll()
+            except Exception as e:  # the watcher is only a convenience, a full scan still works without it
+                print("ERROR WHILE WATCHING REPLAYS:", e)
+            self.__wake.wait(self.interval)
+            self.__wake.clear()
+
+    def is_synced(self, directories):
+        """Whether every one of directories is watched and has been listed at least once"""
+        return all(str(directory) in self.__roots and str(directory) in self.__listed for directory in directories)
+
+    def replays(self, directories):
+        """Filepaths of the replays beneath directories as of the last poll, which must have synced them"""
+        found = []
+        pending = [str(directory) for directory in directories]
+        with self.__poll_lock:
+            while pending:
+                _, filepaths, subdirectories = self.__listed[pending.pop()]
+                found.extend(filepaths)
+                pending.extend(subdirectories)
+        return found
+
+    @staticmethod
+    def __list(directory):
+        """(replay filepaths, subdirectories) directly within directory, by the same rules as scan_replays"""
+        filepaths, subdirectories = set(), []
+        try:
+            with scandir(directory) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        if not entry.name.startswith("__"):
+                            subdirectories.append(entry.path)
+                    elif entry.name.endswith(".replay") and len(entry.path) <= 255:
+                        filepaths.add(entry.path)
+        except OSError:
+            pass
+        return filepaths, subdirectories
+
+    def poll(self):
+        """Relist the watched directories whose mtime has changed, and bring the index up to date with them.
+        :returns: whether the index changed
+        """
+        with self.__poll_lock:
+            listed, removed, synced = [], [], []
+            seen = set()
+            previous = dict(self.__listed)  # put back if the index can't be brought up to date with the relisting
+            pending = list(self.__roots)
+            while pending:
+                directory = pending.pop()
+                seen.add(directory)
+                known = self.__listed.get(directory)
+                try:
+                    mtime = stat(directory).st_mtime_ns
+                except OSError:
+                    mtime = None
+                if known is not None and known[0] == mtime:
+                    pending.extend(known[2])
+                    continue
+                if directory in self.__roots and known is None:
+                    synced.append(directory)
+                # the mtime is taken before listing, so anything added during the listing is caught next poll
+                filepaths, subdirectories = self.__list(directory) if mtime is not None else (set(), [])
+                if known is not None:
+                    removed.extend(known[1] - filepaths)
+                    for deleted in set(known[2]).difference(subdirectories):
+                        removed.extend(self.replays([deleted]))
+                # all of them, not just those new to the listing, so that a replay written over another is re-parsed;
+                # the index only has to stat those it already holds
+                listed.extend(filepaths)
+                self.__listed[directory] = mtime, filepaths, subdirectories
+                pending.extend(subdirectories)
+            for directory in set(self.__listed) - seen:  # deleted, or no longer beneath a watched directory
+                del self.__listed[directory]
+
+            retried = self.__unparsed.difference(removed)
+            self.__unparsed.clear()
+            index = self.index
+            with index.lock:
+                before = index.revision
+                try:
+                    for filepath, parsed in index.update(listed + list(retried.difference(listed)), self.__workers):
+                        if isinstance(parsed, Exception):
+                            self.__unparsed.add(filepath)
+                    for root in synced:  # a root's first listing is complete, so anything else beneath it is gone
+                        index.prune(root, self.replays([root]))
+                    index.remove(removed)
+                except Exception:
+                    # otherwise the directories' mtimes would pass them over, leaving the index behind until they change
+                    self.__listed = previous
+                    self.__unparsed |= retried
+                    raise
+                finally:
+                    changed = index.revision != before  # including replays replaced or re-parsed, and quarantines
+                    if changed:
+                        index.save()
+                        index.table()  # rebuild now, rather than when the next query is waiting on it
+                indexed = len(index)
+        if changed and self.__on_change is not None:
+            self.__on_change(indexed)
+        return changed
@@ -0,0 +1,162 @@
+import json
+from contextlib import contextmanager
+from datetime import datetime
+from math import frexp
+from os import replace
+from pathlib import Path
+from threading import Lock
+from time import perf_counter
+
+# the stages of a scan, in the order a replay passes through them
+STAGE_FIND = 'find'  # walking directories for .replay files
+STAGE_READ = 'read'  # reading headers off the disk
+STAGE_DECODE = 'decode'  # decoding headers into Replays
+STAGE_CRITERIA = 'criteria'  # evaluating the query, over a table or one replay at a time
+STAGE_DASHBOARD = 'dashboard'  # aggregating and showing the results
+STAGES = (STAGE_FIND, STAGE_READ, STAGE_DECODE, STAGE_CRITERIA, STAGE_DASHBOARD)
+
+COUNTER_FILES = 'files seen'
+COUNTER_CACHED = 'already indexed'
+COUNTER_SKIPPED = 'older than the query'
+COUNTER_QUARANTINED = 'quarantined'
+COUNTER_PARSED = 'parsed'
+COUNTER_FAILURES = 'parse failures'
+COUNTER_BYTES = 'bytes read'
+COUNTER_MATCHED = 'matched'
+
+
+class ScanMetrics:
+    """Counters and per-stage timing histograms of one scan, safe to record into from any thread.
+    Parsing processes record into their own ScanMetrics, whose snapshots are merged back, so a stage's time is
+    summed across every process working on it, and may be more than the scan took."""
+    class Histogram:
+        """Durations counted into buckets by powers of two, where bucket b holds those up to 2 ** b seconds"""
+        __slots__ = ('count', 'seconds', 'minimum', 'maximum', 'buckets')
+        FLOOR = -20  # about a microsecond, beneath which durations are all counted together
+
+        def __init__(self):
+            self.count = 0
+            self.seconds = 0.0
+            self.minimum = None
+            self.maximum = None
+            self.buckets = {}
+
+        def add(self, seconds):
+            self.count += 1
+            self.seconds += seconds
+            self.minimum = seconds if self.minimum is None else min(self.minimum, seconds)
+            self.maximum = seconds if self.maximum is None else max(self.maximum, seconds)
+            bucket = self.FLOOR if seconds <= 0 else max(frexp(seconds)[1], self.FLOOR)  # frexp(0) is (0.0, 0)
+            self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+
+        def merge(self, snapshot):
+            self.count += snapshot['count']
+            self.seconds += snapshot['seconds']
+            for extreme, pick in (('minimum', min), ('maximum', max)):
+                if (theirs := snapshot[extreme]) is not None:
+                    ours = getattr(self, extreme)
+                    setattr(self, extreme, theirs if ours is None else pick(ours, theirs))
+            for bucket, count in snapshot['buckets'].items():
+                self.buckets[int(bucket)] = self.buckets.get(int(bucket), 0) + count
+
+        def snapshot(self):
+            return {'count': self.count, 'seconds': self.seconds, 'minimum': self.minimum, 'maximum': self.maximum,
+                    'buckets': {bucket: self.buckets[bucket] for bucket in sorted(self.buckets)}}
+
+    def __init__(self):
+        self.counters = {}
+        self.stages = {}  # stage -> Histogram
+        self.started = datetime.now()
+        self.__start = perf_counter()
+        self.__lock = Lock()
+
+    def count(self, counter, amount=1):
+        with self.__lock:
+            self.counters[counter] = self.counters.get(counter, 0) + amount
+
+    def record(self, stage, seconds):
+        """Add one duration to stage's histogram"""
+        with self.__lock:
+            if (histogram := self.stages.get(stage)) is None:
+                histogram = self.stages[stage] = ScanMetrics.Histogram()
+            histogram.add(seconds)
+
+    @contextmanager
+    def stage(self, stage):
+        """Time the body of a with statement as one duration of stage"""
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, perf_counter() - start)
+
+    def timed(self, iterable, stage):
+        """Generator of iterable's items, timing how long each took to produce as a duration of stage,
+        such as the directory walk which discovers replays while they are being parsed"""
+        iterator = iter(iterable)
+        while True:
+            start = perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            self.record(stage, perf_counter() - start)
+            yield item
+
+    def snapshot(self):
+        """Everything recorded so far, as plain data which pickles and serializes to JSON"""
+        with self.__lock:
+            return {'counters': dict(self.counters),
+                    'stages': {stage: histogram.snapshot() for stage, histogram in self.stages.items()}}
+
+    def merge(self, snapshot):
+        """Add in a snapshot, such as one a parsing process recorded"""
+        with self.__lock:
+            for counter, amount in snapshot['counters'].items():
+                self.counters[counter] = self.counters.get(counter, 0) + amount
+            for stage, histogram in snapshot['stages'].items():
+                if (ours := self.stages.get(stage)) is None:
+                    ours = self.stages[stage] = ScanMetrics.Histogram()
+                ours.merge(histogram)
+
+    def summary(self):
+        """One line of where the time went, and what was found along the way, short enough for a status bar"""
+        snapshot = self.snapshot()
+        order = sorted(snapshot['stages'], key=lambda stage: STAGES.index(stage) if stage in STAGES else len(STAGES))
+        stages = [f'{stage} {snapshot["stages"][stage]["seconds"]:.2f}s' for stage in order]
+        counters = snapshot['counters']
+        found = [f'{counters.get(COUNTER_FILES, 0):,} files', f'{counters.get(COUNTER_BYTES, 0) / 2 ** 20:.1f} MB read']
+        if failures := counters.get(COUNTER_FAILURES, 0) + counters.get(COUNTER_QUARANTINED, 0):
+            found.append(f'{failures:,} unparseable')
+        return f'{", ".join(stages)} | {", ".join(found)}'
+
+    def save(self, report_path, **details):
+        """Write everything recorded to report_path as JSON, with the time taken and any details given,
+        such as the query's plan"""
+        report = {'started': self.started.isoformat(timespec='seconds'), 'elapsed': perf_counter() - self.__start,
+                  **details, **self.snapshot()}
+        temporary = Path(report_path).with_suffix('.tmp')
+        try:
+            with open(temporary, 'w', encoding='utf-8') as f:
+                json.dump(report, f, indent=4)
+            replace(temporary, report_path)
+        except OSError as e:  # the report is only for looking into a slow query, so don't fail the query over it
+            print("ERROR WHILE WRITING SCAN METRICS:", e)
+
+    @staticmethod
+    @contextmanager
+    def profiled(profile_path=None):
+        """Run the body of a with statement under cProfile, dumping its stats to profile_path for pstats or
+        snakeviz, or run it as it is if profile_path is None. Only the thread which entered it is profiled."""
+        if profile_path is None:
+            yield
+            return
+        from cProfile import Profile  # only needed when profiling was asked for
+
+        profile = Profile()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            profile.dump_stats(profile_path)
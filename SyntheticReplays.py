@@ -0,0 +1,110 @@
+from struct import pack_into
+from random import Random
+from os import makedirs, path
+
+# Written independently of ReplayParser's tables, so that parsing these headers actually checks the parser.
+# version: (players, result, setup, venue, variant, selected missions, guests, clock, display name lengths?)
+__LAYOUTS = {
+    2: (0x50, 0x30, 0x34, 0x38, None, 0x3C, None, None, False),
+    3: (0x50, 0x30, 0x34, 0x38, None, 0x3C, None, None, False),
+    4: (0x54, 0x34, 0x38, 0x3C, None, 0x40, None, None, False),
+    5: (0x60, 0x38, 0x3C, 0x40, None, 0x44, 0x50, 0x54, True),
+    6: (0x64, 0x38, 0x3C, 0x40, 0x44, 0x48, 0x54, 0x58, True),
+}
+FILE_VERSIONS = tuple(__LAYOUTS)
+HEADER_BYTES = 416
+
+VENUE_CODES = {
+    "Aquarium": 0x98E45D99,
+    "Balcony": 0x1DBD8E41,
+    "Ballroom": 0x5996FAAA,
+    "Courtyard": 0x9DC5BB5E,
+    "Gallery": 0x7173B8BF,
+    "High-rise": 0x3A30C326,
+    "Library": 0x168F4F62,
+    "Moderne": 0x2E37F15B,
+    "Old Balcony": 0xB8891FBC,
+    "Old Ballroom": 0x09C2E7B0,
+    "Old Courtyard": 0xB4CF686B,
+    "Old Gallery": 0x28B3AA5E,
+    "Old High-rise": 0x8802482A,
+    "Old Veranda": 0xA8BEA091,
+    "Panopticon": 0x3695F583,
+    "Pub": 0x3B85FFF3,
+    "Redwoods": 0x35AC5135,
+    "Teien": 0x79DFA0CF,
+    "Terrace": 0x9032CE22,
+    "Veranda": 0x6F81A558,
+}
+VARIANT_COUNTS = {"Teien": 8, "Aquarium": 2}
+SETUP_MODES = (0, 1, 2)  # known, pick, any
+
+
+def synthetic_header(
+        version=6, spy_username='spy', sniper_username='sniper', spy_display='', sniper_display='',
+        venue='Ballroom', variant=0, result=0, mode=2, required=4, available=7, timestamp=1600000000,
+        duration=180.0, guests=21, clock=210, selected=0xFF, picked=0, completed=0, spyparty_version=6120,
+        uuid=bytes(range(16)), playid=1
+):
+    """Bytes of a .replay header describing the given game, as SpyParty would have written it"""
+    players, o_result, o_setup, o_venue, o_variant, o_missions, o_guests, o_clock, display = __LAYOUTS[version]
+    names = [name.encode() for name in (spy_username, sniper_username)]
+    if display:
+        names += [name.encode() for name in (spy_display, sniper_display)]
+    header = bytearray(max(HEADER_BYTES, players + sum(map(len, names))))
+    header[0x00:0x04] = b'RPLY'
+    pack_into('<I', header, 0x04, version)
+    pack_into('<I', header, 0x0C, spyparty_version)
+    pack_into('<f', header, 0x14, duration)
+    header[0x18:0x28] = uuid
+    pack_into('<IH', header, 0x28, timestamp, playid)
+    for i, name in enumerate(names):
+        header[0x2E + i] = len(name)
+    pack_into('<I', header, o_result, result)
+    pack_into('<I', header, o_setup, (mode << 28) | (available << 14) | required)
+    pack_into('<I', header, o_venue, VENUE_CODES[venue])
+    pack_into('<III', header, o_missions, selected, picked, completed)
+    if o_variant is not None:
+        pack_into('<I', header, o_variant, variant)
+    if o_guests is not None:
+        pack_into('<I', header, o_guests, guests)
+        pack_into('<I', header, o_clock, clock)
+    header[players:players + sum(map(len, names))] = b''.join(names)
+    return bytes(header)
+
+
+def random_header(rng: Random, players=200, version=None):
+    """A synthetic header with randomized players, venue, variant, setup and result"""
+    venue = rng.choice(tuple(VENUE_CODES))
+    required = rng.randint(1, 5)
+    spy, sniper = rng.sample(range(players), 2)
+    return synthetic_header(
+        version=version or rng.choice(FILE_VERSIONS),
+        spy_username=f'player{spy}' + 'x' * rng.randint(0, 20),
+        sniper_username=f'player{sniper}',
+        spy_display=rng.choice(('', f'Display Name {spy}/steam', f'Ünïcödé {spy}' + '!' * rng.randint(0, 60))),
+        sniper_display=rng.choice(('', f'Sniper {sniper}')),
+        venue=venue, variant=rng.randrange(VARIANT_COUNTS.get(venue, 1)), result=rng.randint(0, 3),
+        mode=rng.choice(SETUP_MODES), required=required, available=required + rng.randint(0, 3),
+        timestamp=rng.randint(1400000000, 1650000000), duration=rng.uniform(30, 600),
+        selected=rng.getrandbits(8), picked=rng.getrandbits(8), completed=rng.getrandbits(8),
+        spyparty_version=rng.choice((6000, 6120)),
+        uuid=rng.getrandbits(128).to_bytes(16, 'little'), playid=rng.getrandbits(16)
+    )
+
+
+def write_library(directory, count, seed=0, per_folder=1000, version=None):
+    """Write count random .replay files beneath directory, spread across subfolders like SpyParty's own
+    :returns: list of the written filepaths
+    """
+    rng = Random(seed)
+    filepaths = []
+    for i in range(count):
+        folder = path.join(directory, f'{i // per_folder:04d}')
+        if i % per_folder == 0:
+            makedirs(folder, exist_ok=True)
+        filepath = path.join(folder, f'{i:07d}.replay')
+        with open(filepath, 'wb') as f:
+            f.write(random_header(rng, version=version))
+        filepaths.append(filepath)
+    return filepaths
@@ -0,0 +1,37 @@
+from os import stat, replace
+from pathlib import Path
+from tkinter import PhotoImage
+
+
+class ThumbnailCache:
+    """Resized colour and greyscale copies of images, kept on disk so that they're only made (with PIL) once,
+    and afterwards load straight into Tk. Each copy is named after its source's mtime, so an image which has been
+    replaced is made again rather than served stale."""
+    def __init__(self, directory):
+        self.directory = Path(directory)
+        self.created = 0  # thumbnails which weren't cached, since this was made
+
+    def __paths(self, source, size):
+        prefix = f'{Path(source).stem}-{size[0]}x{size[1]}-'
+        stem = f'{prefix}{stat(source).st_mtime_ns}'
+        return prefix, self.directory / f'{stem}-grey.png', self.directory / f'{stem}-color.png'
+
+    def thumbnails(self, source, size, master):
+        """(greyscale, colour) PhotoImages of source resized to size, for the Tk window master"""
+        prefix, grey, color = self.__paths(source, size)
+        if not (grey.exists() and color.exists()):
+            self.__create(source, size, prefix, grey, color)
+        return PhotoImage(master=master, file=grey), PhotoImage(master=master, file=color)
+
+    def __create(self, source, size, prefix, grey, color):
+        from PIL import Image  # only needed when a thumbnail isn't cached yet
+
+        self.directory.mkdir(exist_ok=True)
+        for stale in self.directory.glob(f'{prefix}*.png'):  # thumbnails of a previous version of source
+            stale.unlink()
+        normal = Image.open(source).resize(size, Image.ANTIALIAS)
+        for image, path in ((normal, color), (normal.convert('LA'), grey)):
+            temporary = path.with_suffix('.tmp')
+            image.save(temporary, format='PNG')
+            replace(temporary, path)  # never leave a half-written thumbnail behind
+        self.created += 1
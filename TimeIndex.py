@@ -0,0 +1,53 @@
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
+from time import gmtime
+
+
+def month_of(timestamp):
+    """Months since year 0 of a timestamp, in UTC, which is all that partitioning needs to be consistent"""
+    when = gmtime(timestamp)
+    return when.tm_year * 12 + when.tm_mon - 1
+
+
+class TimeIndex:
+    """Rows (of a ReplayTable) sorted by timestamp and partitioned by month, so that a date range only touches the
+    months it overlaps: those wholly within it are taken whole, and only the months at its ends are bisected.
+    Months outside the range, such as every old replay for a recent-only query, aren't looked at at all."""
+    def __init__(self, timestamps):
+        """
+        :param
+            timestamps (iterable): the timestamp of each row, in row order
+        """
+        partitions = defaultdict(list)
+        for row, timestamp in enumerate(timestamps):
+            partitions[month_of(timestamp)].append((timestamp, row))
+        self.months = sorted(partitions)
+        self.__partitions = []  # (sorted timestamps, their rows) of each month, in the same order as months
+        for month in self.months:
+            pairs = sorted(partitions[month])
+            self.__partitions.append(([timestamp for timestamp, _ in pairs], [row for _, row in pairs]))
+
+    def __len__(self):
+        return sum(len(timestamps) for timestamps, _ in self.__partitions)
+
+    def __slices(self, start, end):
+        """(rows, low, high) of each month overlapping [start, end), where rows[low:high] are within it"""
+        first = 0 if start is None else bisect_left(self.months, month_of(start))
+        last = len(self.months) if end is None else bisect_right(self.months, month_of(end))
+        for timestamps, rows in self.__partitions[first:last]:
+            low = 0 if start is None or timestamps[0] >= start else bisect_left(timestamps, start)
+            high = len(timestamps) if end is None or timestamps[-1] < end else bisect_left(timestamps, end)
+            yield rows, low, high
+
+    def rows(self, start=None, end=None):
+        """Rows whose timestamp is within [start, end), either of which may be None to leave that side open
+        :returns: list of rows, in timestamp order
+        """
+        found = []
+        for rows, low, high in self.__slices(start, end):
+            found.extend(rows[low:high])
+        return found
+
+    def count(self, start=None, end=None):
+        """Number of rows which rows would find, counted without gathering them"""
+        return sum(high - low for _, low, high in self.__slices(start, end))